@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks of the loader hot paths, run offline over fixed synthetic inputs.
+
+Run with "python -m benchmarks" from the repository root.
+"""
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Script for running the loader microbenchmarks and comparing them to a saved baseline."""
+import sys
+import tempfile
+from argparse import ArgumentParser
+from benchmarks import cases  # noqa: F401 pylint: disable=unused-import
+from benchmarks.harness import benchmarks, compare, measure, read_baseline, write_baseline
+
+
+def command_parser():
+    """Parse the command line arguments."""
+    parser = ArgumentParser(
+        description="Measures the throughput and allocations of the loader hot paths over synthetic inputs.",
+    )
+
+    parser.add_argument(
+        "-k",
+        "--filter",
+        type=str,
+        help="Only run benchmarks whose name contains this string.",
+    )
+
+    parser.add_argument(
+        "-n",
+        "--rows",
+        type=int,
+        default=5000,
+        help="Number of synthetic input rows per benchmark. (default: 5000)",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of timed rounds, of which the fastest is reported. (default: 5)",
+    )
+
+    parser.add_argument(
+        "--min_time",
+        type=float,
+        default=0.2,
+        help="Minimum duration of a timed round in seconds. (default: 0.2)",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        type=str,
+        default=".benchmarks/baseline.json",
+        help="Baseline file to compare against. (default: \".benchmarks/baseline.json\")",
+    )
+
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Save the results as the new baseline.",
+    )
+
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown or allocation increase reported as a regression. (default: 0.1)",
+    )
+
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Exit with status 1 if any benchmark regressed against the baseline.",
+    )
+
+    return parser
+
+
+def format_ratio(ratio):
+    return "" if ratio is None else "{:+.1%}".format(ratio - 1)
+
+
+if __name__ == "__main__":
+    args = command_parser().parse_args()
+    baseline = read_baseline(args.baseline)
+
+    if baseline is not None and baseline["rows"] != args.rows:
+        print("Ignoring baseline measured with {} rows.".format(baseline["rows"]))
+        baseline = None
+
+    results = dict()
+    regressions = list()
+
+    print("{:<36} {:>8} {:>14} {:>10} {:>14} {:>10}".format(
+        "benchmark", "rows", "rows/s", "change", "alloc B/row", "change",
+    ))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for bench in benchmarks:
+            if args.filter is not None and args.filter not in bench.name:
+                continue
+
+            result = measure(bench, args.rows, directory, args.repeat, args.min_time)
+            results[bench.name] = result
+            baseline_result = baseline["results"].get(bench.name) if baseline is not None else None
+            speed, allocations = compare(result, baseline_result)
+
+            if (speed is not None and speed < 1 - args.threshold) or (
+                allocations is not None and allocations > 1 + args.threshold
+            ):
+                regressions.append(bench.name)
+
+            print("{:<36} {:>8} {:>14,.0f} {:>10} {:>14,.0f} {:>10}".format(
+                bench.name,
+                result["rows"],
+                result["rows_per_second"] or 0,
+                format_ratio(speed),
+                result["allocated_bytes_per_row"] or 0,
+                format_ratio(allocations),
+            ))
+
+    if len(regressions) > 0:
+        print("Regressed against the baseline: {}".format(", ".join(regressions)))
+
+    if args.save:
+        write_baseline(args.baseline, results, args.rows)
+        print("Baseline saved to: {}".format(args.baseline))
+
+    if args.check and len(regressions) > 0:
+        sys.exit(1)
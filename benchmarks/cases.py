@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Register the benchmarks of the loader hot paths."""
+from collections import deque
+from functools import partial
+from benchmarks import data
+from benchmarks.harness import benchmark
+from loader.coronavirus import coronavirus_loader
+from loader.dgidb import dgidb_loader
+from loader.disgenet import disgenet_loader
+from loader.hpa import hpa_loader
+from loader.reactome import reactome_loader
+from loader.semmed import load as semmed_load
+from loader.semmed.mapper import relationship_mapper
+from loader.semmed.parse import get_publication_data
+from loader.tissuenet import tissuenet_loader
+from loader.uniprot import uniprot_loader
+from loader.util import clean_string, read_tsv
+
+
+def consume(iterator):
+    deque(iterator, maxlen=0)
+
+
+def register_read_tsv(archive):
+    @benchmark("util.read_tsv[{}]".format(archive or "plain"))
+    def setup(num_rows, directory):
+        path = data.write_tsv_files(directory, num_rows)[archive]
+        return partial(read_tsv, path, archive=archive), num_rows
+
+
+for archive in (None, "gz", "zip"):
+    register_read_tsv(archive)
+
+
+@benchmark("util.clean_string")
+def setup_clean_string(num_rows, directory):
+    strings = data.get_raw_strings(num_rows)
+    return lambda: [clean_string(string) for string in strings], num_rows
+
+
+@benchmark("uniprot.extract_protein_names")
+def setup_extract_protein_names(num_rows, directory):
+    names = [row["protein-name"] for row in data.get_uniprot_dataset(num_rows)]
+    return lambda: [uniprot_loader.extract_protein_names(name) for name in names], num_rows
+
+
+@benchmark("uniprot.extract_gene_entry")
+def setup_extract_gene_entry(num_rows, directory):
+    dataset = [row for row in data.get_uniprot_dataset(num_rows) if row["gene-symbol"] != ""]
+    return lambda: [uniprot_loader.extract_gene_entry(row) for row in dataset], len(dataset)
+
+
+@benchmark("uniprot.extract_transcript_entries")
+def setup_extract_transcript_entries(num_rows, directory):
+    dataset = data.get_uniprot_dataset(num_rows)
+    return lambda: [uniprot_loader.extract_transcript_entries(row) for row in dataset], num_rows
+
+
+@benchmark("uniprot.get_protein_record")
+def setup_get_protein_record(num_rows, directory):
+    dataset = data.get_uniprot_dataset(num_rows)
+    return lambda: [uniprot_loader.get_protein_record(row) for row in dataset], num_rows
+
+
+@benchmark("semmed.get_publication_data")
+def setup_get_publication_data(num_rows, directory):
+    publications = data.get_publications(num_rows)
+    return partial(get_publication_data, publications), num_rows
+
+
+@benchmark("semmed.relationship_mapper")
+def setup_relationship_mapper(num_rows, directory):
+    predicates = list(data.get_semmed_relations(num_rows)["predicate"])
+    return lambda: [relationship_mapper(predicate) for predicate in predicates], num_rows
+
+
+def register_queries(name, generate, get_dataset):
+    """Register a benchmark consuming the queries generated from a synthetic dataset."""
+    @benchmark("queries.{}".format(name))
+    def setup(num_rows, directory):
+        dataset = get_dataset(num_rows)
+        return partial(consume_queries, generate, dataset), len(dataset)
+
+
+def consume_queries(generate, dataset):
+    consume(generate(dataset))
+
+
+def iter_cobatched_protein_queries(dataset):
+    return uniprot_loader.iter_transcript_protein_queries(uniprot_loader.group_transcript_proteins(dataset))
+
+
+def iter_cobatched_expression_queries(dataset):
+    return hpa_loader.iter_grouped_gene_tissue_queries(hpa_loader.group_gene_tissue(dataset))
+
+
+def iter_organism_queries(dataset):
+    return uniprot_loader.iter_organism_queries(uniprot_loader.get_organism_names(dataset))
+
+
+def iter_roleplayer_queries(dataset):
+    return coronavirus_loader.iter_extra_roleplayer_queries(*coronavirus_loader.get_extra_roleplayer_names(dataset))
+
+
+def get_protein_records(num_rows):
+    return [uniprot_loader.get_protein_record(row) for row in data.get_uniprot_dataset(num_rows)]
+
+
+def get_publication_dataset(num_rows):
+    return get_publication_data(data.get_publications(num_rows))
+
+
+def get_journal_names(num_rows):
+    return sorted({row["journal-name"] for row in get_publication_dataset(num_rows) if "journal-name" in row})
+
+
+def get_author_names(num_rows):
+    return sorted({author for row in get_publication_dataset(num_rows) for author in row["authors"]})
+
+
+for name, generate, get_dataset in [
+    ("uniprot.organisms", iter_organism_queries, get_protein_records),
+    ("uniprot.genes", uniprot_loader.iter_gene_queries, get_protein_records),
+    ("uniprot.transcripts", uniprot_loader.iter_transcript_queries, get_protein_records),
+    ("uniprot.proteins", uniprot_loader.iter_protein_queries, get_protein_records),
+    ("uniprot.transcripts-proteins", iter_cobatched_protein_queries, get_protein_records),
+    ("coronavirus.roleplayers", iter_roleplayer_queries, data.get_virus_dataset),
+    ("coronavirus.viruses", coronavirus_loader.iter_virus_queries, data.get_virus_dataset),
+    ("reactome.pathways", reactome_loader.iter_pathway_queries, data.get_reactome_dataset),
+    ("reactome.participations", reactome_loader.iter_pathway_interaction_queries, data.get_reactome_dataset),
+    ("disgenet.diseases", disgenet_loader.iter_disease_queries, data.get_disgenet_dataset),
+    ("disgenet.associations", disgenet_loader.iter_association_queries, data.get_disgenet_dataset),
+    ("dgidb.drugs", dgidb_loader.iter_drug_queries, data.get_drug_dataset),
+    ("dgidb.interactions", dgidb_loader.iter_interaction_queries, data.get_drug_interaction_dataset),
+    ("hpa.tissues", hpa_loader.iter_tissue_queries, data.get_tissue_dataset),
+    ("hpa.gene-ids", hpa_loader.iter_ensemble_id_queries, data.get_tissue_dataset),
+    ("hpa.expressions", hpa_loader.iter_gene_tissue_queries, data.get_tissue_dataset),
+    ("hpa.expressions[cobatch]", iter_cobatched_expression_queries, data.get_tissue_dataset),
+    ("tissuenet.interactions", tissuenet_loader.iter_interaction_queries, data.get_tissuenet_dataset),
+    ("tissuenet.contexts", tissuenet_loader.iter_context_queries, data.get_tissuenet_dataset),
+    ("semmed.journals", semmed_load.iter_journal_queries, get_journal_names),
+    ("semmed.authors", semmed_load.iter_author_queries, get_author_names),
+    ("semmed.publications", semmed_load.iter_publication_queries, get_publication_dataset),
+    ("semmed.gene-relations", semmed_load.iter_gene_relation_queries, data.get_semmed_relations),
+    ("semmed.mentions", semmed_load.iter_gene_mention_queries, data.get_semmed_relations),
+]:
+    register_queries(name, generate, get_dataset)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""Define fixed synthetic inputs for the loader benchmarks.
+
+Every generator is seeded, so a given number of rows always produces the same input.
+"""
+import csv
+import gzip
+import os
+import random
+from zipfile import ZIP_DEFLATED, ZipFile
+import pandas
+from loader.disgenet.disgenet_loader import ASSOCIATION_FIELDS
+from loader.hpa.hpa_loader import TISSUE_CATEGORICAL, TISSUE_FIELDS
+from loader.rows import record_type
+
+
+PREDICATES = [
+    "INHIBITS",
+    "INTERACTS_WITH",
+    "COEXISTS_WITH",
+    "STIMULATES",
+    "PRODUCES",
+    "NEG_INHIBITS",
+    "NEG_INTERACTS_WITH",
+    "ASSOCIATED_WITH",
+    "AFFECTS",
+    "PART_OF",
+]
+
+EXPRESSION_VALUES = ["Low", "Medium", "High"]
+RELIABILITIES = ["Enhanced", "Supported", "Approved", "Uncertain"]
+
+
+def word(rng, length=8):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(length))
+
+
+def gene_symbol(rng, num_genes):
+    return "GENE{}".format(rng.randrange(num_genes))
+
+
+def protein_name(rng):
+    name = "{} {} protein".format(word(rng).capitalize(), word(rng, 5))
+
+    for _ in range(rng.randrange(4)):
+        name += " ({} {})".format(word(rng).capitalize(), rng.randrange(1, 99))
+
+    if rng.random() < 0.2:
+        name += " (EC {}.{}.{}.{})".format(*(rng.randrange(1, 20) for _ in range(4)))
+
+    if rng.random() < 0.1:
+        name += " [Cleaved into: {} chain ({}); {} peptide]".format(word(rng), word(rng, 4), word(rng))
+
+    return name
+
+
+def get_uniprot_dataset(num_rows, seed=0):
+    """Return rows shaped as the output of uniprot_loader.read_uniprot_dataset."""
+    rng = random.Random(seed)
+    num_genes = max(1, num_rows // 4)
+    dataset = list()
+
+    for i in range(num_rows):
+        transcripts = ";".join(
+            "ENST{:011d}.{} [P{}-{}]".format(rng.randrange(10 ** 8), rng.randrange(1, 9), i, j)
+            for j in range(rng.randrange(4))
+        )
+
+        dataset.append({
+            "uniprot-id": "P{:05d}".format(i),
+            "uniprot-entry-name": "{}_HUMAN".format(word(rng, 5).upper()),
+            "protein-name": protein_name(rng),
+            "gene-symbol": " ".join(gene_symbol(rng, num_genes) for _ in range(rng.randrange(4))),
+            "organism": "Homo sapiens (Human)" if rng.random() < 0.9 else "Mus musculus (Mouse)",
+            "function-description": "FUNCTION: {}.".format(" ".join(word(rng) for _ in range(20))),
+            "ensembl-transcript": transcripts + ";" if transcripts else "",
+            "entrez-id": ";".join(str(rng.randrange(10 ** 6)) for _ in range(rng.randrange(3))),
+        })
+
+    return dataset
+
+
+def get_virus_dataset(num_rows, seed=0):
+    """Return rows shaped as the output of coronavirus_loader.get_virus_dataset."""
+    rng = random.Random(seed)
+
+    return [
+        {
+            "genbank-id": "MN{:06d}".format(i),
+            "identity-percent": str(rng.randrange(50, 100)),
+            "host": rng.choice(["Human", "Bat", "Pangolin", "Camel"]),
+            "location-discovered": rng.choice(["China", "Saudi Arabia", "Kenya", "Brazil"]),
+            "names": [word(rng) for _ in range(rng.randrange(1, 3))],
+        }
+        for i in range(num_rows)
+    ]
+
+
+def get_reactome_dataset(num_rows, seed=0):
+    """Return rows shaped as the output of reactome_loader.get_reactome_dataset."""
+    rng = random.Random(seed)
+    num_pathways = max(1, num_rows // 10)
+
+    return [
+        {
+            "uniprot-id": "P{:05d}".format(rng.randrange(num_rows)),
+            "pathway-id": "R-HSA-{}".format(pathway),
+            "pathway-name": "Pathway {}".format(pathway),
+            "organism": "Homo sapiens",
+        }
+        for pathway in (rng.randrange(num_pathways) for _ in range(num_rows))
+    ]
+
+
+def get_disgenet_dataset(num_rows, seed=0):
+    """Return rows shaped as the output of disgenet_loader.get_association_dataset."""
+    rng = random.Random(seed)
+    num_diseases = max(1, num_rows // 5)
+    record = record_type(ASSOCIATION_FIELDS)
+
+    return [
+        record(
+            str(rng.randrange(10 ** 6)),
+            gene_symbol(rng, num_rows),
+            "C{:07d}".format(disease),
+            "Disease {}".format(disease),
+            "{:.2f}".format(rng.random()),
+        )
+        for disease in (rng.randrange(num_diseases) for _ in range(num_rows))
+    ]
+
+
+def get_drug_dataset(num_rows, seed=0):
+    """Return rows shaped as the output of dgidb_loader.get_drug_dataset."""
+    rng = random.Random(seed)
+    num_drugs = max(1, num_rows // 3)
+
+    return [
+        {
+            "drug-claim-name": word(rng).upper(),
+            "drug-name": word(rng).upper(),
+            "chembl-id": "chembl:CHEMBL{}".format(rng.randrange(num_drugs)) if rng.random() < 0.9 else "",
+            "drug-claim-source": rng.choice(["ChEMBL", "DrugBank", "TTD", "GuideToPharmacology"]),
+        }
+        for _ in range(num_rows)
+    ]
+
+
+def get_drug_interaction_dataset(num_rows, seed=0):
+    """Return rows shaped as the output of dgidb_loader.get_interaction_dataset."""
+    rng = random.Random(seed)
+
+    return [
+        {
+            "gene-name": gene_symbol(rng, num_rows),
+            "entrez-id": str(rng.randrange(10 ** 6)) if rng.random() < 0.95 else "",
+            "interaction-type": rng.choice(["inhibitor", "agonist", "antagonist", ""]),
+            "drug-claim-name": word(rng).upper(),
+            "drug-name": word(rng).upper(),
+            "chembl-id": "chembl:CHEMBL{}".format(rng.randrange(num_rows)),
+        }
+        for _ in range(num_rows)
+    ]
+
+
+def get_tissue_dataset(num_rows, seed=0):
+    """Return rows shaped as the output of hpa_loader.get_tissue_dataset."""
+    rng = random.Random(seed)
+    num_genes = max(1, num_rows // 20)
+    tissues = ["Tissue {}".format(i) for i in range(60)]
+    cell_types = ["cell type {}".format(i) for i in range(40)]
+    record = record_type(TISSUE_FIELDS, categorical=TISSUE_CATEGORICAL)
+
+    return [
+        record(
+            "ENSG{:011d}".format(gene),
+            "GENE{}".format(gene),
+            rng.choice(tissues),
+            rng.choice(cell_types),
+            rng.choice(EXPRESSION_VALUES),
+            rng.choice(RELIABILITIES),
+        )
+        for gene in (rng.randrange(num_genes) for _ in range(num_rows))
+    ]
+
+
+def get_tissuenet_dataset(num_rows, seed=0):
+    """Return interactions shaped as those built by tissuenet_loader.load_tissuenet."""
+    rng = random.Random(seed)
+
+    return [
+        {
+            "gene-id-1": "ENSG{:011d}".format(rng.randrange(num_rows)),
+            "gene-id-2": "ENSG{:011d}".format(rng.randrange(num_rows)),
+            "tissue-name": "lung",
+            "cell-name": rng.choice([None, "alveolar cells"]),
+        }
+        for _ in range(num_rows)
+    ]
+
+
+def get_publications(num_rows, seed=0):
+    """Return publication metadata shaped as the responses of the NCBI E-utilities esummary API."""
+    rng = random.Random(seed)
+    journals = ["{} journal of {}".format(word(rng).capitalize(), word(rng)) for _ in range(max(1, num_rows // 20))]
+    authors = ["{} {}".format(word(rng).capitalize(), word(rng, 2).upper()) for _ in range(max(1, num_rows // 2))]
+
+    return [
+        {
+            "uid": str(30000000 + rng.randrange(num_rows * 2)),
+            "issn": "{:04d}-{:04d}".format(rng.randrange(10 ** 4), rng.randrange(10 ** 4)),
+            "volume": str(rng.randrange(1, 300)),
+            "pubdate": "{} Jan".format(rng.randrange(1990, 2022)),
+            "title": "The \"{}\" of {}.".format(word(rng), " ".join(word(rng) for _ in range(8))),
+            "articleids": [
+                {"idtype": "pubmed", "value": str(i)},
+                {"idtype": "doi", "value": "10.{}/{}".format(rng.randrange(1000, 9999), word(rng))},
+            ],
+            "authors": [{"name": rng.choice(authors)} for _ in range(rng.randrange(1, 8))],
+            "pubtype": rng.choice([["Journal Article"], ["Review"], ["Journal Article", "Review"]]),
+            "fulljournalname": rng.choice(journals),
+        }
+        for i in range(num_rows)
+    ]
+
+
+def get_semmed_relations(num_rows, seed=0):
+    """Return a dataframe of relations shaped as the output of semmed.fetch.fetch_data."""
+    rng = random.Random(seed)
+
+    return pandas.DataFrame({
+        "pmid": [str(30000000 + rng.randrange(num_rows * 2)) for _ in range(num_rows)],
+        "predicate": [rng.choice(PREDICATES) for _ in range(num_rows)],
+        "subject": [gene_symbol(rng, num_rows) for _ in range(num_rows)],
+        "object": [gene_symbol(rng, num_rows) for _ in range(num_rows)],
+        "sentence": [" ".join(word(rng) for _ in range(15)) for _ in range(num_rows)],
+    }).astype({"predicate": "category", "subject": "category", "object": "category"})
+
+
+def get_raw_strings(num_rows, seed=0):
+    """Return strings with punctuation, accents and decomposed unicode, as cleaned by util.clean_string."""
+    rng = random.Random(seed)
+    fragments = ["Café", "Café", "naïve", "(EC 2.7.11.1)", "α-helix", "[Cleaved]", "N-terminal;"]
+
+    return [
+        " ".join(rng.choice(fragments) if rng.random() < 0.3 else word(rng) for _ in range(12))
+        for _ in range(num_rows)
+    ]
+
+
+def write_tsv_files(directory, num_rows, seed=0):
+    """Write the same UniProt-shaped table as plain, gzip and zip TSV files.
+
+    :return: A dictionary from archive type (None, "gz" or "zip") to the file path
+    """
+    rng = random.Random(seed)
+    labels = ["Entry", "Entry name", "Protein names", "Gene names", "Organism", "Function [CC]"]
+    rows = [
+        [
+            "P{:05d}".format(i),
+            "{}_HUMAN".format(word(rng, 5).upper()),
+            protein_name(rng),
+            " ".join(gene_symbol(rng, num_rows) for _ in range(rng.randrange(4))),
+            "Homo sapiens (Human)",
+            "FUNCTION: {}.".format(" ".join(word(rng) for _ in range(20))),
+        ]
+        for i in range(num_rows)
+    ]
+
+    plain_path = os.path.join(directory, "table.tsv")
+    gz_path = os.path.join(directory, "table.tsv.gz")
+    zip_path = os.path.join(directory, "table.tsv.zip")
+
+    with open(plain_path, "w", encoding="utf8", newline="") as file:
+        writer = csv.writer(file, delimiter="\t")
+        writer.writerow(labels)
+        writer.writerows(rows)
+
+    with open(plain_path, "rb") as source, gzip.open(gz_path, "wb") as target:
+        target.write(source.read())
+
+    with ZipFile(zip_path, "w", ZIP_DEFLATED) as zip_file:
+        # read_tsv opens the member named after the archive, without the .zip extension.
+        zip_file.write(plain_path, "table.tsv")
+
+    return {None: plain_path, "gz": gz_path, "zip": zip_path}
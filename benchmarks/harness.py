@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Define the benchmark registry, the timing and allocation measurements, and baseline comparison."""
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+
+class Benchmark:
+    """A benchmark of a hot path over a fixed synthetic input.
+
+    :param name: A unique name for the benchmark
+    :param setup: A function taking the number of rows and a scratch directory, which builds the input and
+        returns a function running the hot path once over it, and the number of rows that run processes
+    """
+
+    def __init__(self, name, setup):
+        self.name = name
+        self.setup = setup
+
+    def __repr__(self):
+        return "Benchmark({})".format(self.name)
+
+
+benchmarks = list()
+
+
+def benchmark(name):
+    """Register the decorated setup function as a benchmark."""
+    def register(setup):
+        benchmarks.append(Benchmark(name, setup))
+        return setup
+
+    return register
+
+
+def measure(bench, num_rows, directory, repeat=5, min_time=0.2):
+    """Measure the throughput and allocations of a benchmark.
+
+    The hot path is run in rounds of as many iterations as fit in min_time, and the fastest round is
+    reported, which is the least disturbed by other activity on the machine. Allocations are measured in a
+    separate run under tracemalloc, since tracing slows down every allocation.
+
+    :param bench: The benchmark
+    :param num_rows: The number of input rows to generate
+    :param directory: A scratch directory for input files
+    :param repeat: The number of timed rounds
+    :param min_time: The minimum duration of a round, in seconds
+    :return: A dictionary of the measurements
+    """
+    run, rows = bench.setup(num_rows, directory)
+    run()
+    best = None
+
+    for _ in range(repeat):
+        iterations = 0
+        gc.collect()
+        start = time.perf_counter()
+
+        while True:
+            run()
+            iterations += 1
+            elapsed = time.perf_counter() - start
+
+            if elapsed >= min_time:
+                break
+
+        seconds = elapsed / iterations
+        best = seconds if best is None else min(best, seconds)
+
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "rows": rows,
+        "seconds": best,
+        "rows_per_second": rows / best if best > 0 else None,
+        "peak_allocated_bytes": peak - before,
+        "allocated_bytes_per_row": (peak - before) / rows if rows > 0 else None,
+    }
+
+
+def read_baseline(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_baseline(path, results, num_rows):
+    """Save the results as the baseline for later runs with the same number of rows."""
+    directory = os.path.dirname(path)
+
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+
+    baseline = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "rows": num_rows,
+        "results": results,
+    }
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(baseline, file, indent=4, sort_keys=True)
+
+
+def compare(result, baseline_result):
+    """Return the ratio of the throughput to the baseline throughput, and of the allocations per row."""
+    if baseline_result is None or not baseline_result["rows_per_second"] or not result["rows_per_second"]:
+        return None, None
+
+    speed = result["rows_per_second"] / baseline_result["rows_per_second"]
+
+    if baseline_result["allocated_bytes_per_row"]:
+        allocations = result["allocated_bytes_per_row"] / baseline_result["allocated_bytes_per_row"]
+    else:
+        allocations = None
+
+    return speed, allocations
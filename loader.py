@@ -1,18 +1,15 @@
 # -*- coding: utf-8 -*-
 """Script for migrating data from various sources into the database."""
+import signal
+import sys
 from argparse import ArgumentParser
 from configparser import ConfigParser
-from functools import partial
-from typedb.api.connection.credential import TypeDBCredential
-from typedb.client import SessionType, TypeDB
-from loader.coronavirus.coronavirus_loader import load_coronavirus
-from loader.dgidb.dgidb_loader import load_dgibd
-from loader.disgenet.disgenet_loader import load_disgenet
-from loader.hpa.hpa_loader import load_hpa
-from loader.reactome.reactome_loader import load_reactome
-from loader.semmed.pipeline import load_semmed
-from loader.tissuenet.tissuenet_loader import load_tissuenet
-from loader.uniprot.uniprot_loader import load_uniprot
+from typedb.client import SessionType
+from loader import metrics
+from loader.checkpoint import Checkpoint
+from loader.runner import compile_load, get_client, load
+from loader.sharding import run_sharded
+from loader.util import configure_writer, handle_interrupt, writer_options
 from schema.initialise import initialise_database
 
 
@@ -67,8 +64,11 @@ def command_parser():
         "-s",
         "--server_type",
         type=str,
-        choices=["CORE", "ENTERPRISE", "CLOUD"],
-        help="TypeDB server product in use, \"CORE\", \"ENTERPRISE\", or \"CLOUD\".",
+        choices=["CORE", "ENTERPRISE", "CLOUD", "FAKE"],
+        help=(
+            "TypeDB server product in use, \"CORE\", \"ENTERPRISE\", or \"CLOUD\", or \"FAKE\" for an in-memory "
+            "stand-in."
+        ),
     )
 
     parser.add_argument(
@@ -113,6 +113,178 @@ def command_parser():
         help="Maximum number of concurrently running jobs.",
     )
 
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        default=None,
+        help="Adapt commit batch size and number of jobs per stage to the observed commit latency and errors.",
+    )
+
+    parser.add_argument(
+        "--dead_letter_path",
+        type=str,
+        help="File to which queries that fail on their own are appended.",
+    )
+
+    parser.add_argument(
+        "-g",
+        "--generation_processes",
+        type=int,
+        help="Number of worker processes generating queries for row-wise stages, 0 to generate in the loader process.",
+    )
+
+    parser.add_argument(
+        "--parse_processes",
+        type=int,
+        help=(
+            "Number of worker processes parsing uncompressed source files read without a row limit, 0 or 1 to parse "
+            "in the loader process."
+        ),
+    )
+
+    parser.add_argument(
+        "-e",
+        "--engine",
+        type=str,
+        choices=["thread", "asyncio"],
+        help="Writer engine, \"thread\" for a thread pool or \"asyncio\" for an event loop driving an executor.",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        default=None,
+        help="Resume an interrupted load into an existing database, skipping batches recorded in the checkpoint.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--parallel_stages",
+        type=int,
+        help="Maximum number of independent loader stages run concurrently, sharing the num_jobs transactions.",
+    )
+
+    parser.add_argument(
+        "--cobatch",
+        action="store_true",
+        default=None,
+        help=(
+            "Insert entities in the same queries as the relations depending on them, instead of matching them per "
+            "relation."
+        ),
+    )
+
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        default=None,
+        help="Drop rows whose entity or relation key was already inserted by the load before generating their queries.",
+    )
+
+    parser.add_argument(
+        "--no_existence_checks",
+        dest="existence_checks",
+        action="store_false",
+        default=None,
+        help="Generate plain inserts instead of guarding them with negated existence checks. Use with --dedupe.",
+    )
+
+    parser.add_argument(
+        "--preload_keys",
+        action="store_true",
+        default=None,
+        help=(
+            "Read the keys of genes, proteins, drugs, diseases and pathways from the database before each relation "
+            "stage, and drop rows referring to missing ones."
+        ),
+    )
+
+    parser.add_argument(
+        "--dataset_cache",
+        type=str,
+        help=(
+            "Directory in which parsed datasets are cached, keyed by their source file and parser, to skip parsing "
+            "on later runs."
+        ),
+    )
+
+    parser.add_argument(
+        "--download_jobs",
+        type=int,
+        help="Maximum number of source files downloaded concurrently, in the background of the load.",
+    )
+
+    parser.add_argument(
+        "--refresh_sources",
+        action="store_true",
+        default=None,
+        help="Check downloaded source files for updates with conditional requests, and download the ones that changed.",
+    )
+
+    parser.add_argument(
+        "--no_refresh_sources",
+        dest="refresh_sources",
+        action="store_false",
+        default=None,
+        help="Use the downloaded source files as they are, without checking them for updates.",
+    )
+
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="Number of loader processes, each with its own client, writing a hash partition of every stage.",
+    )
+
+    parser.add_argument(
+        "--compile_only",
+        "--compile-only",
+        action="store_true",
+        default=None,
+        help=(
+            "Parse the datasets and write the queries of every stage to compressed files in compile_dir, without "
+            "connecting to a server."
+        ),
+    )
+
+    parser.add_argument(
+        "--compile_dir",
+        type=str,
+        help="Directory to which --compile_only writes the query files and their manifest.",
+    )
+
+    parser.add_argument(
+        "--replay",
+        type=str,
+        help="Load the queries compiled to this directory by --compile_only instead of parsing the datasets.",
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="?",
+        const="profiles",
+        help=(
+            "Profile each stage, writing <stage>.pstats and collapsed stacks for flamegraphs to the given "
+            "directory. (default: \"profiles\")"
+        ),
+    )
+
+    parser.add_argument(
+        "--metrics_path",
+        type=str,
+        help="File to which the per-stage load metrics are written as JSON.",
+    )
+
+    parser.add_argument(
+        "--prometheus_path",
+        type=str,
+        help=(
+            "File to which the per-stage load metrics are written for the Prometheus node exporter textfile "
+            "collector."
+        ),
+    )
+
     return parser
 
 
@@ -122,6 +294,14 @@ def parse_args():
 
     bool_args = [
         "overwrite",
+        "adaptive",
+        "resume",
+        "compile_only",
+        "cobatch",
+        "dedupe",
+        "existence_checks",
+        "preload_keys",
+        "refresh_sources",
     ]
 
     int_args = [
@@ -136,6 +316,29 @@ def parse_args():
         "max_protein_interactions",
         "commit_batch",
         "num_jobs",
+        "min_commit_batch",
+        "max_commit_batch",
+        "max_num_jobs",
+        "max_retries",
+        "generation_processes",
+        "generation_chunk_size",
+        "parse_processes",
+        "download_jobs",
+        "parallel_stages",
+        "shards",
+        "fake_seed",
+        "fake_sample_size",
+        "compile_file_queries",
+        "key_page_size",
+    ]
+
+    float_args = [
+        "target_commit_latency",
+        "retry_backoff",
+        "fake_commit_latency",
+        "fake_query_latency",
+        "fake_conflict_rate",
+        "fake_failure_rate",
     ]
 
     args = dict()
@@ -145,9 +348,11 @@ def parse_args():
             if config_args[section][arg] is None:
                 args[arg] = None
             elif arg in bool_args:
-                args[arg] = bool(config_args[section][arg])
+                args[arg] = config_args[section][arg].lower() in ("1", "yes", "true", "on")
             elif arg in int_args:
                 args[arg] = int(config_args[section][arg])
+            elif arg in float_args:
+                args[arg] = float(config_args[section][arg])
             else:
                 args[arg] = config_args[section][arg]
 
@@ -158,32 +363,60 @@ def parse_args():
     return args
 
 
+def write_reports(args):
+    """Write the metrics of the load to the report files that are set."""
+    if args["metrics_path"] is not None:
+        metrics.write_report(args["metrics_path"])
+
+    if args["prometheus_path"] is not None:
+        metrics.write_prometheus(args["prometheus_path"])
+
+
 if __name__ == "__main__":
     args = parse_args()
-
-    if args["server_type"].lower() == "core":
-        client_partial = partial(TypeDB.core_client, address=args["address"])
-    elif args["server_type"].lower() in ["enterprise", "cloud"]:
-        credential = TypeDBCredential(username=args["username"], password=args["password"], tls_root_ca_path=args["tls_cert_path"])
-        client_partial = partial(TypeDB.cluster_client, addresses=args["address"], credential=credential)
-    else:
-        raise ValueError("Unknown server type. Must be \"CORE\", \"ENTERPRISE\", or \"CLOUD\".")
+    configure_writer(**{option: args.get(option) for option in writer_options})
 
     print("Welcome to the TypeDB Bio database loader!")
     print("--------------------------------------------------")
 
-    with client_partial() as client:
-        initialise_database(client, args["database"], args["overwrite"])
-
-        with client.session(args["database"], SessionType.DATA) as session:
-            load_uniprot(session, args["max_proteins"], args["num_jobs"], args["commit_batch"])
-            load_coronavirus(session, args["max_viruses"], args["num_jobs"], args["commit_batch"])
-            load_reactome(session, args["max_pathways"], args["num_jobs"], args["commit_batch"])
-            load_disgenet(session, args["max_diseases"], args["num_jobs"], args["commit_batch"])
-            load_dgibd(session, args["max_drugs"], args["max_drug_interactions"], args["num_jobs"], args["commit_batch"])
-            load_hpa(session, args["max_tissues"], args["num_jobs"], args["commit_batch"])
-            load_semmed(session, args["max_publications"], args["num_jobs"], args["commit_batch"])
-            load_tissuenet(session, args["max_protein_interactions"], args["num_jobs"], args["commit_batch"])
+    if args["compile_only"]:
+        try:
+            compile_load(args)
+        finally:
+            write_reports(args)
+
+        print("All queries compiled to: {}".format(args["compile_dir"]))
+        print("Goodbye!")
+        sys.exit(0)
+
+    with get_client(args) as client:
+        resume = args["resume"] and client.databases().contains(args["database"])
+
+        if not resume:
+            initialise_database(client, args["database"], args["overwrite"])
+
+        if args["checkpoint_path"] is None and resume:
+            raise ValueError("A checkpoint path is required to resume a load.")
+
+        signal.signal(signal.SIGINT, handle_interrupt)
+
+        try:
+            if args["shards"] > 1:
+                run_sharded(args, args["shards"], resume)
+            else:
+                if args["checkpoint_path"] is not None:
+                    configure_writer(checkpoint=Checkpoint(args["checkpoint_path"], resume))
+
+                with client.session(args["database"], SessionType.DATA) as session:
+                    load(args, session)
+        except KeyboardInterrupt:
+            print("Load interrupted. Run again with --resume to continue from the last committed batch.")
+            sys.exit(130)
+        finally:
+            if writer_options["checkpoint"] is not None:
+                writer_options["checkpoint"].close()
+
+            write_reports(args)
 
     print("All data loaded.")
     print("Goodbye!")
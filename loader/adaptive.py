@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Define an AIMD controller for adapting the writer batch size and concurrency."""
+import threading
+
+
+class AdaptiveController:
+    """Adapt the batch size and number of active writers to the observed commit performance.
+
+    Follows additive-increase/multiplicative-decrease: every batch committed within the target latency
+    grows the batch size by a fixed step, and every full round of such batches adds a writer. A batch that
+    commits too slowly halves the batch size, and a failed batch halves both the batch size and the number
+    of writers. Both values are kept within the configured bounds.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        num_jobs: int,
+        min_batch_size: int,
+        max_batch_size: int,
+        max_jobs: int,
+        target_latency: float,
+    ):
+        self.min_batch_size = max(1, min_batch_size)
+        self.max_batch_size = max(self.min_batch_size, max_batch_size)
+        self.max_jobs = max(1, max_jobs)
+        self.target_latency = target_latency
+        self.batch_size = min(max(batch_size, self.min_batch_size), self.max_batch_size)
+        self.num_jobs = min(max(num_jobs, 1), self.max_jobs)
+        self.batch_step = max(1, self.batch_size // 10)
+        self.batches = 0
+        self.failures = 0
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    def observe(self, size: int, latency: float, success: bool) -> None:
+        """Record the outcome of a batch and adjust the batch size and concurrency.
+
+        :param size: The number of queries in the batch
+        :type size: int
+        :param latency: The time taken to write and commit the batch, in seconds
+        :type latency: float
+        :param success: Whether the batch was committed
+        :type success: bool
+        """
+        with self._lock:
+            self.batches += 1
+
+            if not success:
+                self.failures += 1
+                self._successes = 0
+                self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+                self.num_jobs = max(1, self.num_jobs // 2)
+            elif latency > self.target_latency:
+                self._successes = 0
+
+                # Only back off if the slow batch was at least as large as the current setting, so that
+                # batches issued before an earlier decrease do not trigger a second one.
+                if size >= self.batch_size:
+                    self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            else:
+                self._successes += 1
+                self.batch_size = min(self.max_batch_size, self.batch_size + self.batch_step)
+
+                if self._successes >= self.num_jobs:
+                    self._successes = 0
+                    self.num_jobs = min(self.max_jobs, self.num_jobs + 1)
+
+    @property
+    def error_rate(self) -> float:
+        """Return the fraction of observed batches that failed."""
+        return self.failures / self.batches if self.batches > 0 else 0.0
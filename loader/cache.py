@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""Define the cache of parsed datasets, stored as columns of string codes.
+
+Parsing a source file, such as the UniProt TSV or the gzip-compressed DisGeNET associations, tokenizes
+every line on every run of the loader. With the dataset_cache writer option set to a directory, the
+dataset a decorated function returns is written there as one NumPy array of string codes per column, and
+a table of the distinct strings of the dataset. Later runs load the arrays and decode the rows from them
+instead of parsing the source again, building each distinct string once.
+
+Entries are keyed by the hash of the source file, the source code of the parsing module and of the reader
+utilities, and the arguments of the call, so that a new download, a change to the parser or a different
+row limit each write a new entry. Entries are never removed, and the directory can be deleted at any time.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import numpy
+import pandas
+from loader.download import downloads, get_file
+from loader.rows import Record, record_type
+from loader.util import get_stage_metrics, writer_options
+
+
+CACHE_FORMAT = 1
+HASH_CHUNK_BYTES = 1 << 20
+
+
+def cached_dataset(source):
+    """Decorate a function parsing a source file, to read its result from the dataset cache if it is set.
+
+    The function must return a list of dictionaries or records with the same keys and string or None values,
+    or a pandas DataFrame with an integer index. A source given by its URL is downloaded before it is hashed.
+    Other sources may be missing before the first call, which is expected to create them.
+
+    :param source: The path of the source file, a pair of its URL and the directory it is downloaded to, or a
+        function of the arguments of the call returning its path
+    :return: The decorator
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def get(*args):
+            cache_dir = writer_options["dataset_cache"]
+
+            if cache_dir is None:
+                return func(*args)
+
+            if callable(source):
+                path = source(*args)
+            elif isinstance(source, tuple):
+                path = get_file(*source)
+            else:
+                path = source
+
+            entry_path = None
+
+            if os.path.exists(path):
+                entry_path = get_entry_path(cache_dir, func, path, args)
+
+                if os.path.exists(entry_path):
+                    stage_metrics = get_stage_metrics()
+
+                    with stage_metrics.phase("parse"):
+                        dataset = read_dataset(entry_path)
+
+                    stage_metrics.add("rows_cached", len(dataset))
+                    print("[cache] Read {} rows of {} from {}.".format(len(dataset), func.__name__, entry_path))
+                    return dataset
+
+            dataset = func(*args)
+
+            if entry_path is None:
+                entry_path = get_entry_path(cache_dir, func, path, args)
+
+            write_dataset(entry_path, dataset)
+            return dataset
+
+        return get
+
+    return decorate
+
+
+def get_entry_path(cache_dir, func, path, args):
+    """Return the path of the cache entry of a call to a parsing function.
+
+    :param cache_dir: The cache directory
+    :param func: The parsing function
+    :param path: The path of the source file
+    :param args: The arguments of the call
+    :return: The path of the directory of the entry
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([CACHE_FORMAT, func.__qualname__, list(args)]).encode("utf-8"))
+    digest.update(inspect.getsource(sys.modules["loader.util"]).encode("utf-8"))
+
+    try:
+        digest.update(inspect.getsource(sys.modules[func.__module__]).encode("utf-8"))
+    except (KeyError, OSError):
+        # The function was defined interactively, so its bytecode stands in for its module.
+        digest.update(func.__code__.co_code)
+
+    sha256 = downloads.get_digest(path)
+
+    if sha256 is not None:
+        # The hash recorded when the file was downloaded saves reading it again.
+        digest.update(sha256.encode("utf-8"))
+    else:
+        with open(path, "rb") as file:
+            for chunk in iter(functools.partial(file.read, HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+
+    return os.path.join(cache_dir, "{}-{}".format(func.__name__, digest.hexdigest()))
+
+
+def write_dataset(entry_path, dataset):
+    """Write a dataset to a cache entry.
+
+    The entry is written to a temporary directory and renamed, so that an interrupted write leaves no entry
+    and concurrent writers of the same entry leave one of theirs.
+
+    :param entry_path: The path of the directory of the entry
+    :param dataset: A list of dictionaries or records, or a pandas DataFrame
+    """
+    categorical = None
+
+    if isinstance(dataset, pandas.DataFrame):
+        kind = "frame"
+        columns = list(dataset.columns)
+        values = [dataset[column].to_numpy() for column in columns]
+    else:
+        kind = "records"
+        columns = list(dataset[0].keys()) if len(dataset) > 0 else list()
+
+        if len(dataset) > 0 and isinstance(dataset[0], Record):
+            # Records of the same type have the same keys, and are read back as records of that type.
+            if any(type(data) is not type(dataset[0]) for data in dataset):
+                raise TypeError("Cannot cache a dataset whose rows have different keys.")
+
+            categorical = list(dataset[0].categorical)
+        elif any(data.keys() != dataset[0].keys() for data in dataset):
+            raise TypeError("Cannot cache a dataset whose rows have different keys.")
+
+        values = [[data[column] for data in dataset] for column in columns]
+
+    strings = dict()
+    arrays = list()
+
+    for column_values in values:
+        if isinstance(column_values, numpy.ndarray) and column_values.dtype.kind in "biuf":
+            arrays.append(("array", column_values))
+        else:
+            arrays.append(("codes", encode_strings(column_values, strings)))
+
+    table = list(strings)
+    offsets = numpy.zeros(len(table) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(string) for string in table], out=offsets[1:])
+
+    temp_path = "{}.tmp-{}".format(entry_path, os.getpid())
+    os.makedirs(temp_path, exist_ok=True)
+
+    numpy.save(os.path.join(temp_path, "strings.npy"), numpy.frombuffer("".join(table).encode("utf-8"), numpy.uint8))
+    numpy.save(os.path.join(temp_path, "offsets.npy"), offsets)
+
+    for i, (_, array) in enumerate(arrays):
+        numpy.save(os.path.join(temp_path, "{}.npy".format(i)), array)
+
+    if kind == "frame":
+        numpy.save(os.path.join(temp_path, "index.npy"), dataset.index.to_numpy(dtype=numpy.int64))
+
+    meta = {
+        "format": CACHE_FORMAT,
+        "kind": kind,
+        "rows": len(dataset),
+        "columns": columns,
+        "categorical": categorical,
+        "encodings": [encoding for encoding, _ in arrays],
+    }
+
+    with open(os.path.join(temp_path, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+
+    try:
+        os.rename(temp_path, entry_path)
+    except OSError:
+        # Another process wrote the same entry first.
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+
+def encode_strings(column_values, strings):
+    """Encode the values of a column as codes into a shared table of strings, with -1 for None.
+
+    :param column_values: The string or None values of the column
+    :param strings: A dictionary from each string in the table to its code, extended with new strings
+    :return: An array of codes
+    """
+    codes = numpy.empty(len(column_values), dtype=numpy.int32)
+
+    for i, value in enumerate(column_values):
+        if value is None:
+            codes[i] = -1
+        elif isinstance(value, str):
+            codes[i] = strings.setdefault(value, len(strings))
+        else:
+            raise TypeError("Cannot cache a dataset value of type {}.".format(type(value).__name__))
+
+    return codes
+
+
+def read_dataset(entry_path):
+    """Read a dataset from a cache entry, decoding every row.
+
+    :param entry_path: The path of the directory of the entry
+    :return: A list of dictionaries or records, or a pandas DataFrame, as written
+    """
+    with open(os.path.join(entry_path, "meta.json"), "r", encoding="utf-8") as file:
+        meta = json.load(file)
+
+    text = numpy.load(os.path.join(entry_path, "strings.npy"), mmap_mode="r").tobytes().decode("utf-8")
+    offsets = numpy.load(os.path.join(entry_path, "offsets.npy"), mmap_mode="r").tolist()
+    # Code -1 selects the final None.
+    table = [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)] + [None]
+    values = list()
+
+    for i, encoding in enumerate(meta["encodings"]):
+        array = numpy.load(os.path.join(entry_path, "{}.npy".format(i)), mmap_mode="r")
+
+        if encoding == "codes":
+            values.append([table[code] for code in array.tolist()])
+        else:
+            values.append(array)
+
+    if meta["kind"] == "frame":
+        index = numpy.load(os.path.join(entry_path, "index.npy"), mmap_mode="r")
+        return pandas.DataFrame(dict(zip(meta["columns"], values)), index=index, columns=meta["columns"])
+
+    if meta.get("categorical") is not None:
+        record = record_type(tuple(meta["columns"]), tuple(meta["categorical"]))
+        return [record(*row) for row in zip(*values)]
+
+    return [dict(zip(meta["columns"], row)) for row in zip(*values)]
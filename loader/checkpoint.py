@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Define a journal of committed batches for resuming interrupted loads."""
+import hashlib
+import json
+import os
+import threading
+from collections import Counter, defaultdict
+
+
+def query_digest(query: str) -> str:
+    """Return a short, stable digest of a query.
+
+    :param query: The query
+    :type query: str
+    :return: The hex digest of the query
+    :rtype: str
+    """
+    return hashlib.blake2b(query.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class Checkpoint:
+    """Record committed batches per stage in a JSON lines journal, and replay it to resume a load.
+
+    Stages are keyed by their name and the number of times a stage of that name has been started in the
+    run, so that stages repeated for several files keep distinct keys as long as the loaders run in the same
+    order. Each committed batch is recorded under a batch ID derived from its queries, together with the
+    digests of those queries. Resuming therefore skips committed queries regardless of how they were
+    batched, which keeps it correct under adaptive batch sizes and unordered query generation.
+    """
+
+    def __init__(self, path: str | os.PathLike, resume: bool = False):
+        self.path = path
+        self.completed_stages: set[str] = set()
+        self.committed: defaultdict[str, set[str]] = defaultdict(set)
+        self._stage_counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+        if resume and os.path.exists(path):
+            self._read()
+            mode = "a"
+        else:
+            mode = "w"
+
+        self._file = open(path, mode, encoding="utf-8")
+
+    def _read(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The final line may be truncated if the loader was killed mid-write.
+                    continue
+
+                if record.get("complete"):
+                    self.completed_stages.add(record["stage"])
+                else:
+                    self.committed[record["stage"]].update(record["queries"])
+
+    def stage_key(self, stage: str) -> str:
+        """Return the key of the next stage with the given name.
+
+        :param stage: The stage name
+        :type stage: str
+        :return: The stage key
+        :rtype: str
+        """
+        with self._lock:
+            self._stage_counts[stage] += 1
+            return "{}#{}".format(stage, self._stage_counts[stage])
+
+    def is_complete(self, key: str) -> bool:
+        """Return whether the stage was completed in the journal being resumed.
+
+        :param key: The stage key
+        :type key: str
+        :return: Whether the stage is complete
+        :rtype: bool
+        """
+        return key in self.completed_stages
+
+    def filter(self, key, queries):
+        """Drop queries of the stage that were committed in the journal being resumed.
+
+        :param key: The stage key
+        :param queries: An iterable of queries
+        :return: A generator of the queries not yet committed
+        """
+        committed = self.committed.get(key, set())
+
+        for query in queries:
+            if query_digest(query) not in committed:
+                yield query
+
+    def record_batch(self, key: str, queries: list[str]) -> None:
+        """Record a committed batch of the stage.
+
+        :param key: The stage key
+        :type key: str
+        :param queries: The queries in the batch
+        :type queries: list[str]
+        """
+        digests = [query_digest(query) for query in queries]
+        batch_id = hashlib.blake2b("".join(digests).encode("ascii"), digest_size=8).hexdigest()
+        self._write({"stage": key, "batch": batch_id, "queries": digests})
+
+    def record_complete(self, key: str) -> None:
+        """Record that every batch of the stage was committed.
+
+        :param key: The stage key
+        :type key: str
+        """
+        self._write({"stage": key, "complete": True})
+
+    def _write(self, record: dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        """Flush and close the journal."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Define the compilation of a load to TypeQL files, and the stages replaying them."""
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from functools import partial
+from loader.scheduler import Stage
+from loader.util import write_batches
+
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def escape_query(query):
+    return query.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def unescape_query(line):
+    return re.sub(r"\\(.)", lambda match: {"n": "\n", "r": "\r"}.get(match.group(1), match.group(1)), line)
+
+
+class Compiler:
+    """Write the queries of every stage to gzip-compressed TypeQL files, described by a manifest.
+
+    The queries of each call to write_batches are written one per line, with backslashes and line breaks
+    escaped, to files of at most file_queries queries. The manifest lists the stages with their
+    dependencies and, in the order they were written, the files of each of their outputs. It is rewritten
+    as each output completes, and only marked complete once the compiler is closed, so that an interrupted
+    compilation can be inspected but not replayed.
+
+    :param directory: The directory to write the files and manifest to
+    :param stages: The stages being compiled
+    :param file_queries: The maximum number of queries per file
+    """
+
+    def __init__(self, directory, stages, file_queries=100000):
+        self.directory = directory
+        self.file_queries = file_queries
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._stages = {
+            stage.name: {
+                "name": stage.name,
+                "produces": sorted(stage.produces),
+                "consumes": sorted(stage.consumes),
+                "outputs": list(),
+            }
+            for stage in stages
+        }
+
+        self.manifest = {
+            "version": MANIFEST_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "complete": False,
+            "stages": list(self._stages.values()),
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        self._write_manifest()
+
+    def write(self, scheduled_stage, stage, queries, progress=None):
+        """Write the queries of one call to write_batches.
+
+        :param scheduled_stage: The name of the scheduled stage
+        :param stage: The name passed to write_batches
+        :param queries: An iterable of queries
+        :param progress: A function called with the number of queries written to each file
+        :return: The number of queries written
+        """
+        with self._lock:
+            self._counts[scheduled_stage, stage] += 1
+            prefix = "{}#{}".format(re.sub(r"[^\w.-]+", "_", stage or "queries"), self._counts[scheduled_stage, stage])
+
+        stage_directory = os.path.join(self.directory, re.sub(r"[^\w.-]+", "_", scheduled_stage))
+        os.makedirs(stage_directory, exist_ok=True)
+        iterator = iter(queries)
+        files = list()
+
+        while True:
+            path = os.path.join(stage_directory, "{}-part-{:05d}.tql.gz".format(prefix, len(files)))
+            count = 0
+
+            with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as file:
+                for query in iterator:
+                    file.write(escape_query(query) + "\n")
+                    count += 1
+
+                    if count == self.file_queries:
+                        break
+
+            if count == 0 and len(files) > 0:
+                os.remove(path)
+                break
+
+            files.append({"path": os.path.relpath(path, self.directory), "queries": count})
+
+            if progress is not None:
+                progress(count)
+
+            if count < self.file_queries:
+                break
+
+        total = sum(file["queries"] for file in files)
+
+        with self._lock:
+            if scheduled_stage not in self._stages:
+                self._stages[scheduled_stage] = {"name": scheduled_stage, "produces": [], "consumes": [], "outputs": []}
+                self.manifest["stages"].append(self._stages[scheduled_stage])
+
+            self._stages[scheduled_stage]["outputs"].append({"stage": stage, "files": files, "queries": total})
+            self._write_manifest()
+
+        return total
+
+    def close(self):
+        """Mark the compilation complete."""
+        with self._lock:
+            self.manifest["complete"] = True
+            self._write_manifest()
+
+    def _write_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        temp_path = path + ".tmp"
+
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, indent=4)
+
+        os.replace(temp_path, path)
+
+
+class CompiledQueries:
+    """The queries of one compiled output, streamed from its files."""
+
+    def __init__(self, directory, output):
+        self.paths = [os.path.join(directory, file["path"]) for file in output["files"]]
+        self.count = output["queries"]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for path in self.paths:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    yield unescape_query(line[:-1])
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+
+    if manifest["version"] != MANIFEST_VERSION:
+        raise ValueError("Unsupported compiled load version: {}".format(manifest["version"]))
+
+    if not manifest["complete"]:
+        raise ValueError("The compiled load in {} is incomplete. Compile it again.".format(directory))
+
+    return manifest
+
+
+def get_replay_stages(directory):
+    """Define stages writing the compiled queries in the directory, with the dependencies of the originals.
+
+    :param directory: The directory of a compiled load
+    :return: The stages, in the order they were compiled
+    """
+    return [
+        Stage(
+            entry["name"],
+            partial(replay_stage, directory, entry["outputs"]),
+            produces=entry["produces"],
+            consumes=entry["consumes"],
+        )
+        for entry in read_manifest(directory)["stages"]
+    ]
+
+
+def replay_stage(directory, outputs, session, num_jobs, batch_size):
+    for output in outputs:
+        write_batches(session, CompiledQueries(directory, output), num_jobs, batch_size, stage=output["stage"])
@@ -1,5 +1,7 @@
 import csv
-from loader.util import write_batches, read_tsv
+from loader.dedupe import existence_checks, filter_new
+from loader.scheduler import Stage, memoize
+from loader.util import write_batches, iter_tsv, generate_queries
 
 
 def load_coronavirus(session, max_coronaviruses, num_jobs, batch_size):
@@ -13,14 +15,38 @@ def load_coronavirus(session, max_coronaviruses, num_jobs, batch_size):
         print("--------------------------------------------------")
 
 
+def get_coronavirus_stages(max_coronaviruses):
+    if max_coronaviruses is not None and max_coronaviruses <= 0:
+        return list()
+
+    dataset = memoize(get_virus_dataset, max_coronaviruses)
+
+    return [
+        Stage(
+            "coronavirus.roleplayers",
+            lambda *args: insert_extra_roleplayers(dataset(), *args),
+            produces=["organism", "country"],
+        ),
+        Stage(
+            "coronavirus.viruses",
+            lambda *args: insert_viruses(dataset(), *args),
+            produces=["virus", "discovery", "virus-hosting"],
+            consumes=["organism", "country"],
+        ),
+        Stage(
+            "coronavirus.host-proteins",
+            insert_host_proteins,
+            produces=["virus-protein-interaction"],
+            consumes=["virus", "protein"],
+        ),
+    ]
+
+
 def get_virus_dataset(max_rows):
-    rows = read_tsv("dataset/coronavirus/Genome identity.csv", delimiter=",")
+    rows = iter_tsv("dataset/coronavirus/Genome identity.csv", delimiter=",", max_rows=max_rows)
     dataset = list()
 
-    if max_rows is None:
-        max_rows = len(rows)
-
-    for row in rows[:max_rows]:
+    for row in rows:
         data = {
             "genbank-id": row["GenBank ID"],
             "identity-percent": row["Identity %"],
@@ -41,6 +67,14 @@ def get_virus_dataset(max_rows):
 
 
 def insert_extra_roleplayers(dataset, session, num_jobs, batch_size):
+    organism_names, country_names = get_extra_roleplayer_names(dataset)
+    organism_names = filter_new("organism", organism_names)
+    country_names = filter_new("country", country_names)
+    queries = iter_extra_roleplayer_queries(organism_names, country_names, existence_checks())
+    write_batches(session, queries, num_jobs, batch_size, stage="organisms and countries")
+
+
+def get_extra_roleplayer_names(dataset):
     organism_names = set()
     country_names = set()
 
@@ -48,41 +82,49 @@ def insert_extra_roleplayers(dataset, session, num_jobs, batch_size):
         organism_names.add(data["host"])
         country_names.add(data["location-discovered"])
 
-    queries = list()
+    return organism_names, country_names
 
-    for organism_name in organism_names:
-        query = " ".join([
-            "match",
-            "?n = \"{}\";",
-            "not {{ $o isa organism, has organism-name ?n; }};",
-            "insert",
-            "$o isa organism, has organism-name ?n;"
-        ]).format(
-            organism_name,
-        )
 
-        queries.append(query)
+def iter_extra_roleplayer_queries(organism_names, country_names, guard=True):
+    for organism_name in organism_names:
+        if guard:
+            query = " ".join([
+                "match",
+                "?n = \"{}\";",
+                "not {{ $o isa organism, has organism-name ?n; }};",
+                "insert",
+                "$o isa organism, has organism-name ?n;"
+            ]).format(
+                organism_name,
+            )
+        else:
+            query = "insert $o isa organism, has organism-name \"{}\";".format(organism_name)
+
+        yield query
 
     for country_name in country_names:
-        query = " ".join([
-            "match",
-            "?n = \"{}\";",
-            "not {{ $c isa country, has country-name ?n; }};",
-            "insert",
-            "$c isa country, has country-name ?n;"
-        ]).format(
-            country_name,
-        )
-
-        queries.append(query)
-
-    print("Inserting organisms and countries:")
-    write_batches(session, queries, num_jobs, batch_size)
+        if guard:
+            query = " ".join([
+                "match",
+                "?n = \"{}\";",
+                "not {{ $c isa country, has country-name ?n; }};",
+                "insert",
+                "$c isa country, has country-name ?n;"
+            ]).format(
+                country_name,
+            )
+        else:
+            query = "insert $c isa country, has country-name \"{}\";".format(country_name)
+
+        yield query
 
 
 def insert_viruses(dataset, session, num_jobs, batch_size):
-    queries = list()
+    queries = generate_queries(iter_virus_queries, dataset, key=lambda data: data["genbank-id"])
+    write_batches(session, queries, num_jobs, batch_size, stage="viruses")
 
+
+def iter_virus_queries(dataset):
     for data in dataset:
         query = " ".join([
             "match",
@@ -107,14 +149,16 @@ def insert_viruses(dataset, session, num_jobs, batch_size):
             data["identity-percent"],
         )
 
-        queries.append(query)
-
-    print("Inserting viruses:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def insert_host_proteins(session, num_jobs, batch_size):
-    rows = read_tsv("dataset/coronavirus/Host proteins (potential drug targets).csv", delimiter=",")
+    write_batches(session, iter_host_protein_queries(), num_jobs, batch_size, stage="protein-virus associations")
+
+
+def iter_host_protein_queries():
+    columns = ["Coronavirus", "UniProt ID", "Host Gene Entrez ID"]
+    rows = iter_tsv("dataset/coronavirus/Host proteins (potential drug targets).csv", delimiter=",", columns=columns)
     dataset = list()
 
     for row in rows:
@@ -126,8 +170,6 @@ def insert_host_proteins(session, num_jobs, batch_size):
 
         dataset.append(data)
 
-    queries = list()
-
     for data in dataset:
         query = " ".join([
             "match",
@@ -142,7 +184,4 @@ def insert_host_proteins(session, num_jobs, batch_size):
             data["entrez-id"],
         )
 
-        queries.append(query)
-
-    print("Inserting protein-virus associations:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Define the registry of inserted keys, deduplicating inserts on the client instead of the server.
+
+Loaders inserting entities or relations that may already exist guard their queries with negated
+subqueries, which the server evaluates for every row and which do not protect against two concurrent
+batches inserting the same key. With the dedupe writer option set, rows whose key was already registered
+during the load are dropped before their queries are generated, and the existence_checks writer option
+can then be unset to generate plain inserts without the guards.
+
+Keys are registered when a stage filters its rows, before write_batches skips the stages and batches a
+resumed load already committed, so a resumed load with deterministic stages registers the keys inserted
+before it was interrupted. Loaders must therefore call filter_new eagerly, not from the generators of
+their queries, which skipped stages never run. Keys are compared by attribute value, so guards should
+only be disabled when loading into a database that the load alone writes to.
+"""
+import threading
+from loader.util import filter_rows, get_stage_metrics, writer_options
+
+
+class DedupeRegistry:
+    """A thread-safe set of keys per namespace, such as an entity or relation type."""
+
+    def __init__(self):
+        self._keys = dict()
+        self._lock = threading.Lock()
+
+    def add(self, namespace, key):
+        """Register a key, returning whether it was new."""
+        with self._lock:
+            keys = self._keys.setdefault(namespace, set())
+
+            if key in keys:
+                return False
+
+            keys.add(key)
+            return True
+
+    def contains(self, namespace, key):
+        with self._lock:
+            return key in self._keys.get(namespace, ())
+
+    def size(self, namespace):
+        with self._lock:
+            return len(self._keys.get(namespace, ()))
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+registry = DedupeRegistry()
+
+
+def filter_new(namespace, rows, key=None):
+    """Drop the rows whose key is registered, registering the others, if the dedupe writer option is set.
+
+    :param namespace: The namespace of the keys
+    :param rows: A list, set or pandas DataFrame of rows
+    :param key: A function returning the hashable key of a row, or of a DataFrame row tuple, or None if rows
+        are their own keys
+    :return: The new rows, as a list or DataFrame, or the rows unchanged if dedupe is unset
+    """
+    if not writer_options["dedupe"]:
+        return rows
+
+    if key is None:
+        key = _identity
+
+    new_rows = filter_rows(rows, lambda row: registry.add(namespace, key(row)))
+    get_stage_metrics().add("rows_deduplicated", len(rows) - len(new_rows))
+    return new_rows
+
+
+def _identity(row):
+    return row
+
+
+def existence_checks():
+    """Return whether queries should guard their inserts with negated existence checks."""
+    return writer_options["existence_checks"]
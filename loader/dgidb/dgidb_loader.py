@@ -1,4 +1,13 @@
-from loader.util import write_batches, get_file, read_tsv
+from functools import partial
+from loader.dedupe import existence_checks, filter_new
+from loader.download import get_file
+from loader.keys import filter_known
+from loader.scheduler import Stage
+from loader.util import write_batches, iter_tsv, generate_queries, group_by
+
+
+DRUG_SOURCE = ("https://www.dgidb.org/data/monthly_tsvs/2021-Jan/drugs.tsv", "dataset/dgidb")
+DRUG_INTERACTION_SOURCE = ("https://www.dgidb.org/data/monthly_tsvs/2021-Jan/interactions.tsv", "dataset/dgidb")
 
 
 def load_dgibd(session, max_drugs, max_interactions, num_jobs, batch_size):
@@ -13,15 +22,41 @@ def load_dgibd(session, max_drugs, max_interactions, num_jobs, batch_size):
         print("--------------------------------------------------")
 
 
+def get_dgidb_stages(max_drugs, max_interactions):
+    stages = list()
+
+    if max_drugs is None or max_drugs > 0:
+        stages.append(Stage(
+            "dgidb.drugs",
+            lambda session, num_jobs, batch_size: insert_drugs(session, max_drugs, num_jobs, batch_size),
+            produces=["drug"],
+        ))
+
+        if max_interactions is None or max_interactions > 0:
+            stages.append(Stage(
+                "dgidb.interactions",
+                lambda session, num_jobs, batch_size: insert_interactions(
+                    session, max_interactions, num_jobs, batch_size
+                ),
+                produces=["drug-gene-interaction"],
+                consumes=["gene", "drug"],
+            ))
+
+    return stages
+
+
 def insert_drugs(session, max_rows, num_jobs, batch_size):
-    get_file("https://www.dgidb.org/data/monthly_tsvs/2021-Jan/drugs.tsv", "dataset/dgidb")
-    rows = read_tsv("dataset/dgidb/drugs.tsv")
-    dataset = list()
+    dataset = get_drug_dataset(max_rows)
+    write_batches(session, iter_drug_queries(dataset), num_jobs, batch_size, stage="drugs")
+
 
-    if max_rows is None:
-        max_rows = len(rows)
+def get_drug_dataset(max_rows):
+    get_file(*DRUG_SOURCE)
+    columns = ["drug_claim_name", "drug_name", "concept_id", "drug_claim_source"]
+    rows = iter_tsv("dataset/dgidb/drugs.tsv", max_rows=max_rows, columns=columns)
+    dataset = list()
 
-    for row in rows[:max_rows]:
+    for row in rows:
         data = {
             "drug-claim-name": row["drug_claim_name"].strip("\"").strip(),
             "drug-name": row["drug_name"].strip("\"").strip(),
@@ -31,56 +66,55 @@ def insert_drugs(session, max_rows, num_jobs, batch_size):
 
         dataset.append(data)
 
-    drugs = dict()
+    return dataset
 
-    for data in dataset:
-        if data["chembl-id"] == "":
-            continue
 
-        if data["chembl-id"] not in drugs.keys():
-            drugs[data["chembl-id"]] = {
-                "drug-claim-name": list(),
-                "drug-name": list(),
-                "drug-claim-source": list(),
-            }
+def iter_drug_queries(dataset):
+    dataset = [data for data in dataset if data["chembl-id"] != ""]
+    claim_names = group_by((data["chembl-id"], data["drug-claim-name"] or None) for data in dataset)
+    names = group_by((data["chembl-id"], data["drug-name"] or None) for data in dataset)
+    claim_sources = group_by((data["chembl-id"], data["drug-claim-source"] or None) for data in dataset)
 
-        if data["drug-claim-name"] != "":
-            drugs[data["chembl-id"]]["drug-claim-name"].append(data["drug-claim-name"])
-
-        if data["drug-name"] != "":
-            drugs[data["chembl-id"]]["drug-name"].append(data["drug-name"])
-
-        if data["drug-claim-source"] != "":
-            drugs[data["chembl-id"]]["drug-claim-source"].append(data["drug-claim-source"])
-
-    queries = list()
-
-    for chembl_id in drugs.keys():
+    for chembl_id in claim_names.keys():
         query = "insert $d isa drug, has chembl-id \"{}\"".format(chembl_id)
 
-        for claim_name in drugs[chembl_id]["drug-claim-name"]:
+        for claim_name in claim_names[chembl_id]:
             query += ", has dgidb-claim-name \"{}\"".format(claim_name)
 
-        for name in drugs[chembl_id]["drug-name"]:
+        for name in names[chembl_id]:
             query += ", has dgidb-name \"{}\"".format(name)
 
-        for claim_source in drugs[chembl_id]["drug-claim-source"]:
+        for claim_source in claim_sources[chembl_id]:
             query += ", has drug-claim-source \"{}\"".format(claim_source)
 
         query += ";"
 
-        queries.append(query)
-
-    print("Inserting drugs:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def insert_interactions(session, max_rows, num_jobs, batch_size):
-    get_file("https://www.dgidb.org/data/monthly_tsvs/2021-Jan/interactions.tsv", "dataset/dgidb")
-    rows = read_tsv("dataset/dgidb/interactions.tsv")
+    interactions = filter_known(session, get_interaction_dataset(max_rows), [
+        ("entrez-id", lambda data: data["entrez-id"] or None),
+        ("chembl-id", lambda data: data["chembl-id"]),
+    ])
+
+    interactions = filter_new(
+        "drug-gene-interaction",
+        interactions,
+        lambda data: (data["entrez-id"], data["chembl-id"], data["interaction-type"]),
+    )
+
+    queries = generate_queries(partial(iter_interaction_queries, guard=existence_checks()), interactions)
+    write_batches(session, queries, num_jobs, batch_size, stage="drug-gene interactions")
+
+
+def get_interaction_dataset(max_rows):
+    get_file(*DRUG_INTERACTION_SOURCE)
+    columns = ["gene_name", "entrez_id", "interaction_types", "drug_claim_name", "drug_name", "drug_concept_id"]
+    rows = iter_tsv("dataset/dgidb/interactions.tsv", max_rows=max_rows, columns=columns)
     interactions = list()
 
-    for row in rows[:max_rows]:
+    for row in rows:
         data = {
             "gene-name": row["gene_name"],
             "entrez-id": row["entrez_id"],
@@ -92,8 +126,10 @@ def insert_interactions(session, max_rows, num_jobs, batch_size):
 
         interactions.append(data)
 
-    queries = list()
+    return interactions
 
+
+def iter_interaction_queries(interactions, guard=True):
     for interaction in interactions:
         if interaction["entrez-id"] != "":
             match_clause = " ".join([
@@ -107,17 +143,16 @@ def insert_interactions(session, max_rows, num_jobs, batch_size):
                 interaction["chembl-id"],
             )
 
-            match_clause += " not { (interacting-gene: $g, interacting-drug: $d) isa drug-gene-interaction"
+            guard_clause = " not { (interacting-gene: $g, interacting-drug: $d) isa drug-gene-interaction"
             insert_clause = "insert $r (interacting-gene: $g, interacting-drug: $d) isa drug-gene-interaction"
 
             if interaction["interaction-type"] != "":
-                match_clause += ", has interaction-type \"{}\"".format(interaction["interaction-type"])
+                guard_clause += ", has interaction-type \"{}\"".format(interaction["interaction-type"])
                 insert_clause += ", has interaction-type \"{}\"".format(interaction["interaction-type"])
 
-            match_clause += "; };"
+            if guard:
+                match_clause += guard_clause + "; };"
+
             insert_clause += ";"
             query = match_clause + " " + insert_clause
-            queries.append(query)
-
-    print("Inserting drug-gene interactions:")
-    write_batches(session, queries, num_jobs, batch_size)
+            yield query
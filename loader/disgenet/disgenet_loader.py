@@ -1,64 +1,121 @@
-from loader.util import write_batches, get_file, read_tsv
+from functools import partial
+from loader.cache import cached_dataset
+from loader.dedupe import existence_checks, filter_new
+from loader.download import get_file
+from loader.keys import filter_known
+from loader.rows import record_type
+from loader.scheduler import Stage, memoize
+from loader.util import write_batches, iter_tsv, generate_queries, group_by
+
+
+ASSOCIATION_SOURCE = (
+    "https://www.disgenet.org/static/disgenet_ap1/files/downloads/all_gene_disease_associations.tsv.gz",
+    "dataset/disgenet",
+)
+
+ASSOCIATION_FIELDS = ("entrez-id", "gene-symbol", "disease-id", "disease-name", "disgenet-score")
 
 
 def load_disgenet(session, max_diseases, num_jobs, batch_size):
     if max_diseases is None or max_diseases > 0:
         print("Loading DisGeNET dataset...")
-        insert_associations(session, max_diseases, num_jobs, batch_size)
+        dataset = get_association_dataset(max_diseases)
+        insert_diseases(dataset, session, num_jobs, batch_size)
+        insert_associations(dataset, session, num_jobs, batch_size)
         print("Dataset load complete.")
         print("--------------------------------------------------")
 
 
-def insert_associations(session, max_rows, num_jobs, batch_size):
-    get_file("https://www.disgenet.org/static/disgenet_ap1/files/downloads/all_gene_disease_associations.tsv.gz", "dataset/disgenet")
-    rows = read_tsv("dataset/disgenet/all_gene_disease_associations.tsv.gz", archive="gz")
+def get_disgenet_stages(max_diseases):
+    if max_diseases is not None and max_diseases <= 0:
+        return list()
+
+    dataset = memoize(get_association_dataset, max_diseases)
+
+    return [
+        Stage(
+            "disgenet.diseases",
+            lambda *args: insert_diseases(dataset(), *args),
+            produces=["disease"],
+        ),
+        Stage(
+            "disgenet.associations",
+            lambda *args: insert_associations(dataset(), *args),
+            produces=["disease-gene-interaction"],
+            consumes=["gene", "disease"],
+        ),
+    ]
+
+
+def insert_associations(dataset, session, num_jobs, batch_size):
+    dataset = filter_known(session, dataset, [
+        ("primary-gene-symbol", lambda data: data["gene-symbol"]),
+        ("umls-id", lambda data: data["disease-id"]),
+    ])
+
+    dataset = filter_new("disease-gene-interaction", dataset, get_association_key)
+    queries = generate_queries(
+        partial(iter_association_queries, guard=existence_checks()), dataset, key=get_association_key
+    )
+    write_batches(session, queries, num_jobs, batch_size, stage="gene-disease associations")
+
+
+def get_association_key(data):
+    return data["gene-symbol"], data["disease-id"]
+
+
+@cached_dataset(ASSOCIATION_SOURCE)
+def get_association_dataset(max_rows):
+    get_file(*ASSOCIATION_SOURCE)
+    columns = ["geneId", "geneSymbol", "diseaseId", "diseaseName", "score"]
+    rows = iter_tsv(
+        "dataset/disgenet/all_gene_disease_associations.tsv.gz", archive="gz", max_rows=max_rows, columns=columns
+    )
+
+    record = record_type(ASSOCIATION_FIELDS)
     dataset = list()
 
-    for row in rows[:max_rows]:
-        data = {
-            "entrez-id": row["geneId"],
-            "gene-symbol": row["geneSymbol"],
-            "disease-id": row["diseaseId"],
-            "disease-name": row["diseaseName"],
-            "disgenet-score": row["score"],
-        }
+    for row in rows:
+        dataset.append(record(row["geneId"], row["geneSymbol"], row["diseaseId"], row["diseaseName"], row["score"]))
+
+    return dataset
+
 
-        dataset.append(data)
+def iter_association_queries(dataset, guard=True):
+    statements = [
+        "match",
+        "$g isa gene, has primary-gene-symbol \"{}\";",
+        "$d isa disease, has umls-id \"{}\";",
+    ]
 
-    insert_diseases(dataset, session, num_jobs, batch_size)
-    queries = list()
+    if guard:
+        statements.append("not {{ (interacting-disease: $d, interacting-gene: $g) isa disease-gene-interaction; }};")
+
+    statements += [
+        "insert",
+        "(interacting-disease: $d, interacting-gene: $g) isa disease-gene-interaction, has disgenet-score {};",
+    ]
+
+    template = " ".join(statements)
 
     for data in dataset:
-        query = " ".join([
-            "match",
-            "$g isa gene, has primary-gene-symbol \"{}\";",
-            "$d isa disease, has umls-id \"{}\";",
-            "not {{ (interacting-disease: $d, interacting-gene: $g) isa disease-gene-interaction; }};",
-            "insert",
-            "(interacting-disease: $d, interacting-gene: $g) isa disease-gene-interaction, has disgenet-score {};",
-        ]).format(
+        query = template.format(
             data['gene-symbol'],
             data['disease-id'],
             data['disgenet-score'],
         )
 
-        queries.append(query)
-
-    print("Inserting gene-disease associations:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def insert_diseases(dataset, session, num_jobs, batch_size):
-    diseases = dict()
-    queries = list()
+    write_batches(session, iter_disease_queries(dataset), num_jobs, batch_size, stage="diseases")
 
-    for data in dataset:
-        if data["disease-id"] != "":
-            if data["disease-id"] not in diseases:
-                diseases[data["disease-id"]] = set()
 
-            if data["disease-name"] != "":
-                diseases[data["disease-id"]].add(data["disease-name"])
+def iter_disease_queries(dataset):
+    diseases = group_by(
+        (data["disease-id"], data["disease-name"] or None) for data in dataset if data["disease-id"] != ""
+    )
 
     for disease_id in diseases.keys():
         query = "insert $d isa disease, has umls-id \"{}\"".format(disease_id)
@@ -67,7 +124,4 @@ def insert_diseases(dataset, session, num_jobs, batch_size):
             query += ", has disease-name \"{}\"".format(name)
 
         query += ";"
-        queries.append(query)
-
-    print("Inserting diseases:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""Define the download manager, fetching the source files of the loaders concurrently and resumably.
+
+The files of every loader that will run are requested when the load starts, and downloaded by background
+threads while the first stages run, up to download_jobs at a time. A loader needing a file waits for its
+download, or starts it if it was not requested.
+
+Each file is downloaded to a .part file next to it, which an interrupted download leaves behind and the
+next attempt resumes with an HTTP Range request, guarded by If-Range so that a file changed in between is
+downloaded whole. A partial file without the ETag or Last-Modified of the response it was started from is
+downloaded again whole, as a change of the file on the server could not be detected. Once its size matches
+the one announced by the server, the file is moved to the store under its SHA-256 hash, and its path is
+replaced by a hard link to it. The manifest records the URL, size, hash, ETag and Last-Modified of the
+current snapshot of every file, and the previous snapshots, which stay in the store.
+
+A file is used as is if it matches its entry, which is cheap to check as it is only hashed again if it was
+modified since it was recorded. With the refresh_sources writer option set, it is then requested with
+If-None-Match and If-Modified-Since, so that an unchanged source costs one round trip and keeps its hash,
+and with it the entries of the parsed dataset cache. A source that cannot be reached keeps its snapshot. A
+file without an entry, such as one downloaded by an older version of the loader, or that does not match
+its entry, is downloaded again.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from urllib.error import URLError
+import requests
+import urllib3
+from loader.util import writer_options
+
+
+MANIFEST_PATH = "dataset/manifest.json"
+STORE_DIR = "dataset/store"
+SNAPSHOT_KEYS = ("sha256", "etag", "last_modified", "fetched")
+DOWNLOAD_CHUNK_BYTES = 1 << 20
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_TIMEOUT = 60
+
+
+class DownloadError(URLError):
+    def __init__(self, url):
+        self.message = "Could not download data files from {}. Check internet connection and status of data host.".format(url)
+        super(DownloadError, self).__init__(self.message)
+
+
+class IncompleteDownload(Exception):
+    """Raised when a response ends before the announced size, so that the download is resumed."""
+
+
+class DownloadManager:
+    """Download source files in background threads, each file once per process."""
+
+    def __init__(self, manifest_path=MANIFEST_PATH, store_dir=STORE_DIR):
+        self.manifest_path = manifest_path
+        self.store_dir = store_dir
+        self._manifest = None
+        self._futures = dict()
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def prefetch(self, sources):
+        """Start downloading files in the background.
+
+        :param sources: Pairs of a URL and the directory to download it to
+        """
+        for url, directory in sources:
+            self._submit(url, directory)
+
+    def get(self, url, directory):
+        """Return the path of a downloaded file, waiting for or starting its download.
+
+        :param url: The URL of the file
+        :param directory: The directory to download it to
+        :return: The path of the file
+        """
+        return self._submit(url, directory).result()
+
+    def wait(self):
+        """Wait for every download started, raising the error of the first that failed."""
+        with self._lock:
+            futures = list(self._futures.values())
+
+        for future in futures:
+            future.result()
+
+    def _submit(self, url, directory):
+        path = os.path.join(directory, url.split("/")[-1])
+
+        with self._lock:
+            if path not in self._futures:
+                if self._semaphore is None:
+                    self._semaphore = threading.BoundedSemaphore(writer_options["download_jobs"])
+
+                self._futures[path] = Future()
+                # Daemon threads let the loader exit during a download, which the next run resumes.
+                thread = threading.Thread(
+                    target=self._run, args=(self._futures[path], url, path), name="download", daemon=True
+                )
+                thread.start()
+
+            return self._futures[path]
+
+    def _run(self, future, url, path):
+        with self._semaphore:
+            try:
+                future.set_result(self.download(url, path))
+            except BaseException as error:
+                future.set_exception(error)
+
+    def download(self, url, path):
+        """Download a file unless it matches its manifest entry, or refresh it if refresh_sources is set.
+
+        :param url: The URL of the file
+        :param path: The path of the file
+        :return: The path of the file
+        """
+        part_path = path + ".part"
+        recorded = self._read_manifest().get(path)
+        entry = recorded
+
+        if os.path.exists(path):
+            if entry is None:
+                os.replace(path, part_path)
+            elif not self._verify(url, path, entry):
+                os.remove(path)
+                entry = None
+            elif not writer_options["refresh_sources"]:
+                return path
+        else:
+            entry = None
+
+        print("  {} {}".format("Refreshing" if entry is not None else "Downloading", url))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            try:
+                snapshot = self._fetch(url, part_path, entry)
+                break
+            except (requests.RequestException, urllib3.exceptions.HTTPError, IncompleteDownload) as error:
+                response = getattr(error, "response", None)
+
+                # Client errors such as a missing file are not retried, and a failed refresh keeps the snapshot.
+                if attempt == DOWNLOAD_RETRIES or (response is not None and response.status_code < 500):
+                    if entry is not None:
+                        print("  Could not refresh {}, keeping the snapshot from {}: {}".format(
+                            url, entry.get("fetched"), error
+                        ))
+                        return path
+
+                    raise DownloadError(url) from error
+
+                print("  Download of {} interrupted, resuming: {}".format(url, error))
+                time.sleep(writer_options["retry_backoff"] * 2 ** attempt)
+
+        if snapshot is None:
+            print("  {} is unchanged since {}".format(url, entry.get("fetched")))
+            return path
+
+        self._store(part_path, path, snapshot["sha256"])
+        stat = os.stat(path)
+        history = list()
+
+        if recorded is not None:
+            history = recorded.get("history", list())
+
+            if recorded["sha256"] != snapshot["sha256"]:
+                history = history + [{key: recorded.get(key) for key in SNAPSHOT_KEYS}]
+
+        self._record(path, dict(snapshot, url=url, size=stat.st_size, mtime_ns=stat.st_mtime_ns, history=history))
+        print("  Finished downloading {}".format(url))
+        return path
+
+    def _fetch(self, url, part_path, entry=None):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validators = read_validators(part_path) if offset > 0 else dict()
+
+        if offset > 0 and not (validators.get("etag") or validators.get("last_modified")):
+            # Without If-Range, the tail of a changed file would be appended to the head of the old one.
+            remove_partial_file(part_path)
+            offset = 0
+            validators = dict()
+
+        # Compressed transfers would be stored decompressed, and their offsets do not match the file.
+        headers = {"Accept-Encoding": "identity"}
+
+        if offset > 0:
+            # The server sends the whole file instead if it changed since the partial file was started.
+            headers["Range"] = "bytes={}-".format(offset)
+            headers["If-Range"] = validators.get("etag") or validators["last_modified"]
+        elif entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            if response.status_code == 304:
+                return None
+
+            if response.status_code == 416:
+                # The partial file is already complete, unless it is larger than the file on the server.
+                total = int(response.headers.get("Content-Range", "*/-1").split("/")[-1])
+
+                if total != offset:
+                    os.remove(part_path)
+                    raise IncompleteDownload("partial file does not match the file on the server")
+
+                return get_snapshot(hash_file(part_path).hexdigest(), validators)
+
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                start, total = parse_content_range(response.headers["Content-Range"])
+
+                if start != offset:
+                    raise IncompleteDownload("server resumed at byte {} instead of {}".format(start, offset))
+
+                digest = hash_file(part_path)
+                mode = "ab"
+            else:
+                total = int(response.headers["Content-Length"]) if "Content-Length" in response.headers else None
+                digest = hashlib.sha256()
+                mode = "wb"
+                validators = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+                write_validators(part_path, validators)
+
+            with open(part_path, mode) as file:
+                for chunk in response.raw.stream(DOWNLOAD_CHUNK_BYTES, decode_content=False):
+                    file.write(chunk)
+                    digest.update(chunk)
+
+                file.flush()
+                os.fsync(file.fileno())
+
+        size = os.path.getsize(part_path)
+
+        if total is not None and size != total:
+            raise IncompleteDownload("received {} of {} bytes".format(size, total))
+
+        return get_snapshot(digest.hexdigest(), validators)
+
+    def _store(self, part_path, path, sha256):
+        """Move a completed download into the store under its hash, and link its path to it."""
+        blob_path = os.path.join(self.store_dir, sha256)
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        # A stored copy of the same version is replaced too, in case it was modified through a link.
+        os.replace(part_path, blob_path)
+
+        if os.path.exists(part_path + ".json"):
+            os.remove(part_path + ".json")
+
+        temp_path = "{}.tmp-{}".format(path, os.getpid())
+
+        try:
+            os.link(blob_path, temp_path)
+        except OSError:
+            # Hard links are not supported across file systems, or by every file system.
+            shutil.copyfile(blob_path, temp_path)
+
+        os.replace(temp_path, path)
+
+    def get_digest(self, path):
+        """Return the SHA-256 hash of a downloaded file recorded in the manifest, or None if it may have changed.
+
+        :param path: The path of the file
+        :return: The hex digest, or None
+        """
+        entry = self._read_manifest().get(path)
+
+        if entry is None or not os.path.exists(path):
+            return None
+
+        stat = os.stat(path)
+
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            return None
+
+        return entry["sha256"]
+
+    def _verify(self, url, path, entry):
+        if entry["url"] != url:
+            return False
+
+        stat = os.stat(path)
+
+        if stat.st_size != entry["size"]:
+            return False
+
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+
+        if hash_file(path).hexdigest() != entry["sha256"]:
+            return False
+
+        self._record(path, dict(entry, mtime_ns=stat.st_mtime_ns))
+        return True
+
+    def _read_manifest(self):
+        with self._lock:
+            if self._manifest is None:
+                if os.path.exists(self.manifest_path):
+                    with open(self.manifest_path, "r", encoding="utf-8") as file:
+                        self._manifest = json.load(file)
+                else:
+                    self._manifest = dict()
+
+            return self._manifest
+
+    def _record(self, path, entry):
+        manifest = self._read_manifest()
+
+        with self._lock:
+            manifest[path] = entry
+            temp_path = "{}.tmp-{}".format(self.manifest_path, os.getpid())
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+
+            with open(temp_path, "w", encoding="utf-8") as file:
+                json.dump(manifest, file, indent=4, sort_keys=True)
+
+            os.replace(temp_path, self.manifest_path)
+
+
+downloads = DownloadManager()
+
+
+def get_file(url, path):
+    """Download a file to a directory, unless it was already downloaded.
+
+    example inputs:
+    url = "https://www.dgidb.org/data/monthly_tsvs/2021-Jan/drugs.tsv"
+    path ='dataset/dgidb'
+    """
+    return downloads.get(url, path)
+
+
+def get_snapshot(sha256, validators):
+    """Return the manifest fields of a snapshot fetched now, with the validators of its response."""
+    return {
+        "sha256": sha256,
+        "etag": validators.get("etag"),
+        "last_modified": validators.get("last_modified"),
+        "fetched": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def read_validators(part_path):
+    """Return the ETag and Last-Modified of the response a partial file was started from, if recorded."""
+    if not os.path.exists(part_path + ".json"):
+        return dict()
+
+    with open(part_path + ".json", "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def remove_partial_file(part_path):
+    os.remove(part_path)
+
+    if os.path.exists(part_path + ".json"):
+        os.remove(part_path + ".json")
+
+
+def write_validators(part_path, validators):
+    with open(part_path + ".json", "w", encoding="utf-8") as file:
+        json.dump(validators, file)
+
+
+def parse_content_range(content_range):
+    """Return the first byte and total size of a Content-Range header, with None for an unknown size."""
+    first, total = content_range.split(" ")[-1].split("/")
+    return int(first.split("-")[0]), None if total == "*" else int(total)
+
+
+def hash_file(path):
+    """Return the SHA-256 hash object of a file, to which the rest of a partial file can be added."""
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+
+    return digest
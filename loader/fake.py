@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""Define an in-memory stand-in for the TypeDB client, for running loads without a server.
+
+The fake implements the part of the client API used by the loader and schema initialisation: database
+management, sessions, write transactions and define, insert and match queries. Queries are not executed,
+only counted, with an optional bounded sample of the committed ones, so a load against it measures the
+throughput of the client side of the loaders alone, in constant memory. Match queries return no answers.
+Commits can be given a simulated latency, and fail at configured rates with transaction conflicts or
+injected errors, to exercise the retry, bisection and adaptive code paths.
+"""
+import random
+import threading
+import time
+from typedb.api.connection.session import SessionType
+from typedb.api.connection.transaction import TransactionType
+from typedb.common.exception import TypeDBClientException
+
+
+class FakeDatabase:
+    """A database of the fake server, counting the queries it receives and commits.
+
+    :param sample_size: The number of committed data queries kept in sample, the first ones committed
+    """
+
+    def __init__(self, name, manager, sample_size=0):
+        self._name = name
+        self._manager = manager
+        self.sample_size = sample_size
+        self.schema = list()
+        self.sample = list()
+        self.queries = 0
+        self.committed = 0
+        self.commits = 0
+        self.conflicts = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def name(self):
+        return self._name
+
+    def delete(self):
+        self._manager.remove(self._name)
+
+
+class FakeDatabaseManager:
+
+    def __init__(self, sample_size=0):
+        self._databases = dict()
+        self._lock = threading.Lock()
+        self._sample_size = sample_size
+
+    def contains(self, name):
+        with self._lock:
+            return name in self._databases
+
+    def create(self, name):
+        with self._lock:
+            if name in self._databases:
+                raise TypeDBClientException("The database '{}' already exists.".format(name))
+
+            self._databases[name] = FakeDatabase(name, self, self._sample_size)
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._databases:
+                raise TypeDBClientException("The database '{}' does not exist.".format(name))
+
+            return self._databases[name]
+
+    def get_or_create(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = FakeDatabase(name, self, self._sample_size)
+
+            return self._databases[name]
+
+    def remove(self, name):
+        with self._lock:
+            del self._databases[name]
+
+    def all(self):
+        with self._lock:
+            return list(self._databases.values())
+
+
+class FakeClient:
+    """An in-memory stand-in for a TypeDB client.
+
+    Sessions may be opened on databases that were not created, so that each shard process of a sharded
+    load, which has its own fake server, can write without initialising the schema.
+
+    :param commit_latency: Seconds each commit takes
+    :param query_latency: Seconds each query takes
+    :param conflict_rate: Probability that a commit fails with a transaction conflict
+    :param failure_rate: Probability that a commit fails with an injected error
+    :param seed: Seed of the random choice of failing commits
+    :param sample_size: The number of committed data queries each database keeps in sample
+    """
+
+    def __init__(
+        self, commit_latency=0.0, query_latency=0.0, conflict_rate=0.0, failure_rate=0.0, seed=None, sample_size=0
+    ):
+        self.commit_latency = commit_latency
+        self.query_latency = query_latency
+        self.conflict_rate = conflict_rate
+        self.failure_rate = failure_rate
+        self._databases = FakeDatabaseManager(sample_size)
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._open = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def databases(self):
+        return self._databases
+
+    def session(self, database, session_type, options=None):
+        return FakeSession(self, self._databases.get_or_create(database), session_type)
+
+    def is_cluster(self):
+        return False
+
+    def is_open(self):
+        return self._open
+
+    def close(self):
+        self._open = False
+
+    def draw_outcome(self):
+        """Choose whether a commit succeeds, conflicts or fails."""
+        with self._random_lock:
+            draw = self._random.random()
+
+        if draw < self.conflict_rate:
+            return "conflict"
+        elif draw < self.conflict_rate + self.failure_rate:
+            return "failure"
+        else:
+            return "success"
+
+
+class FakeSession:
+
+    def __init__(self, client, database, session_type):
+        self.client = client
+        self._database = database
+        self._session_type = session_type
+        self._open = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def transaction(self, transaction_type, options=None):
+        if not self._open:
+            raise TypeDBClientException("The session has been closed and no further operation is allowed.")
+
+        return FakeTransaction(self, transaction_type)
+
+    def database(self):
+        return self._database
+
+    def session_type(self):
+        return self._session_type
+
+    def is_open(self):
+        return self._open
+
+    def close(self):
+        self._open = False
+
+
+class FakeTransaction:
+    """A transaction of the fake server, which is also its own query manager."""
+
+    def __init__(self, session, transaction_type):
+        self.session = session
+        self._transaction_type = transaction_type
+        self._pending = list()
+        self._open = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def query(self):
+        return self
+
+    def define(self, query, options=None):
+        if self.session.session_type() != SessionType.SCHEMA:
+            raise TypeDBClientException("Schema queries can only be run in schema sessions.")
+
+        self._add(query)
+
+    def insert(self, query, options=None):
+        if self._transaction_type != TransactionType.WRITE:
+            raise TypeDBClientException("Write queries can only be run in write transactions.")
+
+        self._add(query)
+        return iter(())
+
+    def match(self, query, options=None):
+        return iter(())
+
+    def _add(self, query):
+        if not self._open:
+            raise TypeDBClientException("The transaction has been closed and no further operation is allowed.")
+
+        if self.session.client.query_latency > 0:
+            time.sleep(self.session.client.query_latency)
+
+        self._pending.append(query)
+        database = self.session.database()
+
+        with database.lock:
+            database.queries += 1
+
+    def commit(self):
+        client = self.session.client
+        database = self.session.database()
+        self._open = False
+
+        if client.commit_latency > 0:
+            time.sleep(client.commit_latency)
+
+        outcome = client.draw_outcome()
+
+        with database.lock:
+            if outcome == "conflict":
+                database.conflicts += 1
+                raise TypeDBClientException("[TXN01] Transaction conflict: the transaction could not be committed.")
+            elif outcome == "failure":
+                database.failures += 1
+                raise TypeDBClientException("[FAKE01] Injected commit failure.")
+
+            database.commits += 1
+
+            if self.session.session_type() == SessionType.SCHEMA:
+                database.schema += self._pending
+            else:
+                database.committed += len(self._pending)
+                database.sample += self._pending[:database.sample_size - len(database.sample)]
+
+    def rollback(self):
+        self._pending = list()
+
+    def transaction_type(self):
+        return self._transaction_type
+
+    def is_open(self):
+        return self._open
+
+    def close(self):
+        self._open = False
@@ -1,4 +1,24 @@
-from loader.util import write_batches, get_file, read_tsv
+from loader.cache import cached_dataset
+from loader.download import get_file
+from loader.keys import filter_known
+from loader.rows import record_type
+from loader.scheduler import Stage, memoize
+from loader.util import write_batches, iter_tsv, generate_queries, group_by, writer_options
+
+
+TISSUE_SOURCE = ("https://www.proteinatlas.org/download/normal_tissue.tsv.zip", "dataset/hpa")
+
+TISSUE_FIELDS = (
+    "ensembl-gene-id",
+    "gene-symbol",
+    "tissue",
+    "cell-type",
+    "expression-value",
+    "expression-value-reliability",
+)
+
+# Each gene has a row per cell type, of few tissues, cell types, levels and reliabilities.
+TISSUE_CATEGORICAL = ("tissue", "cell-type", "expression-value", "expression-value-reliability")
 
 
 def load_hpa(session, max_tissues, num_jobs, batch_size):
@@ -12,47 +32,68 @@ def load_hpa(session, max_tissues, num_jobs, batch_size):
         print("--------------------------------------------------")
 
 
+def get_hpa_stages(max_tissues, cobatch=False):
+    if max_tissues is not None and max_tissues <= 0:
+        return list()
+
+    dataset = memoize(get_tissue_dataset, max_tissues)
+    insert_expressions = insert_grouped_gene_tissue if cobatch else insert_gene_tissue
+
+    return [
+        Stage(
+            "hpa.tissues",
+            lambda *args: insert_tissue(dataset(), *args),
+            produces=["tissue", "cell", "tissue-composition"],
+        ),
+        Stage(
+            "hpa.gene-ids",
+            lambda *args: insert_ensemble_id(dataset(), *args),
+            produces=["ensembl-gene-id"],
+            consumes=["gene"],
+        ),
+        Stage(
+            "hpa.expressions",
+            lambda *args: insert_expressions(dataset(), *args),
+            produces=["cell-expression"],
+            consumes=["gene", "tissue", "cell", "tissue-composition"],
+        ),
+    ]
+
+
+@cached_dataset(TISSUE_SOURCE)
 def get_tissue_dataset(max_rows):
-    get_file("https://www.proteinatlas.org/download/normal_tissue.tsv.zip", "dataset/hpa")
-    rows = read_tsv("dataset/hpa/normal_tissue.tsv.zip", archive="zip")
+    get_file(*TISSUE_SOURCE)
+    columns = ["Gene", "Gene name", "Tissue", "Cell type", "Level", "Reliability"]
+    rows = iter_tsv("dataset/hpa/normal_tissue.tsv.zip", archive="zip", max_rows=max_rows, columns=columns)
+    record = record_type(TISSUE_FIELDS, categorical=TISSUE_CATEGORICAL)
     dataset = list()
 
-    if max_rows is None:
-        max_rows = len(rows)
-
-    for row in rows[:max_rows]:
-        data = {
-            "ensembl-gene-id": row["Gene"],
-            "gene-symbol": row["Gene name"],
-            "tissue": row["Tissue"].rstrip("1234567890").strip(),
-            "cell-type": row["Cell type"],
-            "expression-value": row["Level"],
-            "expression-value-reliability": row["Reliability"],
-        }
-
-        if data["expression-value"].lower() in ("low", "medium", "high", "ascending", "descending"):
-            dataset.append(data)
-        elif data["expression-value"].lower() in ("not detected", "not representative", "n/a"):
+    for row in rows:
+        level = row["Level"]
+
+        if level.lower() in ("low", "medium", "high", "ascending", "descending"):
+            dataset.append(record(
+                row["Gene"],
+                row["Gene name"],
+                row["Tissue"].rstrip("1234567890").strip(),
+                row["Cell type"],
+                level,
+                row["Reliability"],
+            ))
+        elif level.lower() in ("not detected", "not representative", "n/a"):
             pass
         else:
-            raise ValueError("Unhandled gene expression value: {}".format(data["expression-value"]))
+            raise ValueError("Unhandled gene expression value: {}".format(level))
 
     return dataset
 
 
 def insert_tissue(dataset, session, num_jobs, batch_size):
-    cell_types = dict()
+    write_batches(session, iter_tissue_queries(dataset), num_jobs, batch_size, stage="tissues")
 
-    for data in dataset:
-        if data["tissue"] not in cell_types.keys():
-            cell_types[data["tissue"]] = set()
-
-        cell_types[data["tissue"]].add(data["cell-type"])
-
-    for tissue in cell_types.keys():
-        cell_types[tissue] = list(cell_types[tissue])
 
-    queries = list()
+def iter_tissue_queries(dataset):
+    cell_types = group_by((data["tissue"], data["cell-type"]) for data in dataset)
 
     for tissue in cell_types.keys():
         query = "insert $t isa tissue, has tissue-name \"{}\";".format(tissue)
@@ -61,22 +102,20 @@ def insert_tissue(dataset, session, num_jobs, batch_size):
             query += " $c{} isa cell, has cell-name \"{}\";".format(i, cell_name)
             query += " (composed-tissue: $t, composing-cell: $c{}) isa tissue-composition;".format(i)
 
-        queries.append(query)
+        yield query
 
-    print("Inserting tissues:")
-    write_batches(session, queries, num_jobs, batch_size)
 
+def filter_known_genes(session, dataset):
+    return filter_known(session, dataset, [("primary-gene-symbol", lambda data: data["gene-symbol"])])
 
-def insert_ensemble_id(dataset, session, num_jobs, batch_size):
-    ensembl_ids = dict()
 
-    for data in dataset:
-        if data["gene-symbol"] not in ensembl_ids.keys():
-            ensembl_ids[data["gene-symbol"]] = set()
+def insert_ensemble_id(dataset, session, num_jobs, batch_size):
+    dataset = filter_known_genes(session, dataset)
+    write_batches(session, iter_ensemble_id_queries(dataset), num_jobs, batch_size, stage="additional gene IDs")
 
-        ensembl_ids[data["gene-symbol"]].add(data["ensembl-gene-id"])
 
-    queries = list()
+def iter_ensemble_id_queries(dataset):
+    ensembl_ids = group_by((data["gene-symbol"], data["ensembl-gene-id"]) for data in dataset)
 
     for gene in ensembl_ids.keys():
         query = "match $g isa gene, has primary-gene-symbol \"{}\"; insert".format(gene)
@@ -84,15 +123,18 @@ def insert_ensemble_id(dataset, session, num_jobs, batch_size):
         for ensembl_id in ensembl_ids[gene]:
             query += " $g has ensembl-gene-id \"{}\";".format(ensembl_id)
 
-        queries.append(query)
-
-    print("Inserting additional gene IDs:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def insert_gene_tissue(dataset, session, num_jobs, batch_size):
-    queries = list()
+    dataset = filter_known_genes(session, dataset)
+    queries = generate_queries(
+        iter_gene_tissue_queries, dataset, key=lambda data: (data["gene-symbol"], data["tissue"], data["cell-type"])
+    )
+    write_batches(session, queries, num_jobs, batch_size, stage="gene-tissue expressions")
 
+
+def iter_gene_tissue_queries(dataset):
     for data in dataset:
         query = " ".join([
             "match",
@@ -115,7 +157,70 @@ def insert_gene_tissue(dataset, session, num_jobs, batch_size):
             data["expression-value-reliability"],
         )
 
-        queries.append(query)
+        yield query
+
 
-    print("Inserting gene-tissue expressions:")
-    write_batches(session, queries, num_jobs, batch_size)
+# A group matches nothing if any of its tissue compositions is missing, losing every expression of the gene, so
+# the expressions are only grouped if the compositions in the database can be read to drop the rows that would
+# not match. Otherwise they are inserted by a query per row, which only loses the rows that do not match.
+def insert_grouped_gene_tissue(dataset, session, num_jobs, batch_size):
+    if not writer_options["preload_keys"] or session is None:
+        insert_gene_tissue(dataset, session, num_jobs, batch_size)
+        return
+
+    dataset = filter_known(session, dataset, [
+        ("primary-gene-symbol", lambda data: data["gene-symbol"]),
+        ("tissue-composition", lambda data: (data["tissue"], data["cell-type"])),
+    ])
+
+    queries = generate_queries(
+        iter_grouped_gene_tissue_queries, group_gene_tissue(dataset), key=lambda group: group[0]["gene-symbol"]
+    )
+    write_batches(session, queries, num_jobs, batch_size, stage="gene-tissue expressions by gene")
+
+
+def group_gene_tissue(dataset):
+    return list(group_by(((data["gene-symbol"], data) for data in dataset), unique=False).values())
+
+
+# The genes are loaded by UniProt and may be missing, so they cannot be inserted with the tissues. Instead, all
+# the expressions of a gene are inserted by one query, matching the gene and each of its tissues and cells once.
+def iter_grouped_gene_tissue_queries(groups):
+    for group in groups:
+        tissues = dict()
+        cells = dict()
+        match_clause = "match $g isa gene, has primary-gene-symbol \"{}\";".format(group[0]["gene-symbol"])
+        insert_clause = "insert"
+
+        for data in group:
+            if data["tissue"] not in tissues:
+                tissues[data["tissue"]] = "$t{}".format(len(tissues))
+                match_clause += " {} isa tissue, has tissue-name \"{}\";".format(
+                    tissues[data["tissue"]], data["tissue"]
+                )
+
+            cell_key = (data["tissue"], data["cell-type"])
+
+            if cell_key not in cells:
+                cells[cell_key] = "$c{}".format(len(cells))
+                match_clause += " " + " ".join([
+                    "{0} isa cell,",
+                    "has cell-name \"{1}\";",
+                    "(composed-tissue: {2}, composing-cell: {0}) isa tissue-composition;",
+                ]).format(
+                    cells[cell_key],
+                    data["cell-type"],
+                    tissues[data["tissue"]],
+                )
+
+            insert_clause += " " + " ".join([
+                "(expressed-gene: $g, expressing-cell: {}) isa cell-expression,",
+                "has expression-value \"{}\",",
+                "has expression-value-reliability \"{}\";",
+            ]).format(
+                cells[cell_key],
+                data["expression-value"],
+                data["expression-value-reliability"],
+            )
+
+        yield match_clause + " " + insert_clause
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Define the index of entity keys in the database, used to drop queries that cannot match.
+
+Relation loaders match the entities they connect by key attributes, and emit a query for every source row
+even where an entity was never loaded, such as a DisGeNET gene that UniProt does not cover. The server
+evaluates the match of each such query, which returns nothing. With the preload_keys writer option set,
+the keys a relation stage refers to are read from the database with paginated read transactions the first
+time a stage needs them, and the rows referring to missing entities are dropped before their queries are
+generated.
+
+Relation stages consume the entities they match, so the key sets are complete once read, and are shared by
+every later stage of the load. The keys of the few relations that other relations match, such as the tissue
+compositions of HPA cells, are read the same way as pairs of the keys of the entities they connect.
+"""
+import threading
+from typedb.api.connection.transaction import TransactionType
+from loader.util import filter_rows, get_stage_metrics, writer_options
+
+
+KEY_OWNERS = {
+    "primary-gene-symbol": "gene",
+    "entrez-id": "gene",
+    "ensembl-gene-id": "gene",
+    "uniprot-id": "protein",
+    "chembl-id": "drug",
+    "umls-id": "disease",
+    "reactome-id": "pathway",
+}
+
+# Relations with few instances are read whole in one transaction, as pairs of the values of $k1 and $k2.
+RELATION_KEYS = {
+    "tissue-composition": " ".join([
+        "match $t isa tissue, has tissue-name $k1;",
+        "$c isa cell, has cell-name $k2;",
+        "(composed-tissue: $t, composing-cell: $c) isa tissue-composition;",
+        "get $k1, $k2;",
+    ]),
+}
+
+
+class KeyIndex:
+    """The key sets of the database, each read once on first use."""
+
+    def __init__(self):
+        self._keys = dict()
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    def get(self, session, attribute):
+        """Return the set of values of a key attribute, or of pairs of a relation in RELATION_KEYS, reading it
+        from the database if not yet read."""
+        with self._lock:
+            lock = self._locks.setdefault(attribute, threading.Lock())
+
+        with lock:
+            if attribute not in self._keys:
+                if attribute in RELATION_KEYS:
+                    self._keys[attribute] = read_relation_keys(session, RELATION_KEYS[attribute])
+                else:
+                    self._keys[attribute] = read_keys(session, attribute, writer_options["key_page_size"])
+                print("[keys] Read {} {} keys.".format(len(self._keys[attribute]), attribute))
+
+            return self._keys[attribute]
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+index = KeyIndex()
+
+
+def read_keys(session, attribute, page_size):
+    """Read the values of a key attribute owned by its entity type, in pages of sorted values.
+
+    Each page is read in its own transaction, starting after the last value of the previous page, so that
+    no transaction stays open for the whole read and no page repeats the scan of the ones before it.
+
+    :param session: A data session
+    :param attribute: The key attribute, as named in KEY_OWNERS
+    :param page_size: The number of values per page
+    :return: The set of values
+    """
+    keys = set()
+    last = None
+
+    while True:
+        query = "match $o isa {}, has {} $k;".format(KEY_OWNERS[attribute], attribute)
+
+        if last is not None:
+            query += " $k > \"{}\";".format(last.replace("\\", "\\\\").replace("\"", "\\\""))
+
+        query += " get $k; sort $k; limit {};".format(page_size)
+
+        with session.transaction(TransactionType.READ) as transaction:
+            page = [answer.get("k").get_value() for answer in transaction.query().match(query)]
+
+        keys.update(page)
+
+        if len(page) < page_size:
+            return keys
+
+        last = page[-1]
+
+
+def read_relation_keys(session, query):
+    """Read the pairs of keys of the entities connected by the instances of a relation.
+
+    :param session: A data session
+    :param query: The match query of the relation, getting the keys as $k1 and $k2
+    :return: The set of pairs
+    """
+    with session.transaction(TransactionType.READ) as transaction:
+        return {
+            (answer.get("k1").get_value(), answer.get("k2").get_value())
+            for answer in transaction.query().match(query)
+        }
+
+
+def filter_known(session, rows, keys):
+    """Drop the rows referring to keys missing from the database, if the preload_keys writer option is set.
+
+    Rows are kept unchanged without a session, such as when compiling a load.
+
+    :param session: A data session
+    :param rows: A list or pandas DataFrame of rows
+    :param keys: Pairs of a key attribute, or a relation in RELATION_KEYS, and a function returning the value of
+        it a row refers to, or None if it refers to none
+    :return: The rows that can match, as a list or DataFrame, or the rows unchanged if preload_keys is unset
+    """
+    if not writer_options["preload_keys"] or session is None:
+        return rows
+
+    key_sets = [(index.get(session, attribute), key) for attribute, key in keys]
+
+    def can_match(row):
+        for key_set, key in key_sets:
+            value = key(row)
+
+            if value is not None and value not in key_set:
+                return False
+
+        return True
+
+    known_rows = filter_rows(rows, can_match)
+    get_stage_metrics().add("rows_unmatched", len(rows) - len(known_rows))
+    return known_rows
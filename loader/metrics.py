@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""Define per-stage load metrics, and their JSON and Prometheus textfile reports."""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+PHASES = ("parse", "generation", "write")
+RSS_INTERVAL = 0.5
+
+
+class StageMetrics:
+    """Collect the metrics of one loader stage.
+
+    Phase times are exclusive: time spent in a phase nested in another, such as parsing a dataset lazily
+    while generating queries, is only counted towards the inner phase.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_parsed = 0
+        self.rows_cached = 0
+        self.rows_deduplicated = 0
+        self.rows_unmatched = 0
+        self.queries_generated = 0
+        self.queries_committed = 0
+        self.batches_failed = 0
+        self.commit_latencies = list()
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.wall_seconds = 0.0
+        self.peak_rss_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def add_latency(self, latency):
+        with self._lock:
+            self.commit_latencies.append(latency)
+
+    def add_phase(self, phase, seconds):
+        with self._lock:
+            self.phase_seconds[phase] += seconds
+
+    def observe_rss(self, rss):
+        with self._lock:
+            self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+
+    @contextmanager
+    def phase(self, phase):
+        """Attribute the time spent in the block to a phase, excluding nested phases."""
+        stack = _get_phase_stack()
+        entry = [time.perf_counter(), 0.0]
+        stack.append(entry)
+
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - entry[0]
+            self.add_phase(phase, elapsed - entry[1])
+
+            if len(stack) > 0:
+                stack[-1][1] += elapsed
+
+    def iter_generated(self, queries):
+        """Count the queries drawn from an iterable and attribute the time spent producing them to generation."""
+        iterator = iter(queries)
+
+        while True:
+            with self.phase("generation"):
+                try:
+                    query = next(iterator)
+                except StopIteration:
+                    return
+
+            self.add("queries_generated")
+            yield query
+
+    def snapshot(self):
+        """Return the raw metrics, for merging into the metrics of another process."""
+        with self._lock:
+            return {
+                "rows_parsed": self.rows_parsed,
+                "rows_cached": self.rows_cached,
+                "rows_deduplicated": self.rows_deduplicated,
+                "rows_unmatched": self.rows_unmatched,
+                "queries_generated": self.queries_generated,
+                "queries_committed": self.queries_committed,
+                "batches_failed": self.batches_failed,
+                "commit_latencies": list(self.commit_latencies),
+                "phase_seconds": dict(self.phase_seconds),
+                "wall_seconds": self.wall_seconds,
+                "peak_rss_bytes": self.peak_rss_bytes,
+            }
+
+    def merge(self, snapshot):
+        """Add the metrics of the same stage run in another process, such as a shard."""
+        with self._lock:
+            for counter in (
+                "rows_parsed",
+                "rows_cached",
+                "rows_deduplicated",
+                "rows_unmatched",
+                "queries_generated",
+                "queries_committed",
+                "batches_failed",
+            ):
+                setattr(self, counter, getattr(self, counter) + snapshot[counter])
+
+            self.commit_latencies += snapshot["commit_latencies"]
+
+            for phase, seconds in snapshot["phase_seconds"].items():
+                self.phase_seconds[phase] += seconds
+
+            self.wall_seconds = max(self.wall_seconds, snapshot["wall_seconds"])
+            self.peak_rss_bytes = max(self.peak_rss_bytes, snapshot["peak_rss_bytes"])
+
+    def report(self):
+        """Return the summarised metrics of the stage."""
+        with self._lock:
+            latencies = sorted(self.commit_latencies)
+
+            return {
+                "rows_parsed": self.rows_parsed,
+                "rows_cached": self.rows_cached,
+                "rows_deduplicated": self.rows_deduplicated,
+                "rows_unmatched": self.rows_unmatched,
+                "queries_generated": self.queries_generated,
+                "queries_committed": self.queries_committed,
+                "batches_committed": len(latencies),
+                "batches_failed": self.batches_failed,
+                "commit_latency_seconds": {
+                    "p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                },
+                "phase_seconds": dict(self.phase_seconds),
+                "wall_seconds": self.wall_seconds,
+                "peak_rss_bytes": self.peak_rss_bytes,
+            }
+
+
+_stages = dict()
+_active = set()
+_lock = threading.Lock()
+_local = threading.local()
+_sampler = None
+
+
+def _get_phase_stack():
+    if not hasattr(_local, "phases"):
+        _local.phases = list()
+
+    return _local.phases
+
+
+def get_stage_metrics(name):
+    """Return the metrics of the named stage, creating them on first use."""
+    with _lock:
+        if name not in _stages:
+            _stages[name] = StageMetrics(name)
+
+        return _stages[name]
+
+
+def reset():
+    """Discard the metrics of every stage."""
+    with _lock:
+        _stages.clear()
+
+
+@contextmanager
+def track_stage(name):
+    """Record the wall time of a stage, and sample the resident set size of the process while it runs.
+
+    Stages running concurrently share the process, so each is attributed the peak of the whole process
+    while it ran.
+    """
+    global _sampler
+    metrics = get_stage_metrics(name)
+    metrics.observe_rss(get_rss())
+    start = time.perf_counter()
+
+    with _lock:
+        _active.add(metrics)
+
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_rss, name="rss-sampler", daemon=True)
+            _sampler.start()
+
+    try:
+        yield metrics
+    finally:
+        with _lock:
+            _active.discard(metrics)
+
+        metrics.observe_rss(get_rss())
+        metrics.add("wall_seconds", time.perf_counter() - start)
+
+
+def _sample_rss():
+    while True:
+        time.sleep(RSS_INTERVAL)
+        rss = get_rss()
+
+        with _lock:
+            active = list(_active)
+
+        for metrics in active:
+            metrics.observe_rss(rss)
+
+
+def get_rss():
+    """Return the current resident set size of the process in bytes, or its peak where unavailable."""
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+
+    if resource is None:
+        return 0
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, q):
+    """Return the nearest-rank percentile of sorted values, or None if there are none."""
+    if len(values) == 0:
+        return None
+
+    rank = max(1, -(-len(values) * q // 100))
+    return values[int(rank) - 1]
+
+
+def snapshot():
+    """Return the raw metrics of every stage, keyed by stage name."""
+    with _lock:
+        stages = list(_stages.values())
+
+    return {metrics.name: metrics.snapshot() for metrics in stages}
+
+
+def merge(snapshots):
+    """Merge raw metrics from another process into the metrics of this one."""
+    for name, stage_snapshot in snapshots.items():
+        get_stage_metrics(name).merge(stage_snapshot)
+
+
+def get_report():
+    """Return the summarised metrics of every stage."""
+    with _lock:
+        stages = list(_stages.values())
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "stages": {metrics.name: metrics.report() for metrics in stages},
+    }
+
+
+def write_report(path):
+    """Write the metrics of every stage to a JSON file."""
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(get_report(), file, indent=4)
+
+
+def write_prometheus(path):
+    """Write the metrics of every stage in the Prometheus text format, for the node exporter textfile collector.
+
+    The file is written to a temporary path and renamed, so that the collector never reads a partial file.
+    """
+    counters = [
+        ("rows_parsed", "Rows parsed from the source datasets."),
+        ("rows_cached", "Dataset rows read from the parsed dataset cache instead of their source."),
+        ("rows_deduplicated", "Rows dropped because their key was already inserted."),
+        ("rows_unmatched", "Rows dropped because an entity they refer to is not in the database."),
+        ("queries_generated", "Insert queries generated."),
+        ("queries_committed", "Insert queries committed."),
+        ("batches_committed", "Batches committed."),
+        ("batches_failed", "Failed batch commit attempts."),
+    ]
+
+    stages = get_report()["stages"]
+    lines = list()
+
+    for counter, description in counters:
+        lines += [
+            "# HELP typedb_bio_{}_total {}".format(counter, description),
+            "# TYPE typedb_bio_{}_total counter".format(counter),
+        ]
+
+        for name, report in stages.items():
+            lines.append("typedb_bio_{}_total{{stage=\"{}\"}} {}".format(counter, name, report[counter]))
+
+    lines += [
+        "# HELP typedb_bio_commit_latency_seconds Batch commit latency.",
+        "# TYPE typedb_bio_commit_latency_seconds summary",
+    ]
+
+    for name, report in stages.items():
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+            latency = report["commit_latency_seconds"][key]
+
+            if latency is not None:
+                lines.append("typedb_bio_commit_latency_seconds{{stage=\"{}\",quantile=\"{}\"}} {}".format(
+                    name, quantile, latency,
+                ))
+
+    lines += [
+        "# HELP typedb_bio_phase_seconds Time spent parsing, generating and writing.",
+        "# TYPE typedb_bio_phase_seconds gauge",
+    ]
+
+    for name, report in stages.items():
+        for phase, seconds in report["phase_seconds"].items():
+            lines.append("typedb_bio_phase_seconds{{stage=\"{}\",phase=\"{}\"}} {}".format(name, phase, seconds))
+
+    for gauge, description in (
+        ("wall_seconds", "Wall time of the stage."),
+        ("peak_rss_bytes", "Peak resident set size of the loader while the stage ran."),
+    ):
+        lines += [
+            "# HELP typedb_bio_{} {}".format(gauge, description),
+            "# TYPE typedb_bio_{} gauge".format(gauge),
+        ]
+
+        for name, report in stages.items():
+            lines.append("typedb_bio_{}{{stage=\"{}\"}} {}".format(gauge, name, report[gauge]))
+
+    temp_path = "{}.tmp".format(path)
+
+    with open(temp_path, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+    os.replace(temp_path, path)
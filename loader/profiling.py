@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Define per-stage profiling, writing cProfile statistics and sampled collapsed stacks."""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+SAMPLE_INTERVAL = 0.01
+
+
+class StageProfiler:
+    """Profile the threads working on one loader stage.
+
+    Each thread is profiled with its own cProfile.Profile while it works on the stage, and the profiles are
+    merged into a single pstats file. A sampling thread also records the call stacks of those threads at
+    regular intervals, including time spent waiting on the server, which are written in the collapsed
+    format read by flamegraph tools.
+
+    From Python 3.12, cProfile can only be enabled in one thread at a time, so threads that cannot be
+    profiled deterministically are only covered by the sampled stacks.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stacks = Counter()
+        self._profiles = dict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile_thread(self):
+        """Profile the calling thread while in the block."""
+        ident = threading.get_ident()
+
+        with self._lock:
+            profile = self._profiles.setdefault(ident, cProfile.Profile())
+
+        try:
+            profile.enable()
+        except ValueError:
+            profile = None
+
+        _threads[ident] = self
+
+        try:
+            yield
+        finally:
+            _threads.pop(ident, None)
+
+            if profile is not None:
+                profile.disable()
+
+    def call(self, func, *args):
+        """Call a function under the profiler, from a worker thread of the stage."""
+        with self.profile_thread():
+            return func(*args)
+
+    def add_sample(self, frame):
+        stack = list()
+
+        while frame is not None:
+            code = frame.f_code
+            stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+
+        with self._lock:
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, directory):
+        """Write <stage>.pstats and <stage>.collapsed to the directory."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name)
+
+        with self._lock:
+            profiles = [profile for profile in self._profiles.values() if profile.getstats()]
+            stacks = sorted(self.stacks.items())
+
+        if len(profiles) > 0:
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(path + ".pstats")
+
+        with open(path + ".collapsed", "w", encoding="utf-8") as file:
+            for stack, count in stacks:
+                file.write("{} {}\n".format(stack, count))
+
+
+_threads = dict()
+_local = threading.local()
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_profiler():
+    """Return the profiler of the stage run by the calling thread, or None if it is not profiled."""
+    return getattr(_local, "profiler", None)
+
+
+@contextmanager
+def profile_stage(name, directory):
+    """Profile a stage run by the calling thread, writing its profiles to the directory when it ends.
+
+    :param name: The name of the stage, used for the file names
+    :param directory: The directory to write the profiles to, or None to disable profiling
+    """
+    if directory is None:
+        yield None
+        return
+
+    start_sampler()
+    profiler = StageProfiler(name)
+    _local.profiler = profiler
+
+    try:
+        with profiler.profile_thread():
+            yield profiler
+    finally:
+        _local.profiler = None
+        profiler.write(directory)
+
+
+def start_sampler():
+    global _sampler
+
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=sample_stacks, name="stack-sampler", daemon=True)
+            _sampler.start()
+
+
+def sample_stacks():
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        frames = sys._current_frames()  # pylint: disable=protected-access
+
+        for ident, profiler in list(_threads.items()):
+            if ident in frames:
+                profiler.add_sample(frames[ident])
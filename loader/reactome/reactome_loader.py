@@ -1,4 +1,13 @@
-from loader.util import write_batches, get_file, read_tsv
+from functools import partial
+from loader.cache import cached_dataset
+from loader.dedupe import existence_checks, filter_new
+from loader.download import get_file
+from loader.keys import filter_known
+from loader.scheduler import Stage, memoize
+from loader.util import write_batches, iter_tsv, generate_queries, group_by
+
+
+PATHWAY_SOURCE = ("https://reactome.org/download/current/UniProt2Reactome_All_Levels.txt", "dataset/reactome")
 
 
 def load_reactome(session, max_pathways, num_jobs, batch_size):
@@ -11,20 +20,46 @@ def load_reactome(session, max_pathways, num_jobs, batch_size):
         print("--------------------------------------------------")
 
 
+def get_reactome_stages(max_pathways):
+    if max_pathways is not None and max_pathways <= 0:
+        return list()
+
+    dataset = memoize(get_reactome_dataset, max_pathways)
+
+    return [
+        Stage(
+            "reactome.pathways",
+            lambda *args: insert_pathways(*args, dataset()),
+            produces=["pathway"],
+        ),
+        Stage(
+            "reactome.participations",
+            lambda *args: insert_pathway_interactions(*args, dataset()),
+            produces=["pathway-participation"],
+            consumes=["pathway", "protein"],
+        ),
+    ]
+
+
+@cached_dataset(PATHWAY_SOURCE)
 def get_reactome_dataset(max_rows):
-    get_file("https://reactome.org/download/current/UniProt2Reactome_All_Levels.txt", "dataset/reactome")
-    rows = [row for row in read_tsv("dataset/reactome/UniProt2Reactome_All_Levels.txt", header=False) if row[5] == "Homo sapiens"]
-    dataset = list()
+    get_file(*PATHWAY_SOURCE)
+    rows = iter_tsv(
+        "dataset/reactome/UniProt2Reactome_All_Levels.txt",
+        header=False,
+        max_rows=max_rows,
+        columns=[0, 1, 3, 5],
+        predicate=lambda row: row[3] == "Homo sapiens",
+    )
 
-    if max_rows is None:
-        max_rows = len(rows)
+    dataset = list()
 
-    for row in rows[:max_rows]:
+    for row in rows:
         data = {
             "uniprot-id": row[0].strip("\""),
             "pathway-id": row[1].strip("\""),
-            "pathway-name": row[3],
-            "organism": row[5],
+            "pathway-name": row[2],
+            "organism": row[3],
         }
 
         dataset.append(data)
@@ -33,52 +68,54 @@ def get_reactome_dataset(max_rows):
 
 
 def insert_pathways(session, num_jobs, batch_size, dataset):
-    pathway_ids = {data["pathway-id"] for data in dataset}
-    pathways = list()
-
-    for pathway_id in pathway_ids:
-        pathway = dict()
-        pathway["pathway-id"] = pathway_id
-        pathway["pathway-name"] = list()
+    write_batches(session, iter_pathway_queries(dataset), num_jobs, batch_size, stage="pathways")
 
-        for data in dataset:
-            if data["pathway-id"] == pathway_id:
-                pathway["pathway-name"].append(data["pathway-name"])
 
-        pathways.append(pathway)
+def iter_pathway_queries(dataset):
+    pathways = group_by((data["pathway-id"], data["pathway-name"]) for data in dataset)
 
-    queries = list()
+    for pathway_id, names in pathways.items():
+        query = "insert $p isa pathway, has reactome-id \"{}\"".format(pathway_id)
 
-    for pathway in pathways:
-        query = "insert $p isa pathway, has reactome-id \"{}\"".format(pathway["pathway-id"])
-
-        for name in pathway["pathway-name"]:
+        for name in names:
             query += ", has pathway-name \"{}\"".format(name)
 
         query += ";"
-        queries.append(query)
-
-    print("Inserting pathways:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def insert_pathway_interactions(session, num_jobs, batch_size, dataset):
-    queries = list()
+    dataset = filter_known(session, dataset, [
+        ("reactome-id", lambda data: data["pathway-id"]),
+        ("uniprot-id", lambda data: data["uniprot-id"]),
+    ])
+
+    dataset = filter_new("pathway-participation", dataset, get_participation_key)
+    queries = generate_queries(
+        partial(iter_pathway_interaction_queries, guard=existence_checks()), dataset, key=get_participation_key
+    )
+    write_batches(session, queries, num_jobs, batch_size, stage="protein-pathway participations")
+
+
+def get_participation_key(data):
+    return data["pathway-id"], data["uniprot-id"]
+
+
+def iter_pathway_interaction_queries(dataset, guard=True):
+    if guard:
+        guard_clause = " not {{ (participated-pathway: $p, participating-protein: $pr) isa pathway-participation; }};"
+    else:
+        guard_clause = " "
 
     for data in dataset:
         query = " ".join([
             "match",
             "$p isa pathway, has reactome-id \"{}\";",
-            "$pr isa protein, has uniprot-id \"{}\";",
-            "not {{ (participated-pathway: $p, participating-protein: $pr) isa pathway-participation; }};"
-            "insert",
+            "$pr isa protein, has uniprot-id \"{}\";" + guard_clause + "insert",
             "(participated-pathway: $p, participating-protein: $pr) isa pathway-participation;"
         ]).format(
             data["pathway-id"],
             data["uniprot-id"],
         )
 
-        queries.append(query)
-
-    print("Inserting protein-pathway participations:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
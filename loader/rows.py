@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Define compact records, holding the rows of the loader datasets.
+
+A dictionary per row costs a hash table per row, and the parsers return a new string object for every value,
+even though some columns repeat a few values: the tissues, cell types, expression levels and reliabilities of
+HPA, and the organisms of UniProt. A record stores its values in a tuple, in about half the memory of a
+dictionary, and the values of its categorical fields, which should be limited to such low-cardinality columns,
+are interned, so that each distinct value is stored once and every row refers to it. Loaders build records
+positionally from the parsed values, without an intermediate dictionary.
+
+Records are read like dictionaries, by field name, and compare equal to dictionaries with the same items.
+"""
+import functools
+import sys
+from collections.abc import Mapping
+
+
+class Record(Mapping):
+    """A row of a dataset, mapping the field names to its values, without a dictionary of its own."""
+
+    __slots__ = ("_values",)
+    fields = ()
+    categorical = ()
+    _interned = ()
+    _positions = dict()
+
+    def __init__(self, *values):
+        if len(values) != len(self.fields):
+            raise TypeError("Expected {} values, got {}.".format(len(self.fields), len(values)))
+
+        if len(self.categorical) > 0:
+            values = tuple([
+                sys.intern(value) if interned and value is not None else value
+                for value, interned in zip(values, self._interned)
+            ])
+
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return the record of a dictionary holding every field.
+
+        :param data: A dictionary from field names to values
+        :return: The record
+        """
+        return cls(*[data[field] for field in cls.fields])
+
+    def __getitem__(self, key):
+        return self._values[self._positions[key]]
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return "Record({!r})".format(dict(self))
+
+    def __reduce__(self):
+        return make_record, (self.fields, self.categorical, self._values)
+
+
+def record_type(fields, categorical=()):
+    """Return the record class of a dataset, the same for the same fields and categorical fields.
+
+    :param fields: The field names, in order
+    :param categorical: The fields whose string values are interned, as they repeat across rows
+    :return: A subclass of Record
+    """
+    return _create_record_type(tuple(fields), tuple(categorical))
+
+
+@functools.lru_cache(maxsize=None)
+def _create_record_type(fields, categorical):
+    return type("Record", (Record,), {
+        "__module__": __name__,
+        "__slots__": (),
+        "fields": fields,
+        "categorical": categorical,
+        "_interned": tuple(field in categorical for field in fields),
+        "_positions": {field: i for i, field in enumerate(fields)},
+    })
+
+
+def make_record(fields, categorical, values):
+    """Return a record from its fields and values, such as when it is unpickled in another process."""
+    return record_type(fields, categorical)(*values)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Define the clients and stages of a load, shared by the loader script and its shard processes."""
+from typedb.api.connection.credential import TypeDBCredential
+from typedb.client import TypeDB
+from loader.compiler import Compiler, get_replay_stages
+from loader.coronavirus.coronavirus_loader import get_coronavirus_stages
+from loader.dgidb.dgidb_loader import DRUG_INTERACTION_SOURCE, DRUG_SOURCE, get_dgidb_stages
+from loader.disgenet.disgenet_loader import ASSOCIATION_SOURCE, get_disgenet_stages
+from loader.download import downloads
+from loader.fake import FakeClient
+from loader.hpa.hpa_loader import TISSUE_SOURCE, get_hpa_stages
+from loader.reactome.reactome_loader import PATHWAY_SOURCE, get_reactome_stages
+from loader.scheduler import run_stages
+from loader.semmed.pipeline import get_semmed_stages
+from loader.tissuenet.tissuenet_loader import PROTEIN_INTERACTION_SOURCE, get_tissuenet_stages
+from loader.uniprot.uniprot_loader import get_uniprot_stages
+from loader.util import configure_writer
+
+
+def get_client(args, address=None):
+    """Open a client to the server in use.
+
+    :param args: The parsed loader arguments
+    :param address: The server address to connect to, overriding the address argument
+    :return: The TypeDB client
+    """
+    if address is None:
+        address = args["address"]
+
+    if args["server_type"].lower() == "core":
+        return TypeDB.core_client(address=address)
+    elif args["server_type"].lower() in ["enterprise", "cloud"]:
+        credential = TypeDBCredential(username=args["username"], password=args["password"], tls_root_ca_path=args["tls_cert_path"])
+        return TypeDB.cluster_client(addresses=address, credential=credential)
+    elif args["server_type"].lower() == "fake":
+        if args.get("preload_keys"):
+            raise ValueError("Keys cannot be preloaded from the FAKE server type, whose match queries return nothing.")
+
+        return FakeClient(
+            commit_latency=args.get("fake_commit_latency") or 0.0,
+            query_latency=args.get("fake_query_latency") or 0.0,
+            conflict_rate=args.get("fake_conflict_rate") or 0.0,
+            failure_rate=args.get("fake_failure_rate") or 0.0,
+            seed=args.get("fake_seed"),
+            sample_size=args.get("fake_sample_size") or 0,
+        )
+    else:
+        raise ValueError("Unknown server type. Must be \"CORE\", \"ENTERPRISE\", \"CLOUD\" or \"FAKE\".")
+
+
+def get_stages(args):
+    """Collect the stages of every loader, in the order they would be run sequentially.
+
+    If a compiled load is being replayed, its stages are returned instead.
+    """
+    if args.get("replay") is not None:
+        return get_replay_stages(args["replay"])
+
+    return [
+        *get_uniprot_stages(args["max_proteins"], args.get("cobatch")),
+        *get_coronavirus_stages(args["max_viruses"]),
+        *get_reactome_stages(args["max_pathways"]),
+        *get_disgenet_stages(args["max_diseases"]),
+        *get_dgidb_stages(args["max_drugs"], args["max_drug_interactions"]),
+        *get_hpa_stages(args["max_tissues"], args.get("cobatch")),
+        *get_semmed_stages(args["max_publications"]),
+        *get_tissuenet_stages(args["max_protein_interactions"]),
+    ]
+
+
+def get_sources(args):
+    """Collect the files downloaded by the loaders that will run, as pairs of a URL and a directory."""
+    if args.get("replay") is not None:
+        return list()
+
+    sources = [
+        (PATHWAY_SOURCE, args["max_pathways"]),
+        (ASSOCIATION_SOURCE, args["max_diseases"]),
+        (DRUG_SOURCE, args["max_drugs"]),
+        (DRUG_INTERACTION_SOURCE, args["max_drug_interactions"]),
+        (TISSUE_SOURCE, args["max_tissues"]),
+        (PROTEIN_INTERACTION_SOURCE, args["max_protein_interactions"]),
+    ]
+
+    return [source for source, max_rows in sources if max_rows is None or max_rows > 0]
+
+
+def load(args, session, tracker=None):
+    """Run every stage of the load into the session, downloading the source files in the background."""
+    downloads.prefetch(get_sources(args))
+    run_stages(
+        get_stages(args), session, args["num_jobs"], args["commit_batch"], args["parallel_stages"], tracker
+    )
+
+
+def compile_load(args):
+    """Run the parsing and query generation of every stage, writing the queries to files instead of a server."""
+    downloads.prefetch(get_sources(args))
+    stages = get_stages(args)
+    compiler = Compiler(args["compile_dir"], stages, args["compile_file_queries"])
+    configure_writer(compiler=compiler)
+    run_stages(stages, None, args["num_jobs"], args["commit_batch"], args["parallel_stages"])
+    compiler.close()
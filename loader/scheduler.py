@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Define a scheduler running loader stages concurrently in dependency order."""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from loader.metrics import track_stage
+from loader.profiling import profile_stage
+from loader.util import configure_writer, interrupted, stage_context, writer_options
+
+
+class Stage:
+    """A unit of loading work, with the types it inserts and the types its queries match on.
+
+    :param name: A unique name for the stage
+    :param run: A function taking a session, the number of jobs and the batch size, which loads the stage
+    :param produces: The labels of the types inserted by the stage
+    :param consumes: The labels of the types that must be loaded before the stage
+    """
+
+    def __init__(self, name, run, produces=(), consumes=()):
+        self.name = name
+        self.run = run
+        self.produces = frozenset(produces)
+        self.consumes = frozenset(consumes)
+
+    def __repr__(self):
+        return "Stage({})".format(self.name)
+
+
+POLL_INTERVAL = 0.5
+
+
+def memoize(func, *args):
+    """Return a function that computes func(*args) on its first call and returns the same value thereafter.
+
+    Used to share a dataset between the stages of a loader, so that it is only read if and when the first of
+    them runs.
+    """
+    lock = threading.Lock()
+    result = list()
+
+    def get():
+        with lock:
+            if len(result) == 0:
+                result.append(func(*args))
+
+            return result[0]
+
+    return get
+
+
+def get_dependencies(stages):
+    """Determine the stages each stage must wait for.
+
+    A stage depends on every stage listed before it that inserts a type it consumes or also inserts, so
+    that matches only run once their data is loaded, and existence checks of stages inserting the same type
+    do not race. Stages that do neither run in any order.
+
+    :param stages: The stages in the order they would be run sequentially
+    :return: A dictionary from each stage name to the set of names of the stages it depends on
+    """
+    dependencies = dict()
+
+    for i, stage in enumerate(stages):
+        dependencies[stage.name] = {
+            earlier.name for earlier in stages[:i] if earlier.produces & (stage.consumes | stage.produces)
+        }
+
+    return dependencies
+
+
+class LocalTracker:
+    """Track the stages completed by this process."""
+
+    def __init__(self):
+        self.completed = set()
+
+    def complete(self, name):
+        self.completed.add(name)
+
+    def is_complete(self, name):
+        return name in self.completed
+
+
+class SharedTracker:
+    """Track the stages completed by every shard of a sharded load, in shared memory.
+
+    :param names: The names of all stages, in the same order in every shard
+    :param counts: A multiprocessing Array of integers with an entry per stage
+    :param num_shards: The number of shards that must complete a stage
+    """
+
+    def __init__(self, names, counts, num_shards):
+        self.indices = {name: i for i, name in enumerate(names)}
+        self.counts = counts
+        self.num_shards = num_shards
+
+    def complete(self, name):
+        with self.counts.get_lock():
+            self.counts[self.indices[name]] += 1
+
+    def is_complete(self, name):
+        return self.counts[self.indices[name]] >= self.num_shards
+
+
+def run_stages(stages, session, num_jobs, batch_size, max_parallel=1, tracker=None):
+    """Run stages concurrently as their dependencies complete.
+
+    At most max_parallel stages run at once. When more than one may run, the writers of all stages share a
+    budget of num_jobs concurrent transactions, so that concurrent stages fill the server without
+    overloading it. If a stage fails, no further stages are started and the error is raised once the running
+    stages finish.
+
+    A SharedTracker may be given to run the stages in several processes at once, each writing a shard of
+    the queries. A stage then starts once its dependencies are complete in every process.
+
+    :param stages: The stages in the order they would be run sequentially
+    :param session: The TypeDB data session
+    :param num_jobs: The number of concurrent transactions across all stages
+    :param batch_size: The number of queries per transaction
+    :param max_parallel: The maximum number of stages run at once
+    :param tracker: The tracker of completed stages (default: a LocalTracker)
+    """
+    if tracker is None:
+        tracker = LocalTracker()
+
+    dependencies = get_dependencies(stages)
+    waiting = list(stages)
+    running = dict()
+    error = None
+
+    if max_parallel > 1:
+        configure_writer(transaction_budget=threading.BoundedSemaphore(num_jobs))
+
+    with ThreadPoolExecutor(max_parallel) as executor:
+        while len(waiting) > 0 or len(running) > 0:
+            if error is None:
+                for stage in list(waiting):
+                    if len(running) == max_parallel:
+                        break
+
+                    if all(tracker.is_complete(name) for name in dependencies[stage.name]):
+                        waiting.remove(stage)
+                        running[executor.submit(run_stage, stage, session, num_jobs, batch_size)] = stage
+            elif len(running) == 0:
+                break
+
+            if len(running) == 0:
+                # Waiting on stages run by other processes.
+                if interrupted.is_set():
+                    raise KeyboardInterrupt
+
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            timeout = None if isinstance(tracker, LocalTracker) else POLL_INTERVAL
+            finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                stage = running.pop(future)
+
+                try:
+                    future.result()
+                except BaseException as stage_error:  # pylint: disable=broad-except
+                    error = error or stage_error
+                else:
+                    tracker.complete(stage.name)
+
+    if error is not None:
+        raise error
+
+
+def run_stage(stage, session, num_jobs, batch_size):
+    stage_context.name = stage.name
+    print("Starting stage {}.".format(stage.name))
+    start = time.perf_counter()
+
+    try:
+        with track_stage(stage.name), profile_stage(stage.name, writer_options["profile"]):
+            stage.run(session, num_jobs, batch_size)
+    finally:
+        stage_context.name = None
+
+    print("Finished stage {} in {:.1f}s.".format(stage.name, time.perf_counter() - start))
@@ -5,7 +5,11 @@ from pathlib import Path
 import numpy
 import pandas
 import requests
-from loader.util import clean_string
+from loader.cache import cached_dataset
+from loader.util import clean_string, get_stage_metrics
+
+
+RELATION_CHUNK_ROWS = 10000
 
 
 def _fetch_metadata_from_api(pm_ids: list[str]) -> tuple[dict, int]:
@@ -132,19 +136,47 @@ def _fetch_metadata_with_retries(
     return publications, failed_ids
 
 
-def fetch_data(
-    file_path: str, max_publications: int | None, cache_dir: Path
-) -> tuple[pandas.DataFrame, list[dict]]:
-    """Fetch SemMed data for the given file path.
+def _read_first_publications(file_path: str, columns: list[str], max_publications: int) -> pandas.DataFrame:
+    """Read the relations of a SemMed file in chunks, until enough distinct publications have been read.
+
+    :param file_path: The path to the file specifying the SemMed data
+    :type file_path: str
+    :param columns: The columns to read, the first of which is the PubMed ID
+    :type columns: list[str]
+    :param max_publications: The number of distinct publications after which reading stops
+    :type max_publications: int
+    :return: A dataframe of the relations read
+    :rtype: pd.DataFrame
+    """
+    stage_metrics = get_stage_metrics()
+    chunks = list()
+    pm_ids = set()
+
+    with pandas.read_csv(file_path, sep=";", dtype=str, usecols=columns, chunksize=RELATION_CHUNK_ROWS) as reader:
+        for chunk in reader:
+            stage_metrics.add("rows_parsed", len(chunk))
+            chunks.append(chunk)
+            pm_ids.update(chunk[columns[0]])
+
+            if len(pm_ids) >= max_publications:
+                break
+
+    if len(chunks) == 0:
+        return pandas.DataFrame(columns=columns, dtype=str)
+
+    return pandas.concat(chunks, ignore_index=True)
+
+
+@cached_dataset(lambda file_path, max_publications: file_path)
+def read_relations(file_path: str, max_publications: int | None) -> pandas.DataFrame:
+    """Read the relations of a SemMed file, one per publication, with cleaned values.
 
     :param file_path: The path to the file specifying the SemMed data
     :type file_path: str
     :param max_publications: The maximum number of publications to import
     :type max_publications: int | None
-    :param cache_dir: The path to the cache directory
-    :type cache_dir: Path
-    :return: A tuple of a dataframe of relations and a list of publications
-    :rtype: tuple[pd.DataFrame, list[dict]]
+    :return: A dataframe of relations
+    :rtype: pd.DataFrame
     """
     columns = {
         "P_PMID": "pmid",
@@ -154,14 +186,42 @@ def fetch_data(
         "S_SENTENCE": "sentence",
     }
 
-    relations = pandas.read_csv(file_path, sep=";", dtype=str, usecols=columns.keys())
-    relations = relations.rename(columns=columns)
-    relations = relations.drop_duplicates(subset=["pmid"])
+    stage_metrics = get_stage_metrics()
 
-    if max_publications is not None:
-        relations = relations[:max_publications]
+    with stage_metrics.phase("parse"):
+        if max_publications is None:
+            relations = pandas.read_csv(file_path, sep=";", dtype=str, usecols=columns.keys())
+            stage_metrics.add("rows_parsed", len(relations))
+        else:
+            relations = _read_first_publications(file_path, list(columns.keys()), max_publications)
+
+        relations = relations.rename(columns=columns)
+        relations = relations.drop_duplicates(subset=["pmid"])
+
+        if max_publications is not None:
+            relations = relations[:max_publications]
+
+        return relations.apply(numpy.vectorize(clean_string))
+
+
+def fetch_data(
+    file_path: str, max_publications: int | None, cache_dir: Path
+) -> tuple[pandas.DataFrame, list[dict]]:
+    """Fetch SemMed data for the given file path.
 
-    relations = relations.apply(numpy.vectorize(clean_string))
+    :param file_path: The path to the file specifying the SemMed data
+    :type file_path: str
+    :param max_publications: The maximum number of publications to import
+    :type max_publications: int | None
+    :param cache_dir: The path to the cache directory
+    :type cache_dir: Path
+    :return: A tuple of a dataframe of relations and a list of publications
+    :rtype: tuple[pd.DataFrame, list[dict]]
+    """
+    # Predicates and genes repeat across relations, so that each distinct value is stored once in a category.
+    relations = read_relations(file_path, max_publications).astype(
+        {"predicate": "category", "subject": "category", "object": "category"}
+    )
     publications, failed_ids = _fetch_metadata_with_retries(relations["pmid"], batch_size=400, retries=1, cache_dir=cache_dir)
 
     with open(cache_dir / "failed_ids.json", "w", encoding="utf-8") as file:
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 """Define functions for loading data into TypeDB."""
+from collections.abc import Iterator
+from functools import partial
 import pandas
 from typedb.api.connection.session import TypeDBSession
-from loader.util import write_batches
+from loader.dedupe import existence_checks, filter_new
+from loader.keys import filter_known
+from loader.util import write_batches, generate_queries
 from loader.semmed.mapper import relationship_mapper
 
 
@@ -20,23 +24,36 @@ def load_journals(
     :param batch_size: The batch size for committing
     :type batch_size: int
     """
-    queries = list()
+    queries = iter_journal_queries(filter_new("journal", journal_names), existence_checks())
+    write_batches(session, queries, num_jobs, batch_size, stage="journals")
 
+
+def iter_journal_queries(journal_names: list[str], guard: bool = True) -> Iterator[str]:
+    """Generate insert queries for journals.
+
+    :param journal_names: The list of journal names
+    :type journal_names: list[str]
+    :param guard: Whether to only insert journals that do not exist
+    :type guard: bool
+    :return: A generator of insert queries
+    :rtype: Iterator[str]
+    """
     for journal_name in journal_names:
-        query = " ".join([
-            "match",
-            "?jn = \"{}\";",
-            "not {{ $j isa journal, has journal-name ?jn; }};",
-            "insert",
-            "$j isa journal,",
-            "has journal-name ?jn;",
-        ]).format(
-            journal_name,
-        )
-        queries.append(query)
+        if guard:
+            query = " ".join([
+                "match",
+                "?jn = \"{}\";",
+                "not {{ $j isa journal, has journal-name ?jn; }};",
+                "insert",
+                "$j isa journal,",
+                "has journal-name ?jn;",
+            ]).format(
+                journal_name,
+            )
+        else:
+            query = "insert $j isa journal, has journal-name \"{}\";".format(journal_name)
 
-    print("Inserting journals:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def load_authors(
@@ -53,23 +70,36 @@ def load_authors(
     :param batch_size: The batch size for committing
     :type batch_size: int
     """
-    queries = list()
+    queries = iter_author_queries(filter_new("person", author_names), existence_checks())
+    write_batches(session, queries, num_jobs, batch_size, stage="authors")
 
+
+def iter_author_queries(author_names: list[str], guard: bool = True) -> Iterator[str]:
+    """Generate insert queries for authors.
+
+    :param author_names: The list of author names
+    :type author_names: list[str]
+    :param guard: Whether to only insert authors that do not exist
+    :type guard: bool
+    :return: A generator of insert queries
+    :rtype: Iterator[str]
+    """
     for author_name in author_names:
-        query = " ".join([
-            "match",
-            "?pn = \"{}\";",
-            "not {{ $p isa person, has author-name ?pn; }};",
-            "insert",
-            "$p isa person,",
-            "has author-name ?pn;",
-        ]).format(
-            author_name,
-        )
-        queries.append(query)
+        if guard:
+            query = " ".join([
+                "match",
+                "?pn = \"{}\";",
+                "not {{ $p isa person, has author-name ?pn; }};",
+                "insert",
+                "$p isa person,",
+                "has author-name ?pn;",
+            ]).format(
+                author_name,
+            )
+        else:
+            query = "insert $p isa person, has author-name \"{}\";".format(author_name)
 
-    print("Inserting authors:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def load_publications(
@@ -86,8 +116,18 @@ def load_publications(
     :param batch_size: The batch size for committing
     :type batch_size: int
     """
-    queries = list()
+    queries = generate_queries(iter_publication_queries, publications, key=lambda publication: publication["paper-id"])
+    write_batches(session, queries, num_jobs, batch_size, stage="publications")
+
 
+def iter_publication_queries(publications: list[dict]) -> Iterator[str]:
+    """Generate insert queries for publications.
+
+    :param publications: The list of publications
+    :type publications: list[dict]
+    :return: A generator of insert queries
+    :rtype: Iterator[str]
+    """
     for publication in publications:
         match_clause = " ".join([
             "match",
@@ -130,10 +170,7 @@ def load_publications(
             insert_clause += " (publishing-journal: $j, published-publication: $p) isa publishing;"
 
         query = match_clause + " " + insert_clause
-        queries.append(query)
-
-    print("Inserting publications:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def load_relations(data: pandas.DataFrame, session: TypeDBSession, num_jobs: int, batch_size: int) -> None:
@@ -164,8 +201,52 @@ def load_gene_relations(data: pandas.DataFrame, session: TypeDBSession, num_jobs
     :param batch_size: The batch size for committing
     :type batch_size: int
     """
-    queries = list()
+    data = filter_known_genes(data, session)
+    data = filter_new("gene-relation", data, get_gene_relation_key)
+    queries = generate_queries(
+        partial(iter_gene_relation_queries, guard=existence_checks()), data, key=get_gene_relation_key
+    )
+    write_batches(session, queries, num_jobs, batch_size, stage="gene relations")
 
+
+def filter_known_genes(data: pandas.DataFrame, session: TypeDBSession) -> pandas.DataFrame:
+    """Drop the relations between genes missing from the database, if keys are preloaded.
+
+    :param data: The relation data
+    :type data: pd.DataFrame
+    :param session: The TypeDB session
+    :type session: typedb.api.connection.session.TypeDBSession
+    :return: The relations between known genes
+    :rtype: pd.DataFrame
+    """
+    return filter_known(session, data, [
+        ("primary-gene-symbol", lambda row: row.subject),
+        ("primary-gene-symbol", lambda row: row.object),
+    ])
+
+
+def get_gene_relation_key(row: tuple) -> tuple:
+    """Return the key identifying the gene relation of a row, for deduplication.
+
+    :param row: A row of the relation data, as returned by pandas.DataFrame.itertuples
+    :type row: tuple
+    :return: The subject, object and relation of the row, and whether it is negated
+    :rtype: tuple
+    """
+    relation = relationship_mapper(row.predicate)
+    return row.subject, row.object, relation["relation-name"], relation["active-role"], relation["negated"]
+
+
+def iter_gene_relation_queries(data: pandas.DataFrame, guard: bool = True) -> Iterator[str]:
+    """Generate insert queries for gene relations.
+
+    :param data: The data to load
+    :type data: pd.DataFrame
+    :param guard: Whether to only insert relations that do not exist
+    :type guard: bool
+    :return: A generator of insert queries
+    :rtype: Iterator[str]
+    """
     for counter, row in enumerate(data.itertuples(), 1):
         relation = relationship_mapper(row.predicate)
 
@@ -178,15 +259,18 @@ def load_gene_relations(data: pandas.DataFrame, session: TypeDBSession, num_jobs
             "has primary-gene-symbol \"{}\";",
             "$g2 isa gene,",
             "has primary-gene-symbol \"{}\";",
-            "not {{ ({}: $g1, {}: $g2) isa {}; }};"
         ]).format(
             row.subject,
             row.object,
-            relation["active-role"],
-            relation["passive-role"],
-            relation["relation-name"],
         )
 
+        if guard:
+            match_clause += " not {{ ({}: $g1, {}: $g2) isa {}; }};".format(
+                relation["active-role"],
+                relation["passive-role"],
+                relation["relation-name"],
+            )
+
         insert_clause = " ".join([
             "insert",
             "({}: $g1, {}: $g2) isa {};",
@@ -197,10 +281,7 @@ def load_gene_relations(data: pandas.DataFrame, session: TypeDBSession, num_jobs
         )
 
         query = match_clause + " " + insert_clause
-        queries.append(query)
-
-    print("Inserting gene relations:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def load_gene_mentions(data: pandas.DataFrame, session: TypeDBSession, num_jobs: int, batch_size: int) -> None:
@@ -215,8 +296,19 @@ def load_gene_mentions(data: pandas.DataFrame, session: TypeDBSession, num_jobs:
     :param batch_size: The batch size for committing
     :type batch_size: int
     """
-    queries = list()
+    data = filter_known_genes(data, session)
+    queries = generate_queries(iter_gene_mention_queries, data, key=lambda row: (row.pmid, row.subject, row.object))
+    write_batches(session, queries, num_jobs, batch_size, stage="publication references")
+
 
+def iter_gene_mention_queries(data: pandas.DataFrame) -> Iterator[str]:
+    """Generate insert queries for gene mentions.
+
+    :param data: The data to load
+    :type data: pd.DataFrame
+    :return: A generator of insert queries
+    :rtype: Iterator[str]
+    """
     for counter, row in enumerate(data.itertuples(), 1):
         relation = relationship_mapper(row.predicate)
 
@@ -251,7 +343,4 @@ def load_gene_mentions(data: pandas.DataFrame, session: TypeDBSession, num_jobs:
         )
 
         query = match_clause + " " + insert_clause
-        queries.append(query)
-
-    print("Inserting publication references:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
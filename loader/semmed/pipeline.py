@@ -4,7 +4,15 @@ import os
 from pathlib import Path
 import typedb.api.connection.session
 from loader.semmed.fetch import fetch_data
-from loader.semmed.load import load_authors, load_journals, load_publications, load_relations
+from loader.scheduler import Stage, memoize
+from loader.semmed.load import (
+    load_authors,
+    load_gene_mentions,
+    load_gene_relations,
+    load_journals,
+    load_publications,
+    load_relations,
+)
 from loader.semmed.parse import get_author_names, get_journal_names, get_publication_data
 
 
@@ -58,6 +66,66 @@ def load_semmed(
         print("--------------------------------------------------")
 
 
+def get_semmed_stages(
+    max_publications: int | None,
+    cache_dir: str | os.PathLike = ".cache/semmed",
+) -> list[Stage]:
+    """Define the stages for migrating SemMed data to TypeDB.
+
+    :param max_publications: The maximum number of publications to be migrated
+    :type max_publications: int | None
+    :param cache_dir: The directory to store the cache files
+    :type cache_dir: str | os.PathLike
+    :return: The stages for the subject and object datasets
+    :rtype: list[Stage]
+    """
+    if max_publications is not None and max_publications <= 0:
+        return list()
+
+    cache_path = Path(cache_dir)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    stages = list()
+
+    for name, file_path in (
+        ("subject", "dataset/semmed/Subject_CORD_NER.csv"),
+        ("object", "dataset/semmed/Object_CORD_NER.csv"),
+    ):
+        data = memoize(fetch_data, file_path, max_publications, cache_path)
+
+        stages += [
+            Stage(
+                "semmed.{}.journals".format(name),
+                lambda *args, data=data: load_journals(get_journal_names(data()[1]), *args),
+                produces=["journal"],
+            ),
+            Stage(
+                "semmed.{}.authors".format(name),
+                lambda *args, data=data: load_authors(get_author_names(data()[1]), *args),
+                produces=["person"],
+            ),
+            Stage(
+                "semmed.{}.publications".format(name),
+                lambda *args, data=data: load_publications(get_publication_data(data()[1]), *args),
+                produces=["publication", "authorship", "publishing"],
+                consumes=["journal", "person"],
+            ),
+            Stage(
+                "semmed.{}.gene-relations".format(name),
+                lambda *args, data=data: load_gene_relations(data()[0], *args),
+                produces=["gene-relation"],
+                consumes=["gene"],
+            ),
+            Stage(
+                "semmed.{}.mentions".format(name),
+                lambda *args, data=data: load_gene_mentions(data()[0], *args),
+                produces=["mention"],
+                consumes=["publication", "gene", "gene-relation"],
+            ),
+        ]
+
+    return stages
+
+
 def load_dataset(
     file_path: str,
     session: typedb.api.connection.session.TypeDBSession,
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Define a sharded load, running the stages in several processes that each write a partition of the queries."""
+import os
+import queue
+import signal
+import sys
+import traceback
+from multiprocessing import get_context
+from tqdm import tqdm
+from typedb.client import SessionType
+from loader import metrics
+from loader.checkpoint import Checkpoint
+from loader.download import downloads
+from loader.runner import get_client, get_sources, get_stages, load
+from loader.scheduler import SharedTracker
+from loader.util import configure_writer, handle_interrupt, interrupted, writer_options
+
+
+def get_shard_address(args, index):
+    """Return the server address used by a shard, assigning the comma-separated addresses round-robin."""
+    addresses = [address.strip() for address in args["address"].split(",")]
+    return addresses[index % len(addresses)]
+
+
+def run_sharded(args, num_shards, resume=False):
+    """Run the load in num_shards processes, each with its own client, session and writer pool.
+
+    Every process generates the queries of each stage from the rows whose entity or relation key hashes to
+    its shard, or, for stages generating queries from the whole dataset, writes the queries whose digest
+    hashes to its shard, so that the shards partition the queries without coordinating. A stage starts once
+    its dependencies have completed in every shard. Progress and metrics are aggregated in this process, and
+    only the first shard prints its stage messages. Each shard keeps its own checkpoint, so a sharded load
+    must be resumed with the same number of shards.
+
+    :param args: The parsed loader arguments
+    :param num_shards: The number of shard processes
+    :param resume: Whether to resume from the shard checkpoints
+    """
+    context = get_context("spawn")
+    names = [stage.name for stage in get_stages(args)]
+    # The shards would each download the source files, so they are downloaded before the shards start.
+    downloads.prefetch(get_sources(args))
+    downloads.wait()
+    counts = context.Array("i", len(names))
+    messages = context.Queue()
+
+    processes = [
+        context.Process(
+            target=run_shard,
+            args=(args, index, num_shards, resume, names, counts, messages),
+            name="shard-{}".format(index),
+        )
+        for index in range(num_shards)
+    ]
+
+    for process in processes:
+        process.start()
+
+    running = set(range(num_shards))
+    stopped = list()
+    error = None
+
+    try:
+        with tqdm(unit="queries") as pbar:
+            while len(running) > 0:
+                try:
+                    kind, shard, payload = messages.get(timeout=1)
+                except queue.Empty:
+                    for index in list(running):
+                        if not processes[index].is_alive():
+                            running.discard(index)
+                            error = error or "Shard {} exited with code {}.".format(
+                                index, processes[index].exitcode
+                            )
+
+                    if error is not None:
+                        break
+
+                    continue
+
+                if kind == "progress":
+                    pbar.update(payload)
+                elif kind == "metrics":
+                    metrics.merge(payload)
+                elif kind == "error":
+                    running.discard(shard)
+                    error = "Shard {} failed:\n{}".format(shard, payload)
+                    break
+                else:
+                    running.discard(shard)
+
+                    if kind == "interrupted":
+                        stopped.append(shard)
+    finally:
+        if error is not None or len(running) > 0:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+        for process in processes:
+            process.join()
+
+    if error is not None:
+        raise RuntimeError(error)
+
+    if len(stopped) > 0:
+        raise KeyboardInterrupt
+
+
+def run_shard(args, index, num_shards, resume, names, counts, messages):
+    """Load one shard in a spawned process, reporting progress and the outcome to the coordinator."""
+    if index > 0:
+        sys.stdout = open(os.devnull, "w")
+
+    signal.signal(signal.SIGINT, handle_interrupt)
+    configure_writer(**{option: args.get(option) for option in writer_options})
+    configure_writer(shard=(index, num_shards), progress_queue=messages)
+
+    if args["profile"] is not None:
+        configure_writer(profile=os.path.join(args["profile"], "shard{}".format(index)))
+
+    checkpoint = None
+
+    if args["checkpoint_path"] is not None:
+        checkpoint = Checkpoint("{}.shard{}".format(args["checkpoint_path"], index), resume)
+        configure_writer(checkpoint=checkpoint)
+
+    try:
+        with get_client(args, get_shard_address(args, index)) as client:
+            with client.session(args["database"], SessionType.DATA) as session:
+                load(args, session, SharedTracker(names, counts, num_shards))
+    except KeyboardInterrupt:
+        outcome = ("interrupted", index, None)
+    except BaseException:  # pylint: disable=broad-except
+        outcome = ("error", index, traceback.format_exc())
+    else:
+        outcome = ("interrupted" if interrupted.is_set() else "done", index, None)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    messages.put(("metrics", index, metrics.snapshot()))
+    messages.put(outcome)
@@ -1,32 +1,43 @@
-import glob
-import os.path
+from functools import partial
 from zipfile import ZipFile
-from loader.util import write_batches, get_file, read_tsv
+from loader.dedupe import existence_checks, filter_new
+from loader.download import get_file
+from loader.keys import filter_known
+from loader.scheduler import Stage
+from loader.util import write_batches, iter_tsv, generate_queries
 from loader.tissuenet.mapper import tissue_mapper
 
 
+PROTEIN_INTERACTION_SOURCE = (
+    "https://netbio.bgu.ac.il/tissuenet2-interactomes/TissueNet2.0/HPA-Protein.zip",
+    "dataset/tissuenet",
+)
+
+
 def load_tissuenet(session, max_interactions, num_jobs, batch_size):
     if max_interactions is None or max_interactions > 0:
         print("Loading TissueNet dataset...")
-        get_file("https://netbio.bgu.ac.il/tissuenet2-interactomes/TissueNet2.0/HPA-Protein.zip", "dataset/tissuenet")
+        get_file(*PROTEIN_INTERACTION_SOURCE)
 
         with ZipFile("dataset/tissuenet/HPA-Protein.zip", "r") as file:
-            file.extractall("dataset/tissuenet/")
-
-        paths = glob.iglob("dataset/tissuenet/*.tsv")
+            members = sorted(name for name in file.namelist() if "/" not in name and name.endswith(".tsv"))
 
-        for path in paths:
-            file_name = path.split("/")[-1].split(".")[0]
+        for member in members:
+            file_name = member.split(".")[0]
             tissue = tissue_mapper(file_name)
             print("Loading TissueNet \"{}\" dataset...".format(file_name))
-            rows = read_tsv(path, header=False)
-            os.remove(path)
-            interactions = list()
+            rows = iter_tsv(
+                "dataset/tissuenet/HPA-Protein.zip",
+                header=False,
+                archive="zip",
+                max_rows=max_interactions,
+                member=member,
+                columns=[0, 1],
+            )
 
-            if max_interactions is None:
-                max_interactions = len(rows)
+            interactions = list()
 
-            for row in rows[:max_interactions]:
+            for row in rows:
                 interaction = {
                     "gene-id-1": row[0],
                     "gene-id-2": row[1],
@@ -36,6 +47,11 @@ def load_tissuenet(session, max_interactions, num_jobs, batch_size):
 
                 interactions.append(interaction)
 
+            interactions = filter_known(session, interactions, [
+                ("ensembl-gene-id", lambda interaction: interaction["gene-id-1"]),
+                ("ensembl-gene-id", lambda interaction: interaction["gene-id-2"]),
+            ])
+
             load_interactions(interactions, session, num_jobs, batch_size)
             load_contexts(interactions, session, num_jobs, batch_size)
 
@@ -43,8 +59,37 @@ def load_tissuenet(session, max_interactions, num_jobs, batch_size):
         print("--------------------------------------------------")
 
 
+def get_tissuenet_stages(max_interactions):
+    if max_interactions is not None and max_interactions <= 0:
+        return list()
+
+    return [
+        Stage(
+            "tissuenet",
+            lambda session, num_jobs, batch_size: load_tissuenet(session, max_interactions, num_jobs, batch_size),
+            produces=["encoded-protein-interaction", "process-localisation"],
+            consumes=["ensembl-gene-id", "tissue-composition"],
+        ),
+    ]
+
+
 def load_interactions(interactions, session, num_jobs, batch_size):
-    queries = list()
+    interactions = filter_new("encoded-protein-interaction", interactions, get_interaction_key)
+    queries = generate_queries(
+        partial(iter_interaction_queries, guard=existence_checks()), interactions, key=get_interaction_key
+    )
+    write_batches(session, queries, num_jobs, batch_size, stage="protein-protein interactions")
+
+
+def get_interaction_key(interaction):
+    return frozenset((interaction["gene-id-1"], interaction["gene-id-2"]))
+
+
+def iter_interaction_queries(interactions, guard=True):
+    if guard:
+        guard_clause = " not {{ (encoding-gene: $g1, encoding-gene: $g2) isa encoded-protein-interaction; }};"
+    else:
+        guard_clause = " "
 
     for interaction in interactions:
         query = " ".join([
@@ -52,24 +97,22 @@ def load_interactions(interactions, session, num_jobs, batch_size):
             "$g1 isa gene,",
             "has ensembl-gene-id \"{}\";",
             "$g2 isa gene,",
-            "has ensembl-gene-id \"{}\";",
-            "not {{ (encoding-gene: $g1, encoding-gene: $g2) isa encoded-protein-interaction; }};"
-            "insert",
+            "has ensembl-gene-id \"{}\";" + guard_clause + "insert",
             "$i (encoding-gene: $g1, encoding-gene: $g2) isa encoded-protein-interaction;",
         ]).format(
             interaction["gene-id-1"],
             interaction["gene-id-2"],
         )
 
-        queries.append(query)
-
-    print("Inserting protein-protein interactions:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def load_contexts(interactions, session, num_jobs, batch_size):
-    queries = list()
+    queries = generate_queries(iter_context_queries, interactions, key=get_interaction_key)
+    write_batches(session, queries, num_jobs, batch_size, stage="tissue contexts")
 
+
+def iter_context_queries(interactions):
     for interaction in interactions:
         if interaction["tissue-name"] is None and interaction["cell-name"] is None:
             continue
@@ -98,7 +141,4 @@ def load_contexts(interactions, session, num_jobs, batch_size):
 
         query += " insert (biomolecular-process: $i, cell-context: $c) isa process-localisation;"
 
-        queries.append(query)
-
-    print("Inserting tissue contexts:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
@@ -1,4 +1,25 @@
-from loader.util import write_batches, read_tsv
+import re
+from loader.cache import cached_dataset
+from loader.dedupe import existence_checks, filter_new
+from loader.rows import record_type
+from loader.scheduler import Stage, memoize
+from loader.util import write_batches, iter_tsv, generate_queries, group_by
+
+
+PROTEIN_FIELDS = (
+    "uniprot-id",
+    "uniprot-entry-name",
+    "organism",
+    "function-description",
+    "gene-symbol",
+    "alternative-gene-symbols",
+    "entrez-ids",
+    "transcripts",
+    "primary-name",
+    "alternative-names",
+)
+
+PROTEIN_RECORD = record_type(PROTEIN_FIELDS, categorical=("organism",))
 
 
 def load_uniprot(session, max_proteins, num_jobs, batch_size):
@@ -13,14 +34,74 @@ def load_uniprot(session, max_proteins, num_jobs, batch_size):
         print("--------------------------------------------------")
 
 
+def get_uniprot_stages(max_proteins, cobatch=False):
+    if max_proteins is not None and max_proteins <= 0:
+        return list()
+
+    dataset = memoize(get_uniprot_dataset, max_proteins)
+
+    stages = [
+        Stage(
+            "uniprot.organisms",
+            lambda *args: insert_organisms(dataset(), *args),
+            produces=["organism"],
+        ),
+        Stage(
+            "uniprot.genes",
+            lambda *args: insert_genes(dataset(), *args),
+            produces=["gene"],
+        ),
+    ]
+
+    if cobatch:
+        stages.append(
+            Stage(
+                "uniprot.transcripts-proteins",
+                lambda *args: insert_transcripts_proteins(dataset(), *args),
+                produces=["transcript", "transcription", "protein", "organism-protein-association", "translation"],
+                consumes=["organism", "gene"],
+            )
+        )
+
+        return stages
+
+    return stages + [
+        Stage(
+            "uniprot.transcripts",
+            lambda *args: insert_transcripts(dataset(), *args),
+            produces=["transcript", "transcription"],
+            consumes=["gene"],
+        ),
+        Stage(
+            "uniprot.proteins",
+            lambda *args: insert_proteins(dataset(), *args),
+            produces=["protein", "organism-protein-association", "translation"],
+            consumes=["organism", "transcript"],
+        ),
+    ]
+
+
 def get_uniprot_dataset(max_rows):
-    rows = read_tsv("dataset/uniprot/uniprot-reviewed_yes+AND+proteome.tsv")
+    return [get_protein_record(data) for data in read_uniprot_dataset(max_rows)]
+
+
+@cached_dataset("dataset/uniprot/uniprot-reviewed_yes+AND+proteome.tsv")
+def read_uniprot_dataset(max_rows):
+    columns = [
+        "Entry",
+        "Entry name",
+        "Protein names",
+        "Gene names",
+        "Organism",
+        "Function [CC]",
+        "Ensembl transcript",
+        "Cross-reference (GeneID)",
+    ]
+
+    rows = iter_tsv("dataset/uniprot/uniprot-reviewed_yes+AND+proteome.tsv", max_rows=max_rows, columns=columns)
     dataset = list()
 
-    if max_rows is None:
-        max_rows = len(rows)
-
-    for row in rows[:max_rows]:
+    for row in rows:
         data = {
             "uniprot-id": row["Entry"],
             "uniprot-entry-name": row["Entry name"],
@@ -38,28 +119,36 @@ def get_uniprot_dataset(max_rows):
 
 
 def insert_organisms(uniprot_dataset, session, num_jobs, batch_size):
+    organism_names = filter_new("organism", get_organism_names(uniprot_dataset))
+    queries = iter_organism_queries(organism_names, existence_checks())
+    write_batches(session, queries, num_jobs, batch_size, stage="organisms")
+
+
+def get_organism_names(uniprot_dataset):
     organism_names = set()
 
     for data in uniprot_dataset:
         organism_names.add(data["organism"])
 
-    queries = list()
+    return organism_names
 
-    for organism_name in organism_names:
-        query = " ".join([
-            "match",
-            "?n = \"{}\";"
-            "not {{ $o isa organism, has organism-name ?n; }};",
-            "insert",
-            "$o isa organism, has organism-name ?n;"
-        ]).format(
-            organism_name,
-        )
 
-        queries.append(query)
+def iter_organism_queries(organism_names, guard=True):
+    for organism_name in organism_names:
+        if guard:
+            query = " ".join([
+                "match",
+                "?n = \"{}\";"
+                "not {{ $o isa organism, has organism-name ?n; }};",
+                "insert",
+                "$o isa organism, has organism-name ?n;"
+            ]).format(
+                organism_name,
+            )
+        else:
+            query = "insert $o isa organism, has organism-name \"{}\";".format(organism_name)
 
-    print("Inserting organisms:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def extract_gene_entry(data):
@@ -76,45 +165,47 @@ def extract_gene_entry(data):
     return entry
 
 
-def insert_genes(uniprot_dataset, session, num_jobs, batch_size):
-    gene_entries = list()
+# Each protein is parsed once into a record that every stage reuses, with None for a missing gene or primary name.
+def get_protein_record(data):
+    gene = extract_gene_entry(data) if data["gene-symbol"] != "" else None
+    names = extract_protein_names(data["protein-name"])
 
-    for data in uniprot_dataset:
-        if data["gene-symbol"] != "":
-            gene_entries.append(extract_gene_entry(data))
+    return PROTEIN_RECORD(
+        data["uniprot-id"],
+        data["uniprot-entry-name"],
+        data["organism"],
+        data["function-description"],
+        gene["official-gene-symbol"] if gene is not None else None,
+        gene["alternative-gene-symbol"] if gene is not None else list(),
+        gene["entrez-id"] if gene is not None else list(),
+        extract_transcript_entries(data),
+        names.get("primary-name"),
+        names["alternative-names"],
+    )
 
-    symbols = {entry["official-gene-symbol"] for entry in gene_entries}
-    genes = list()
 
-    for symbol in symbols:
-        gene = dict()
-        gene["official-gene-symbol"] = symbol
-        gene["alternative-gene-symbol"] = list()
-        gene["entrez-id"] = list()
-
-        for entry in gene_entries:
-            if entry["official-gene-symbol"] == symbol:
-                gene["alternative-gene-symbol"] += entry["alternative-gene-symbol"]
-                gene["entrez-id"] += entry["entrez-id"]
+def insert_genes(uniprot_dataset, session, num_jobs, batch_size):
+    write_batches(session, iter_gene_queries(uniprot_dataset), num_jobs, batch_size, stage="genes")
 
-        genes.append(gene)
 
-    queries = list()
+def iter_gene_queries(uniprot_dataset):
+    records = [data for data in uniprot_dataset if data["gene-symbol"] is not None]
+    alternative_symbols = group_by(
+        (data["gene-symbol"], symbol) for data in records for symbol in [None] + data["alternative-gene-symbols"]
+    )
+    entrez_ids = group_by((data["gene-symbol"], entrez_id) for data in records for entrez_id in data["entrez-ids"])
 
-    for gene in genes:
-        query = "insert $g isa gene, has primary-gene-symbol \"{}\"".format(gene["official-gene-symbol"])
+    for gene_symbol, symbols in alternative_symbols.items():
+        query = "insert $g isa gene, has primary-gene-symbol \"{}\"".format(gene_symbol)
 
-        for symbol in gene["alternative-gene-symbol"]:
+        for symbol in symbols:
             query += ", has alternative-gene-symbol \"{}\"".format(symbol)
 
-        for entrez_id in gene["entrez-id"]:
+        for entrez_id in entrez_ids.get(gene_symbol, list()):
             query += ", has entrez-id \"{}\"".format(entrez_id)
 
         query += ";"
-        queries.append(query)
-
-    print("Inserting genes:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def extract_transcript_entries(data):
@@ -123,19 +214,13 @@ def extract_transcript_entries(data):
 
 
 def insert_transcripts(uniprot_dataset, session, num_jobs, batch_size):
-    transcripts = dict()
-    queries = list()
+    write_batches(session, iter_transcript_queries(uniprot_dataset), num_jobs, batch_size, stage="transcripts")
 
-    for data in uniprot_dataset:
-        entries = extract_transcript_entries(data)
 
-        for entry in entries:
-            if entry not in transcripts:
-                transcripts[entry] = list()
-
-            if data["gene-symbol"] != "":
-                gene_symbol = extract_gene_entry(data)["official-gene-symbol"]
-                transcripts[entry].append(gene_symbol)
+def iter_transcript_queries(uniprot_dataset):
+    transcripts = group_by(
+        (transcript_id, data["gene-symbol"]) for data in uniprot_dataset for transcript_id in data["transcripts"]
+    )
 
     for transcript_id in transcripts.keys():
         match_clause = "match"
@@ -151,10 +236,7 @@ def insert_transcripts(uniprot_dataset, session, num_jobs, batch_size):
         else:
             query = match_clause + " " + insert_clause
 
-        queries.append(query)
-
-    print("Inserting transcripts:")
-    write_batches(session, queries, num_jobs, batch_size)
+        yield query
 
 
 def extract_protein_names(entry):
@@ -165,92 +247,184 @@ def extract_protein_names(entry):
     if entry == "":
         return protein_names
 
+    # Only brackets are visited, from the end, and the entry is split before each one opening a top-level group.
     candidate_names = list()
-    name = ""
+    end = len(entry)
     depth = 0
 
-    for char in entry[::-1]:
-        if char in (")", "]"):
+    for bracket in reversed([match.start() for match in re.finditer(r"[()\[\]]", entry)]):
+        if entry[bracket] in (")", "]"):
             depth += 1
-            name = char + name
-        elif char in ("(", "["):
+        else:
             depth -= 1
-            name = char + name
 
             if depth == 0:
-                candidate_names.append(name)
-                name = ""
-        else:
-            name = char + name
+                candidate_names.append(entry[bracket:end])
+                end = bracket
 
-    candidate_names.append(name)
+    candidate_names.append(entry[:end])
 
-    if len(candidate_names) == 0:
-        return protein_names
-    else:
-        primary_name = ""
-        alternative_names = list()
-        in_primary_name = False
-
-        for name in candidate_names:
-            if name == "":
-                continue
-
-            if name.strip()[0] == "(" and name.strip()[-1] == ")":
-                alternative_names.append(name.strip()[1:-1].strip())
-            elif name.strip()[0] == "[" and name.strip()[-1] == "]":
-                if in_primary_name:
-                    primary_name = name + primary_name
-                else:
-                    continue
-            else:
-                in_primary_name = True
-                primary_name = name + primary_name
-
-    protein_names["primary-name"] = primary_name.strip()
+    primary_names = list()
+    alternative_names = list()
+    in_primary_name = False
+
+    for name in candidate_names:
+        stripped = name.strip()
+
+        if stripped == "":
+            continue
+
+        if stripped[0] == "(" and stripped[-1] == ")":
+            alternative_names.append(stripped[1:-1].strip())
+        elif stripped[0] == "[" and stripped[-1] == "]":
+            if in_primary_name:
+                primary_names.append(name)
+        else:
+            in_primary_name = True
+            primary_names.append(name)
+
+    protein_names["primary-name"] = "".join(primary_names[::-1]).strip()
     protein_names["alternative-names"] = alternative_names[::-1]
     return protein_names
 
 
 def insert_proteins(uniprot_dataset, session, num_jobs, batch_size):
-    queries = list()
+    queries = generate_queries(iter_protein_queries, uniprot_dataset, key=lambda data: data["uniprot-id"])
+    write_batches(session, queries, num_jobs, batch_size, stage="proteins")
 
-    for data in uniprot_dataset:
-        transcripts = extract_transcript_entries(data)
-        match_clause = "match"
-        insert_clause = "insert"
 
-        insert_clause += " " + " ".join([
-            "$p isa protein,",
-            "has uniprot-id \"{}\",",
-            "has uniprot-entry-name \"{}\"",
-        ]).format(
-            data["uniprot-id"],
-            data["uniprot-entry-name"],
-        )
+def get_protein_statement(variable, data):
+    statement = " ".join([
+        "{} isa protein,",
+        "has uniprot-id \"{}\",",
+        "has uniprot-entry-name \"{}\"",
+    ]).format(
+        variable,
+        data["uniprot-id"],
+        data["uniprot-entry-name"],
+    )
 
-        if data["function-description"] != "":
-            insert_clause += ", has function-description \"{}\"".format(data["function-description"])
+    if data["function-description"] != "":
+        statement += ", has function-description \"{}\"".format(data["function-description"])
 
-        names = extract_protein_names(data["protein-name"])
+    if data["primary-name"] is not None:
+        statement += ", has primary-uniprot-name \"{}\"".format(data["primary-name"])
 
-        if "primary-name" in names:
-            insert_clause += ", has primary-uniprot-name \"{}\"".format(names["primary-name"])
+    for name in data["alternative-names"]:
+        statement += ", has alternative-uniprot-name \"{}\"".format(name)
 
-        for name in names["alternative-names"]:
-            insert_clause += ", has alternative-uniprot-name \"{}\"".format(name)
+    return statement + ";"
 
-        insert_clause += ";"
+
+def iter_protein_queries(uniprot_dataset):
+    for data in uniprot_dataset:
+        match_clause = "match"
+        insert_clause = "insert " + get_protein_statement("$p", data)
 
         match_clause += " $o isa organism, has organism-name \"{}\";".format(data["organism"])
         insert_clause += " (associated-organism: $o, associated-protein: $p) isa organism-protein-association;"
 
-        for i, transcript_id in enumerate(transcripts):
+        for i, transcript_id in enumerate(data["transcripts"]):
             match_clause += " $t{} isa transcript, has ensembl-transcript-id \"{}\";".format(i, transcript_id)
             insert_clause += " (translated-transcript: $t{}, synthesised-protein: $p) isa translation;".format(i)
 
         query = match_clause + " " + insert_clause
-        queries.append(query)
+        yield query
+
+
+def insert_transcripts_proteins(uniprot_dataset, session, num_jobs, batch_size):
+    groups = group_transcript_proteins(uniprot_dataset)
+    queries = generate_queries(iter_transcript_protein_queries, groups, key=lambda group: group[0]["uniprot-id"])
+    write_batches(session, queries, num_jobs, batch_size, stage="transcripts and proteins")
+
+
+# Proteins sharing transcripts, directly or through other proteins, are grouped so that each group can be
+# inserted by one query binding its transcripts to variables, instead of matching them by ID per protein.
+def group_transcript_proteins(uniprot_dataset):
+    groups = dict()
+    owners = dict()
+
+    for index, data in enumerate(uniprot_dataset):
+        transcripts = data["transcripts"]
+        merged = sorted({owners[transcript] for transcript in transcripts if transcript in owners})
+
+        if len(merged) == 0:
+            group_id = index
+            groups[group_id] = (list(), list())
+        else:
+            group_id = merged[0]
+
+        rows, group_transcripts = groups[group_id]
+
+        for other_id in merged[1:]:
+            other_rows, other_transcripts = groups.pop(other_id)
+            rows += other_rows
+            group_transcripts += other_transcripts
+
+            for transcript in other_transcripts:
+                owners[transcript] = group_id
+
+        rows.append((index, data))
+
+        for transcript in transcripts:
+            if owners.get(transcript) != group_id:
+                owners[transcript] = group_id
+                group_transcripts.append(transcript)
+
+    return [
+        [data for _, data in sorted(groups[group_id][0], key=lambda row: row[0])]
+        for group_id in sorted(groups.keys())
+    ]
+
+
+def iter_transcript_protein_queries(groups):
+    for group in groups:
+        organisms = dict()
+        genes = dict()
+        transcripts = dict()
+        transcriptions = set()
+        match_clause = "match"
+        insert_clause = "insert"
 
-    print("Inserting proteins:")
-    write_batches(session, queries, num_jobs, batch_size)
+        for i, data in enumerate(group):
+            protein = "$p{}".format(i)
+            insert_clause += " " + get_protein_statement(protein, data)
+
+            if data["organism"] not in organisms:
+                organisms[data["organism"]] = "$o{}".format(len(organisms))
+                match_clause += " {} isa organism, has organism-name \"{}\";".format(
+                    organisms[data["organism"]], data["organism"]
+                )
+
+            insert_clause += " " + " ".join([
+                "(associated-organism: {}, associated-protein: {})",
+                "isa organism-protein-association;",
+            ]).format(
+                organisms[data["organism"]],
+                protein,
+            )
+
+            gene_symbol = data["gene-symbol"]
+
+            if gene_symbol is not None and gene_symbol not in genes:
+                genes[gene_symbol] = "$g{}".format(len(genes))
+                match_clause += " {} isa gene, has primary-gene-symbol \"{}\";".format(genes[gene_symbol], gene_symbol)
+
+            for transcript_id in data["transcripts"]:
+                if transcript_id not in transcripts:
+                    transcripts[transcript_id] = "$t{}".format(len(transcripts))
+                    insert_clause += " {} isa transcript, has ensembl-transcript-id \"{}\";".format(
+                        transcripts[transcript_id], transcript_id
+                    )
+
+                if gene_symbol is not None and (transcript_id, gene_symbol) not in transcriptions:
+                    transcriptions.add((transcript_id, gene_symbol))
+                    insert_clause += " (transcribed-gene: {}, synthesised-transcript: {}) isa transcription;".format(
+                        genes[gene_symbol], transcripts[transcript_id]
+                    )
+
+                insert_clause += " (translated-transcript: {}, synthesised-protein: {}) isa translation;".format(
+                    transcripts[transcript_id], protein
+                )
+
+        yield match_clause + " " + insert_clause
@@ -1,78 +1,296 @@
+import asyncio
 import csv
 import gzip
+import json
+import mmap
 import os
 import re
+import signal
+import threading
+import time
 import unicodedata
+from collections import deque
+from collections.abc import Sequence, Sized
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
 from functools import partial
-from io import TextIOWrapper
+from io import StringIO, TextIOWrapper
+from itertools import islice
 from multiprocessing.dummy import Pool as ThreadPool
-from urllib.error import URLError
+from queue import Queue
 from zipfile import ZipFile
-import wget
 from tqdm import tqdm
 from typedb.api.connection.transaction import TransactionType
+from loader import metrics
+from loader.adaptive import AdaptiveController
+from loader.checkpoint import query_digest
+from loader.profiling import get_profiler
 
 
-class DownloadError(URLError):
-    def __init__(self, url):
-        self.message = "Could not download data files from {}. Check internet connection and status of data host.".format(url)
-        super(DownloadError, self).__init__(self.message)
+PARSE_CHUNK_ROWS = 1000
+PARSE_CHUNK_BYTES = 1 << 23
 
 
-def get_file(url, path):
-    """downloads file and makes folder if missing
+def read_tsv(path, header=True, delimiter="\t", archive=None):
+    return list(iter_tsv(path, header, delimiter, archive))
+
+
+def iter_tsv(
+    path,
+    header=True,
+    delimiter="\t",
+    archive=None,
+    max_rows=None,
+    member=None,
+    columns=None,
+    predicate=None,
+    ordered=True,
+):
+    """Yield the rows of a delimited file as they are read, stopping after max_rows rows.
+
+    Rows are parsed in chunks of PARSE_CHUNK_ROWS, so that the time spent reading them is attributed to the
+    parse phase of the stage without timing every row, and the file is closed as soon as the limit is reached
+    or the consumer stops iterating. Only the projected columns of a row are stripped and kept, and rows
+    rejected by the predicate are dropped as they are read, so neither is retained by the caller.
+
+    Uncompressed files read without a row limit are parsed by iter_tsv_parallel instead if the
+    parse_processes writer option is above 1.
 
-    example inputs:
-    url = "https://www.dgidb.org/data/monthly_tsvs/2021-Jan/drugs.tsv"
-    path ='dataset/dgidb'
+    :param path: The path of the file, or of the archive containing it
+    :param header: Whether the first row labels the columns, in which case rows are dictionaries from the
+        stripped labels to the stripped values, and lists of values otherwise
+    :param delimiter: The column delimiter
+    :param archive: None for a plain file, "gz" for a gzip-compressed file or "zip" for a zip archive
+    :param max_rows: The maximum number of rows to yield, or None to yield every row
+    :param member: The file to read from a zip archive, by default the one named after the archive without
+        its extension
+    :param columns: The labels, or without a header the indices, of the columns to keep, in order
+    :param predicate: A function of a projected row, returning whether to yield it
+    :param ordered: Whether rows parsed in parallel must be yielded in file order
+    :return: A generator of rows
     """
-    if not os.path.exists(path + "/" + url.split("/")[-1]):
-        print("  Downloading dataset")
+    if max_rows is not None and max_rows <= 0:
+        return
 
-        if not os.path.isdir(path):
-            os.mkdir(path)
+    if archive is None and max_rows is None and writer_options["parse_processes"] > 1:
+        rows = iter_tsv_parallel(path, header, delimiter, columns, writer_options["parse_processes"], ordered)
+        yield from rows if predicate is None else filter(predicate, rows)
+        return
 
-        try:
-            wget.download(url, path)
-        except URLError:
-            raise DownloadError(url)
+    stage_metrics = get_stage_metrics()
+    count = 0
 
-        print("  Finished downloading")
+    with open_tsv(path, archive, member) as file:
+        reader = csv.reader(file, delimiter=delimiter)
+        fields = None
+        lines = 0
 
+        if header:
+            with stage_metrics.phase("parse"):
+                labels = next(reader, None)
 
-def read_tsv(path, header=True, delimiter="\t", archive=None):
-    if archive is None:
-        with open(path, "r", encoding="utf8") as file:
-            reader = csv.reader(file, delimiter=delimiter)
+            if labels is None:
+                return
 
-            if header:
-                labels = next(reader)
+            fields = get_fields(path, labels, columns)
+            lines = reader.line_num
 
-            rows = list(reader)
-    elif archive == "gz":
-        with gzip.open(path, "rt", encoding="utf8") as file:
-            reader = csv.reader(file, delimiter=delimiter)
+        rows = project_rows(reader, fields, columns)
+
+        if predicate is not None:
+            rows = filter(predicate, rows)
+
+        while max_rows is None or count < max_rows:
+            chunk_size = PARSE_CHUNK_ROWS if max_rows is None else min(PARSE_CHUNK_ROWS, max_rows - count)
+
+            with stage_metrics.phase("parse"):
+                chunk = list(islice(rows, chunk_size))
+
+            stage_metrics.add("rows_parsed", reader.line_num - lines)
+            lines = reader.line_num
+
+            if len(chunk) == 0:
+                return
+
+            count += len(chunk)
+            yield from chunk
+
+
+def get_fields(path, labels, columns):
+    """Return the pairs of a stripped label and its index of the columns to keep, or of every column."""
+    labels = [label.strip() for label in labels]
+
+    if columns is None:
+        return [(label, i) for i, label in enumerate(labels)]
+
+    missing = [column for column in columns if column not in labels]
+
+    if len(missing) > 0:
+        raise ValueError("Unknown columns in {}: {}".format(path, ", ".join(missing)))
+
+    return [(column, labels.index(column)) for column in columns]
+
+
+def project_rows(rows, fields=None, columns=None):
+    """Project rows of values to dictionaries of the stripped fields, or to lists of the column indices."""
+    if fields is not None:
+        return ({column: row[i].strip() for column, i in fields} for row in rows)
+
+    if columns is not None:
+        return ([row[i] for i in columns] for row in rows)
+
+    return rows
+
+
+def iter_tsv_parallel(path, header, delimiter, columns, processes, ordered=True):
+    """Yield the rows of an uncompressed delimited file, parsed in parallel by worker processes.
+
+    The file is mapped into memory and split into chunks of about PARSE_CHUNK_BYTES, ending on line breaks,
+    each of which a worker process maps and parses. A quoted value spanning a line break makes the chunk
+    containing its start report a record that is not one line. Since every chunk before it was parsed from
+    the start of a record, rows are yielded from the chunks before it, and the rest of the file is parsed
+    sequentially from its start.
+
+    Rows are yielded in file order, unless ordered is false and the file contains no quotes, in which case
+    every chunk starts on a record and rows are yielded as chunks complete.
+
+    :param path: The path of the file
+    :param header: Whether the first row labels the columns
+    :param delimiter: The column delimiter
+    :param columns: The labels, or without a header the indices, of the columns to keep, in order
+    :param processes: The number of worker processes
+    :param ordered: Whether rows must be yielded in file order
+    :return: A generator of rows, as yielded by iter_tsv
+    """
+    if os.path.getsize(path) == 0:
+        return
+
+    stage_metrics = get_stage_metrics()
+    fields = None
 
-            if header:
-                labels = next(reader)
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        begin = 0
 
-            rows = list(reader)
+        if header:
+            begin = mapped.find(b"\n") + 1 or len(mapped)
+            labels = next(csv.reader(StringIO(mapped[:begin].decode("utf8"), newline=None), delimiter=delimiter))
+            fields = get_fields(path, labels, columns)
+
+        bounds = list()
+
+        while begin < len(mapped):
+            end = mapped.find(b"\n", begin + PARSE_CHUNK_BYTES) + 1 or len(mapped)
+            bounds.append((begin, end))
+            begin = end
+
+        quoted = mapped.find(b"\"") >= 0
+
+    parse = partial(parse_tsv_chunk, path, delimiter=delimiter, fields=fields, columns=columns)
+    executor = ProcessPoolExecutor(processes, initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN))
+
+    with executor:
+        if not ordered and not quoted:
+            pending = set()
+
+            for begin, end in bounds:
+                if len(pending) == 2 * processes:
+                    with stage_metrics.phase("parse"):
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        rows, lines, _ = future.result()
+                        stage_metrics.add("rows_parsed", lines)
+                        yield from rows
+
+                pending.add(executor.submit(parse, begin, end))
+
+            for future in as_completed(pending):
+                rows, lines, _ = future.result()
+                stage_metrics.add("rows_parsed", lines)
+                yield from rows
+
+            return
+
+        pending = deque()
+        bounds = deque(bounds)
+
+        while len(pending) > 0 or len(bounds) > 0:
+            while len(bounds) > 0 and len(pending) < 2 * processes:
+                begin, end = bounds.popleft()
+                pending.append((begin, executor.submit(parse, begin, end)))
+
+            begin, future = pending.popleft()
+
+            with stage_metrics.phase("parse"):
+                rows, lines, complete = future.result()
+
+            if not complete:
+                for _, future in pending:
+                    future.cancel()
+
+                break
+
+            stage_metrics.add("rows_parsed", lines)
+            yield from rows
+        else:
+            return
+
+    with open(path, "rb") as file:
+        file.seek(begin)
+        reader = csv.reader(TextIOWrapper(file, "utf8"), delimiter=delimiter)
+        rows = project_rows(reader, fields, columns)
+        lines = 0
+
+        while True:
+            with stage_metrics.phase("parse"):
+                chunk = list(islice(rows, PARSE_CHUNK_ROWS))
+
+            stage_metrics.add("rows_parsed", reader.line_num - lines)
+            lines = reader.line_num
+
+            if len(chunk) == 0:
+                return
+
+            yield from chunk
+
+
+def parse_tsv_chunk(path, begin, end, delimiter, fields, columns):
+    """Parse the lines of a file between two byte offsets, in a worker process.
+
+    :return: A tuple of the projected rows, the number of lines parsed, and whether every record was one
+        complete line
+    """
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        text = mapped[begin:end].decode("utf8")
+
+    reader = csv.reader(StringIO(text, newline=None), delimiter=delimiter)
+    records = list(reader)
+    last = records[-1] if len(records) > 0 else list()
+    # A record spanning lines, or a quote left open at the end of the chunk, keeps a line break in a value.
+    complete = reader.line_num == len(records) and not any("\n" in value for value in last)
+    return list(project_rows(records, fields, columns)), reader.line_num, complete
+
+
+@contextmanager
+def open_tsv(path, archive=None, member=None):
+    """Open a delimited file as text, decompressing it if it is archived."""
+    if archive is None:
+        with open(path, "r", encoding="utf8") as file:
+            yield file
+    elif archive == "gz":
+        with gzip.open(path, "rt", encoding="utf8") as file:
+            yield file
     elif archive == "zip":
-        with ZipFile(path) as zip_file:
-            with zip_file.open(".".join(path.split("/")[-1].split(".")[:-1]), "r") as file:
-                reader = csv.reader(TextIOWrapper(file, "utf-8"), delimiter=delimiter)
-                if header:
-                    labels = next(reader)
+        if member is None:
+            member = ".".join(path.split("/")[-1].split(".")[:-1])
 
-                rows = list(reader)
+        with ZipFile(path) as zip_file:
+            with zip_file.open(member, "r") as file:
+                yield TextIOWrapper(file, "utf-8")
     else:
         raise ValueError("Unknown archive type: {}".format(archive))
 
-    if header:
-        return [{labels[i].strip(): row[i].strip() for i in range(len(labels))} for row in rows]
-    else:
-        return rows
-
 
 def clean_string(string: str) -> str:
     """Remove special characters from a string.
@@ -83,25 +301,672 @@ def clean_string(string: str) -> str:
     return " ".join(re.findall(r"\w+", unicodedata.normalize("NFC", string), re.UNICODE))
 
 
-def write_batches(session, queries, num_jobs, batch_size):
-    with ThreadPool(num_jobs) as pool:
-        with tqdm(total=len(queries)) as pbar:
-            chunk_size = max(1, len(queries) // num_jobs // batch_size // 10)
+writer_options = {
+    "adaptive": False,
+    "min_commit_batch": 1,
+    "max_commit_batch": 1000,
+    "max_num_jobs": 32,
+    "target_commit_latency": 2.0,
+    "max_retries": 0,
+    "retry_backoff": 1.0,
+    "dead_letter_path": None,
+    "generation_processes": 0,
+    "generation_chunk_size": 1000,
+    "engine": "thread",
+    "checkpoint": None,
+    "transaction_budget": None,
+    "shard": None,
+    "progress_queue": None,
+    "profile": None,
+    "compiler": None,
+    "dedupe": False,
+    "existence_checks": True,
+    "preload_keys": False,
+    "key_page_size": 10000,
+    "dataset_cache": None,
+    "parse_processes": 0,
+    "download_jobs": 4,
+    "refresh_sources": False,
+}
+
+
+def configure_writer(**options):
+    """Set options used by every subsequent call to write_batches.
+
+    Options that are None are left unchanged, so parsed arguments can be passed through directly.
+
+    :param options: Writer options, as named in writer_options
+    """
+    for option, value in options.items():
+        if option not in writer_options:
+            raise ValueError("Unknown writer option: {}".format(option))
+
+        if value is not None:
+            writer_options[option] = value
+
+
+def generate_queries(generate, rows, key=None):
+    """Generate queries from rows, in worker processes if the generation_processes writer option is set.
+
+    The rows are split into chunks of generation_chunk_size, each of which is passed to generate in a
+    ProcessPoolExecutor, so that query construction runs in parallel and outside the interpreter running
+    the writer threads. Queries are yielded in row order as the chunks complete, with at most two chunks
+    per process in flight. The generate function must only produce queries that depend on a single row,
+    and must be importable at module level so that it can be sent to the worker processes.
+
+    If a key function is given and a shard writer option is set, only the rows whose key hashes to the shard
+    are generated from, so that each shard generates its own partition of the queries instead of them all.
+
+    :param generate: A generator function producing queries from a sequence of rows
+    :param rows: A list or pandas DataFrame of rows
+    :param key: A function returning the entity or relation key of a row, or of a DataFrame row as a named
+        tuple from itertuples
+    :return: An iterable of queries
+    """
+    if key is None or writer_options["shard"] is None:
+        return iter_generated_queries(generate, rows)
+
+    index, count = writer_options["shard"]
+    rows = filter_rows(rows, lambda row: get_key_shard(key(row), count) == index)
+    return PartitionedQueries(iter_generated_queries(generate, rows))
+
+
+def iter_generated_queries(generate, rows):
+    processes = writer_options["generation_processes"]
+
+    if processes < 1:
+        yield from generate(rows)
+        return
+
+    chunk_size = writer_options["generation_chunk_size"]
+
+    if hasattr(rows, "iloc"):
+        chunks = (rows.iloc[i:i + chunk_size] for i in range(0, len(rows), chunk_size))
+    else:
+        chunks = iter_batches(rows, chunk_size)
+
+    # Interrupts are handled by the loader process, which lets the chunks in flight finish.
+    executor = ProcessPoolExecutor(processes, initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN))
+
+    with executor:
+        pending = deque()
+
+        for chunk in chunks:
+            if len(pending) == 2 * processes:
+                yield from pending.popleft().result()
+
+            pending.append(executor.submit(generate_chunk, generate, chunk))
+
+        while len(pending) > 0:
+            yield from pending.popleft().result()
+
+
+def get_key_shard(key, count):
+    """Return the shard of an entity or relation key, the same in every process.
+
+    :param key: A key built from strings and numbers, in tuples or frozensets
+    :param count: The number of shards
+    :return: The index of the shard
+    """
+    if isinstance(key, (set, frozenset)):
+        key = sorted(key)
+
+    return int(query_digest(repr(key)), 16) % count
+
+
+class PartitionedQueries:
+    """Queries generated from the rows of the running shard only, which are not partitioned again."""
+
+    def __init__(self, queries):
+        self.queries = queries
+
+    def __iter__(self):
+        return iter(self.queries)
+
+
+def filter_rows(rows, predicate):
+    """Return the rows for which the predicate is true, keeping pandas DataFrames as DataFrames.
+
+    :param rows: A list, set or pandas DataFrame of rows
+    :param predicate: A function of a row, or of a DataFrame row as a named tuple from itertuples
+    :return: A list, or a DataFrame of a DataFrame
+    """
+    if hasattr(rows, "iloc"):
+        return rows.loc[[bool(predicate(row)) for row in rows.itertuples()]]
+
+    return [row for row in rows if predicate(row)]
+
+
+def group_by(pairs, unique=True):
+    """Group values by key in one pass, keeping groups and their values in order of first occurrence.
+
+    A value of None creates its group without adding to it, so that keys without values are kept.
+
+    :param pairs: An iterable of pairs of a key and a value
+    :param unique: Whether to keep only the first occurrence of each value in a group, which must then be hashable
+    :return: A dictionary from each key to the list of its values
+    """
+    groups = dict()
+
+    if not unique:
+        for key, value in pairs:
+            group = groups.setdefault(key, list())
+
+            if value is not None:
+                group.append(value)
+
+        return groups
+
+    # Dictionaries with None values serve as ordered sets.
+    for key, value in pairs:
+        group = groups.setdefault(key, dict())
+
+        if value is not None:
+            group[value] = None
+
+    return {key: list(group) for key, group in groups.items()}
+
+
+def generate_chunk(generate, rows):
+    return list(generate(rows))
+
+
+def write_batches(session, queries, num_jobs, batch_size, max_pending=None, stage=None):
+    """Write queries to the database in concurrent batches.
+
+    Batches are pulled lazily from the queries, so any iterable or generator may be supplied. At most
+    max_pending batches are generated ahead of the writer threads, which bounds memory use regardless of
+    the number of queries. Progress is reported against the total if the queries are sized, otherwise as a
+    running count.
+
+    The batches are written from a thread pool, or from an asyncio event loop through write_batches_async if
+    the engine writer option is "asyncio".
+
+    If the adaptive writer option is set, num_jobs and batch_size are only starting points: each call gets
+    its own AdaptiveController, which tunes them within the configured bounds from the commit latency and
+    failures of each batch.
+
+    A failed batch is retried up to max_retries times with exponential backoff. If it still fails and a
+    dead_letter_path is configured, the batch is bisected so that its valid queries are committed, each half
+    being retried in the same way, and each query that fails on its own is appended to the dead-letter file
+    with the error. Without a dead_letter_path the error is raised. A summary is printed once all batches
+    are written.
+
+    If a shard writer option (index, count) is set, only the queries hashed to that shard are written, unless
+    generate_queries already kept the rows of the shard.
+
+    The queries generated and committed, failed batches, commit latencies and time spent generating and
+    writing are recorded in the metrics of the running stage. If the stage is profiled, so are the writer
+    threads.
+
+    If a compiler writer option is set, the queries are written to its files instead of the database.
+
+    If a checkpoint writer option is set, committed batches of named stages are recorded in it, and stages
+    or queries it already holds as committed are skipped. If a transaction_budget semaphore is set, it is
+    held for each transaction, capping the transactions open across concurrent calls. Once the interrupted
+    event is set, no further batches are started, those in flight are completed and KeyboardInterrupt is
+    raised.
+
+    :param session: The TypeDB data session
+    :param queries: An iterable of insert queries
+    :param num_jobs: The number of writer threads
+    :param batch_size: The number of queries per transaction
+    :param max_pending: The maximum number of batches queued or in flight (default: 2 * num_jobs)
+    :param stage: The name of the stage, printed as "Inserting <stage>:" and used to key checkpoints
+    """
+    if writer_options["compiler"] is not None:
+        compile_queries(queries, stage)
+        return
+
+    if writer_options["engine"] == "asyncio":
+        asyncio.run(write_batches_async(session, queries, num_jobs, batch_size, max_pending, stage))
+        return
+
+    key, queries = begin_stage(stage, queries)
+
+    if key is SKIPPED:
+        return
+
+    total = len(queries) if isinstance(queries, Sized) else None
+    func, batches, pool_size, max_pending, summary = prepare_write(
+        session, queries, num_jobs, batch_size, max_pending, key, stage,
+    )
+
+    with ThreadPool(pool_size) as pool, summary.metrics.phase("write"):
+        with tqdm(total=total, unit="queries", disable=writer_options["progress_queue"] is not None) as pbar:
+            for n in imap_bounded(pool, func, batches, max_pending):
+                report_progress(pbar, n)
+
+    end_stage(key, summary)
+
+
+async def write_batches_async(session, queries, num_jobs, batch_size, max_pending=None, stage=None):
+    """Write queries to the database in concurrent batches from an asyncio event loop.
+
+    Behaves as write_batches, but keeps the batches in flight as tasks on the running event loop. The
+    blocking TypeDB client calls are run in a ThreadPoolExecutor managed by this call, and no more than
+    max_pending batches are in flight at once.
+
+    :param session: The TypeDB data session
+    :param queries: An iterable of insert queries
+    :param num_jobs: The number of writer threads
+    :param batch_size: The number of queries per transaction
+    :param max_pending: The maximum number of batches in flight (default: 2 * num_jobs)
+    :param stage: The name of the stage, printed as "Inserting <stage>:" and used to key checkpoints
+    """
+    key, queries = begin_stage(stage, queries)
+
+    if key is SKIPPED:
+        return
+
+    total = len(queries) if isinstance(queries, Sized) else None
+    func, batches, pool_size, max_pending, summary = prepare_write(
+        session, queries, num_jobs, batch_size, max_pending, key, stage,
+    )
+
+    with ThreadPoolExecutor(pool_size) as executor, summary.metrics.phase("write"):
+        with tqdm(total=total, unit="queries", disable=writer_options["progress_queue"] is not None) as pbar:
+            async for n in amap_bounded(executor, func, batches, max_pending):
+                report_progress(pbar, n)
+
+    end_stage(key, summary)
+
+
+def compile_queries(queries, stage):
+    """Write queries to the files of the compiler writer option instead of the database.
+
+    :param queries: An iterable of insert queries
+    :param stage: The name of the stage, or None
+    """
+    scheduled_stage = getattr(stage_context, "name", None)
+
+    if scheduled_stage is not None:
+        print("[{}] Compiling {}:".format(scheduled_stage, stage))
+    else:
+        print("Compiling {}:".format(stage))
+
+    stage_metrics = get_stage_metrics(stage)
+
+    if isinstance(queries, Sized):
+        stage_metrics.add("queries_generated", len(queries))
+    else:
+        queries = stage_metrics.iter_generated(queries)
+
+    with tqdm(unit="queries", disable=writer_options["progress_queue"] is not None) as pbar:
+        count = writer_options["compiler"].write(
+            scheduled_stage or stage or "queries", stage, queries, partial(report_progress, pbar),
+        )
+
+    print("  Compiled {} queries.".format(count))
+
+
+SKIPPED = object()
+interrupted = threading.Event()
+stage_context = threading.local()
+
+
+def begin_stage(stage, queries):
+    """Announce a stage and apply its checkpoint and shard.
+
+    :param stage: The name of the stage, or None
+    :param queries: An iterable of insert queries
+    :return: A tuple of the checkpoint key of the stage, None if it is not checkpointed or SKIPPED if it
+        is already complete, and the queries still to be written
+    """
+    scheduled_stage = getattr(stage_context, "name", None)
+
+    if stage is not None and scheduled_stage is not None:
+        print("[{}] Inserting {}:".format(scheduled_stage, stage))
+        stage = "{}/{}".format(scheduled_stage, stage)
+    elif stage is not None:
+        print("Inserting {}:".format(stage))
+
+    stage_metrics = get_stage_metrics(stage)
+    partitioned = isinstance(queries, PartitionedQueries)
+
+    if isinstance(queries, Sized):
+        stage_metrics.add("queries_generated", len(queries))
+    else:
+        queries = stage_metrics.iter_generated(queries)
+
+    if writer_options["shard"] is not None and not partitioned:
+        queries = iter_shard(queries, *writer_options["shard"])
+
+    checkpoint = writer_options["checkpoint"]
+
+    if checkpoint is None or stage is None:
+        return None, queries
+
+    key = checkpoint.stage_key(stage)
+
+    if checkpoint.is_complete(key):
+        print("  Already committed, skipping.")
+        return SKIPPED, queries
+
+    if key in checkpoint.committed:
+        print("  Resuming after {} committed queries.".format(len(checkpoint.committed[key])))
+        queries = checkpoint.filter(key, queries)
+
+    return key, queries
+
+
+def iter_shard(queries, index, count):
+    """Select the queries of one shard by hash partitioning.
+
+    :param queries: An iterable of insert queries
+    :param index: The index of the shard
+    :param count: The number of shards
+    :return: A generator of the queries whose digest falls in the shard
+    """
+    for query in queries:
+        if int(query_digest(query), 16) % count == index:
+            yield query
+
+
+def get_stage_metrics(stage=None):
+    """Return the metrics of the running scheduled stage, or of the named stage outside the scheduler."""
+    return metrics.get_stage_metrics(getattr(stage_context, "name", None) or stage or "unnamed")
+
+
+def report_progress(pbar, n):
+    pbar.update(n)
+    progress_queue = writer_options["progress_queue"]
+
+    if progress_queue is not None:
+        progress_queue.put(("progress", getattr(stage_context, "name", None), n))
+
+
+def handle_interrupt(signum, frame):
+    """Stop starting new batches on the first interrupt, and stop immediately on the second."""
+    if interrupted.is_set():
+        raise KeyboardInterrupt
+
+    interrupted.set()
+    print("\nInterrupted: finishing batches in flight. Interrupt again to stop immediately.")
+
+
+def end_stage(key, summary):
+    summary.report()
+
+    if interrupted.is_set():
+        raise KeyboardInterrupt
+
+    if key is not None:
+        writer_options["checkpoint"].record_complete(key)
+
+
+def prepare_write(session, queries, num_jobs, batch_size, max_pending, key=None, stage=None):
+    """Set up the batch function, batches and concurrency limits shared by the writer engines.
+
+    :return: A tuple of the function writing a batch, the batches, the number of writer threads, the
+        maximum number of pending batches and the WriteSummary of the stage
+    """
+    stage_metrics = get_stage_metrics(stage)
+    summary = WriteSummary(writer_options["dead_letter_path"], stage_metrics)
+    write = partial(write_batch_measured, partial(write_batch, session), stage_metrics)
+
+    if writer_options["adaptive"]:
+        controller = AdaptiveController(
+            batch_size=batch_size,
+            num_jobs=num_jobs,
+            min_batch_size=writer_options["min_commit_batch"],
+            max_batch_size=writer_options["max_commit_batch"],
+            max_jobs=writer_options["max_num_jobs"],
+            target_latency=writer_options["target_commit_latency"],
+        )
+
+        pool_size = controller.max_jobs
+        write = partial(write_batch_observed, write, controller)
+        batches = iter_batches(queries, lambda: controller.batch_size)
+        max_pending = partial(getattr, controller, "num_jobs")
+    else:
+        pool_size = num_jobs
+        batches = iter_batches(queries, batch_size)
+
+        if max_pending is None:
+            max_pending = 2 * num_jobs
+
+    if key is not None:
+        write = partial(write_batch_checkpointed, write, writer_options["checkpoint"], key)
+
+    func = partial(write_batch_with_recovery, write, summary)
+    profiler = get_profiler()
 
-            for n in pool.imap_unordered(partial(write_batch, session), iter_batches(queries, batch_size), chunk_size):
-                pbar.update(n)
+    if profiler is not None:
+        func = partial(profiler.call, func)
+
+    return func, batches, pool_size, max_pending, summary
+
+
+def imap_bounded(pool, func, iterable, max_pending):
+    """Apply a function to an iterable in a pool, holding back the iterable while the pool is saturated.
+
+    Unlike Pool.imap_unordered, which consumes the whole iterable up front, items are only drawn once one
+    of the max_pending queued or running tasks has completed. Results are yielded in completion order and
+    the first exception raised by a task is re-raised. No further items are drawn once the interrupted
+    event is set.
+
+    :param pool: A multiprocessing or thread pool
+    :param func: The function to apply
+    :param iterable: The items to apply the function to
+    :param max_pending: The maximum number of tasks queued or running at once, or a callable returning it
+    :return: A generator of results in completion order
+    """
+    completed = Queue()
+    pending = 0
+
+    def on_success(result):
+        completed.put((True, result))
+
+    def on_error(error):
+        completed.put((False, error))
+
+    def next_result():
+        success, value = completed.get()
+
+        if not success:
+            raise value
+
+        return value
+
+    for item in iterable:
+        while pending > 0 and pending >= (max_pending() if callable(max_pending) else max_pending):
+            yield next_result()
+            pending -= 1
+
+        if interrupted.is_set():
+            break
+
+        pool.apply_async(func, (item,), callback=on_success, error_callback=on_error)
+        pending += 1
+
+    while pending > 0:
+        yield next_result()
+        pending -= 1
+
+
+async def amap_bounded(executor, func, iterable, max_pending):
+    """Apply a function to an iterable in an executor from the running event loop, in bounded flight.
+
+    The asyncio counterpart of imap_bounded: items are only drawn once fewer than max_pending calls are in
+    flight, results are yielded in completion order and the first exception raised is re-raised.
+
+    :param executor: A concurrent.futures executor
+    :param func: The function to apply
+    :param iterable: The items to apply the function to
+    :param max_pending: The maximum number of calls in flight at once, or a callable returning it
+    :return: An asynchronous generator of results in completion order
+    """
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    try:
+        for item in iterable:
+            while len(pending) > 0 and len(pending) >= (max_pending() if callable(max_pending) else max_pending):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for future in done:
+                    yield future.result()
+
+            if interrupted.is_set():
+                break
+
+            pending.add(loop.run_in_executor(executor, func, item))
+
+        while len(pending) > 0:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
 
 
 def iter_batches(a, batch_size):
-    for i in range(0, len(a), batch_size):
-        yield a[i:i+batch_size]
+    if isinstance(a, Sequence) and not callable(batch_size):
+        for i in range(0, len(a), batch_size):
+            yield a[i:i + batch_size]
+    else:
+        iterator = iter(a)
+
+        while batch := list(islice(iterator, batch_size() if callable(batch_size) else batch_size)):
+            yield batch
 
 
 def write_batch(session, queries):
-    with session.transaction(TransactionType.WRITE) as transaction:
-        for query in queries:
-            transaction.query().insert(query)
+    budget = writer_options["transaction_budget"]
 
-        transaction.commit()
+    with budget if budget is not None else nullcontext():
+        with session.transaction(TransactionType.WRITE) as transaction:
+            for query in queries:
+                transaction.query().insert(query)
+
+            transaction.commit()
 
     return len(queries)
+
+
+def write_batch_measured(write, stage_metrics, queries):
+    start = time.perf_counter()
+
+    try:
+        n = write(queries)
+    except Exception:
+        stage_metrics.add("batches_failed")
+        raise
+
+    stage_metrics.add_latency(time.perf_counter() - start)
+    return n
+
+
+def write_batch_observed(write, controller, queries):
+    start = time.perf_counter()
+
+    try:
+        n = write(queries)
+    except Exception:
+        controller.observe(len(queries), time.perf_counter() - start, False)
+        raise
+
+    controller.observe(len(queries), time.perf_counter() - start, True)
+    return n
+
+
+def write_batch_checkpointed(write, checkpoint, key, queries):
+    n = write(queries)
+    checkpoint.record_batch(key, queries)
+    return n
+
+
+def write_batch_with_recovery(write, summary, queries):
+    """Write a batch, retrying with backoff and then bisecting it to isolate failing queries.
+
+    :param write: A function writing and committing a batch of queries
+    :param summary: The WriteSummary of the stage
+    :param queries: The batch of queries
+    :return: The number of queries processed, whether committed or dead-lettered
+    """
+    try:
+        write_batch_with_retries(write, summary, queries)
+    except Exception as error:
+        if summary.dead_letter_path is None:
+            raise
+
+        bisect_batch(write, summary, queries, error)
+
+    return len(queries)
+
+
+def write_batch_with_retries(write, summary, queries):
+    """Write a batch, retrying it up to max_retries times with exponential backoff, and raise the last error."""
+    retries = writer_options["max_retries"]
+
+    for attempt in range(retries + 1):
+        try:
+            summary.add_committed(write(queries))
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+
+            summary.add_retry()
+            time.sleep(writer_options["retry_backoff"] * 2 ** attempt)
+
+
+def bisect_batch(write, summary, queries, error):
+    if len(queries) == 1:
+        summary.add_dead_letter(queries[0], error)
+        return
+
+    middle = len(queries) // 2
+
+    # Each half is retried as the whole batch was, so that a transient conflict does not dead-letter its queries.
+    for half in (queries[:middle], queries[middle:]):
+        try:
+            write_batch_with_retries(write, summary, half)
+        except Exception as half_error:
+            bisect_batch(write, summary, half, half_error)
+
+
+class WriteSummary:
+    """Collect the outcome of the batches written in one call to write_batches."""
+
+    def __init__(self, dead_letter_path=None, stage_metrics=None):
+        self.dead_letter_path = dead_letter_path
+        self.metrics = stage_metrics if stage_metrics is not None else metrics.StageMetrics(None)
+        self.committed = 0
+        self.retries = 0
+        self.dead_letters = 0
+        self._lock = threading.Lock()
+
+    def add_committed(self, n):
+        with self._lock:
+            self.committed += n
+
+        self.metrics.add("queries_committed", n)
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def add_dead_letter(self, query, error):
+        record = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "query": query,
+            "error": str(error),
+        }
+
+        with self._lock:
+            self.dead_letters += 1
+
+            with open(self.dead_letter_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
+
+    def report(self):
+        print("  Committed {} queries ({} retried batches, {} failed queries).".format(
+            self.committed, self.retries, self.dead_letters,
+        ))
+
+        if self.dead_letters > 0:
+            print("  Failed queries written to: {}".format(self.dead_letter_path))
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the loader microbenchmarks."""
+from pathlib import Path
+
+from benchmarks import cases  # noqa: F401 pylint: disable=unused-import
+from benchmarks.harness import benchmarks, compare, measure, read_baseline, write_baseline
+
+
+def test_benchmarks_run(tmp_path: Path):
+    """Test that every benchmark runs on a small input and its results round-trip through a baseline.
+
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    results = {bench.name: measure(bench, 50, str(tmp_path), repeat=1, min_time=0) for bench in benchmarks}
+    assert "util.read_tsv[zip]" in results
+    assert "queries.uniprot.proteins" in results
+
+    for result in results.values():
+        assert result["rows"] > 0
+        assert result["rows_per_second"] > 0
+        assert result["peak_allocated_bytes"] >= 0
+
+    baseline_path = tmp_path / "baseline.json"
+    write_baseline(str(baseline_path), results, 50)
+    baseline = read_baseline(str(baseline_path))
+    speed, allocations = compare(results["util.clean_string"], baseline["results"]["util.clean_string"])
+    assert speed == 1
+    assert allocations == 1
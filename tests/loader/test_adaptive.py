@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the adaptive writer controller."""
+from loader.adaptive import AdaptiveController
+
+
+def _controller() -> AdaptiveController:
+    return AdaptiveController(
+        batch_size=50,
+        num_jobs=4,
+        min_batch_size=10,
+        max_batch_size=100,
+        max_jobs=8,
+        target_latency=1.0,
+    )
+
+
+def test_additive_increase():
+    """Test that fast commits grow the batch size and concurrency up to their bounds."""
+    controller = _controller()
+
+    for _ in range(1000):
+        controller.observe(controller.batch_size, 0.1, True)
+
+    assert controller.batch_size == 100
+    assert controller.num_jobs == 8
+
+
+def test_multiplicative_decrease():
+    """Test that slow commits halve the batch size and failures also halve concurrency."""
+    controller = _controller()
+    controller.observe(50, 5.0, True)
+    assert (controller.batch_size, controller.num_jobs) == (25, 4)
+
+    # A stale, larger batch finishing slowly does not shrink the batch size again.
+    controller.observe(10, 5.0, True)
+    assert controller.batch_size == 25
+
+    controller.observe(25, 0.1, False)
+    assert (controller.batch_size, controller.num_jobs) == (12, 2)
+
+    for _ in range(10):
+        controller.observe(10, 0.1, False)
+
+    assert (controller.batch_size, controller.num_jobs) == (10, 1)
+    assert controller.error_rate == 11 / 13
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the cache of parsed datasets."""
+from pathlib import Path
+
+import pandas
+import pytest
+
+from loader import metrics
+from loader.cache import cached_dataset, read_dataset, write_dataset
+from loader.rows import record_type
+from loader.util import iter_tsv, writer_options
+
+
+def test_round_trip(tmp_path: Path):
+    """Test that records and dataframes are read back as written.
+
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    records = [
+        {"id": "1", "name": "α", "note": None},
+        {"id": "2", "name": "β", "note": "α"},
+        {"id": "3", "name": "α", "note": ""},
+    ]
+
+    write_dataset(str(tmp_path / "records"), records)
+    assert read_dataset(str(tmp_path / "records")) == records
+
+    record = record_type(("id", "name", "note"), categorical=("name",))
+    write_dataset(str(tmp_path / "compact"), [record.from_dict(data) for data in records])
+    compact = read_dataset(str(tmp_path / "compact"))
+    assert compact == records
+    assert all(type(data) is record for data in compact)
+
+    write_dataset(str(tmp_path / "empty"), list())
+    assert read_dataset(str(tmp_path / "empty")) == list()
+
+    frame = pandas.DataFrame({"pmid": ["7", "9"], "score": [0.5, 1.5]}, index=[3, 8])
+    write_dataset(str(tmp_path / "frame"), frame)
+    pandas.testing.assert_frame_equal(read_dataset(str(tmp_path / "frame")), frame, check_index_type=False)
+
+    with pytest.raises(TypeError):
+        write_dataset(str(tmp_path / "invalid"), [{"id": 1}])
+
+
+def test_cached_dataset(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that a dataset is parsed once per source file content and row limit.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    source = tmp_path / "rows.tsv"
+    source.write_text("id\tname\n1\ta\n2\tb\n")
+    calls = list()
+
+    @cached_dataset(str(source))
+    def get_dataset(max_rows):
+        calls.append(max_rows)
+        return list(iter_tsv(str(source), max_rows=max_rows))
+
+    assert get_dataset(None) == [{"id": "1", "name": "a"}, {"id": "2", "name": "b"}]
+    assert len(calls) == 1
+
+    monkeypatch.setitem(writer_options, "dataset_cache", str(tmp_path / "cache"))
+    metrics.reset()
+    assert get_dataset(None) == get_dataset(None) == [{"id": "1", "name": "a"}, {"id": "2", "name": "b"}]
+    assert len(calls) == 2
+    assert metrics.get_stage_metrics("unnamed").rows_cached == 2
+
+    assert get_dataset(1) == [{"id": "1", "name": "a"}]
+    source.write_text("id\tname\n3\tc\n")
+    assert get_dataset(None) == [{"id": "3", "name": "c"}]
+    assert len(calls) == 4
+    assert len(list((tmp_path / "cache").iterdir())) == 3
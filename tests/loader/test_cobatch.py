@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for inserting entities in the same queries as the relations depending on them."""
+import pytest
+
+from loader.hpa.hpa_loader import (
+    group_gene_tissue,
+    insert_grouped_gene_tissue,
+    iter_gene_tissue_queries,
+    iter_grouped_gene_tissue_queries,
+)
+from loader.keys import index
+from loader.uniprot.uniprot_loader import (
+    get_protein_record,
+    group_transcript_proteins,
+    iter_protein_queries,
+    iter_transcript_protein_queries,
+    iter_transcript_queries,
+)
+from loader.util import writer_options
+
+
+class _Value:
+    def __init__(self, value):
+        self.value = value
+
+    def get_value(self):
+        return self.value
+
+
+class _Answer:
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, variable):
+        return _Value(self.values[variable])
+
+
+class _Transaction:
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def query(self):
+        return self
+
+    def match(self, query):
+        if "isa tissue-composition;" in query:
+            return iter([_Answer({"k1": tissue, "k2": cell}) for tissue, cell in self.session.compositions])
+
+        return iter([_Answer({"k": gene}) for gene in self.session.genes if "$k > " not in query])
+
+    def insert(self, query):
+        self.session.committed.append(query)
+
+    def commit(self):
+        pass
+
+
+class _Session:
+    def __init__(self, genes, compositions):
+        self.genes = genes
+        self.compositions = compositions
+        self.committed = list()
+
+    def transaction(self, transaction_type):
+        return _Transaction(self)
+
+
+def _protein(uniprot_id, gene_symbol, transcripts):
+    return get_protein_record({
+        "uniprot-id": uniprot_id,
+        "uniprot-entry-name": uniprot_id + "_HUMAN",
+        "protein-name": "Protein {} (Alternative {})".format(uniprot_id, uniprot_id),
+        "gene-symbol": gene_symbol,
+        "organism": "Homo sapiens (Human)",
+        "function-description": "",
+        "ensembl-transcript": "".join("{} [{}-1];".format(transcript, uniprot_id) for transcript in transcripts),
+        "entrez-id": "",
+    })
+
+
+def _insert_clause(query):
+    return query[query.index("insert"):]
+
+
+def test_group_transcript_proteins():
+    """Test that proteins sharing transcripts, directly or transitively, are grouped in dataset order."""
+    dataset = [
+        _protein("P1", "A", ["T1"]),
+        _protein("P2", "B", ["T2"]),
+        _protein("P3", "C", ["T3"]),
+        _protein("P4", "A B", ["T2", "T4"]),
+        _protein("P5", "", []),
+        _protein("P6", "A", ["T4", "T1"]),
+    ]
+
+    groups = group_transcript_proteins(dataset)
+    assert [[data["uniprot-id"] for data in group] for group in groups] == [["P1", "P2", "P4", "P6"], ["P3"], ["P5"]]
+
+
+def test_transcript_protein_queries():
+    """Test that co-batched queries insert every transcript once and only match organisms and genes."""
+    dataset = [
+        _protein("P1", "A", ["T1"]),
+        _protein("P2", "B", ["T1", "T2"]),
+        _protein("P3", "", ["T3"]),
+        _protein("P4", "A", []),
+    ]
+
+    queries = list(iter_transcript_protein_queries(group_transcript_proteins(dataset)))
+    separate = list(iter_transcript_queries(dataset)) + list(iter_protein_queries(dataset))
+    assert len(queries) == 3
+
+    for statement in ("isa transcript,", "isa transcription;", "isa translation;", "isa organism-protein-association;"):
+        assert sum(_insert_clause(query).count(statement) for query in queries) == sum(
+            _insert_clause(query).count(statement) for query in separate
+        )
+
+    assert all("ensembl-transcript-id" not in query.split("insert")[0] for query in queries)
+    assert queries[0].count("isa organism, has organism-name") == 1
+    assert queries[0].count("(transcribed-gene: $g0, synthesised-transcript: $t0)") == 1
+    assert queries[0].count("(transcribed-gene: $g1, synthesised-transcript: $t0)") == 1
+
+
+def test_grouped_gene_tissue_queries():
+    """Test that the expressions of each gene are inserted by one query matching each tissue and cell once."""
+    dataset = [
+        {
+            "gene-symbol": gene,
+            "tissue": tissue,
+            "cell-type": cell,
+            "expression-value": "High",
+            "expression-value-reliability": "Approved",
+        }
+        for gene in ("A", "B")
+        for tissue, cell in (("liver", "hepatocytes"), ("liver", "bile duct cells"), ("lung", "macrophages"))
+    ]
+
+    queries = list(iter_grouped_gene_tissue_queries(group_gene_tissue(dataset)))
+    assert len(queries) == 2
+    assert all(query.count("isa tissue,") == 2 for query in queries)
+    assert all(query.count("isa tissue-composition;") == 3 for query in queries)
+    assert all(query.count("isa gene,") == 1 for query in queries)
+
+    assert sum(query.count("isa cell-expression,") for query in queries) == len(
+        list(iter_gene_tissue_queries(dataset))
+    )
+
+
+def test_grouped_gene_tissue_missing_composition(monkeypatch: pytest.MonkeyPatch):
+    """Test that a missing tissue composition only drops its rows from the groups, and that expressions are
+    inserted per row if the compositions in the database cannot be read.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    dataset = [
+        {
+            "gene-symbol": "A",
+            "tissue": tissue,
+            "cell-type": cell,
+            "expression-value": "High",
+            "expression-value-reliability": "Approved",
+        }
+        for tissue, cell in (("liver", "hepatocytes"), ("liver", "bile duct cells"), ("lung", "macrophages"))
+    ]
+
+    session = _Session(["A"], [("liver", "hepatocytes"), ("lung", "macrophages")])
+    monkeypatch.setitem(writer_options, "preload_keys", True)
+    index.clear()
+    insert_grouped_gene_tissue(dataset, session, 1, 10)
+    index.clear()
+
+    assert len(session.committed) == 1
+    assert session.committed[0].count("isa cell-expression,") == 2
+    assert "bile duct cells" not in session.committed[0]
+
+    session = _Session(["A"], [])
+    monkeypatch.setitem(writer_options, "preload_keys", False)
+    insert_grouped_gene_tissue(dataset, session, 1, 10)
+    assert session.committed == list(iter_gene_tissue_queries(dataset))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for compiling loads to files and replaying them."""
+from pathlib import Path
+
+import pytest
+from typedb.client import SessionType
+
+from loader.compiler import Compiler, escape_query, get_replay_stages, unescape_query
+from loader.coronavirus.coronavirus_loader import get_coronavirus_stages
+from loader.fake import FakeClient
+from loader.scheduler import run_stages
+from loader.util import writer_options
+
+
+def test_escape_query():
+    """Test that queries with line breaks and backslashes round-trip through a single line."""
+    query = "insert $x isa thing, has text \"a\\\\n\nb\\\"c\r\";"
+    assert "\n" not in escape_query(query)
+    assert unescape_query(escape_query(query)) == query
+
+
+def test_compile_and_replay(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that replaying a compiled load commits the same queries as loading the datasets.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    monkeypatch.chdir(Path(__file__).parents[2])
+    monkeypatch.setitem(writer_options, "transaction_budget", None)
+    stages = get_coronavirus_stages(None)
+
+    with FakeClient(sample_size=10000) as client:
+        with client.session("direct", SessionType.DATA) as session:
+            run_stages(stages, session, num_jobs=2, batch_size=20)
+
+        direct = client.databases().get("direct").sample
+
+    compiler = Compiler(tmp_path, stages, file_queries=40)
+    monkeypatch.setitem(writer_options, "compiler", compiler)
+
+    with pytest.raises(ValueError):
+        get_replay_stages(tmp_path)
+
+    run_stages(get_coronavirus_stages(None), None, num_jobs=2, batch_size=20)
+    compiler.close()
+    monkeypatch.setitem(writer_options, "compiler", None)
+    assert len(list(tmp_path.glob("coronavirus.host-proteins/*.tql.gz"))) > 1
+
+    replay_stages = get_replay_stages(tmp_path)
+    assert [stage.name for stage in replay_stages] == [stage.name for stage in stages]
+    assert replay_stages[1].consumes == stages[1].consumes
+
+    with FakeClient(sample_size=10000) as client:
+        with client.session("replayed", SessionType.DATA) as session:
+            run_stages(replay_stages, session, num_jobs=2, batch_size=20)
+
+        database = client.databases().get("replayed")
+        assert database.committed == len(direct) < 10000
+        assert sorted(database.sample) == sorted(direct)
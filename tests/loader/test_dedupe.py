@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the client-side deduplication of inserts."""
+from pathlib import Path
+
+import pandas
+import pytest
+
+from loader import metrics
+from loader.checkpoint import Checkpoint
+from loader.coronavirus.coronavirus_loader import (
+    get_extra_roleplayer_names, insert_extra_roleplayers, iter_extra_roleplayer_queries
+)
+from loader.dedupe import filter_new, registry
+from loader.disgenet.disgenet_loader import iter_association_queries
+from loader.semmed.load import get_gene_relation_key
+from loader.uniprot.uniprot_loader import get_organism_names, insert_organisms, iter_organism_queries
+from loader.util import writer_options
+
+
+@pytest.fixture
+def dedupe(monkeypatch: pytest.MonkeyPatch):
+    """Enable deduplication with an empty registry and fresh metrics.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    monkeypatch.setitem(writer_options, "dedupe", True)
+    registry.clear()
+    metrics.reset()
+    yield registry
+    registry.clear()
+
+
+def test_filter_new_disabled():
+    """Test that rows are returned unchanged unless deduplication is enabled."""
+    rows = ["a", "a", "b"]
+    assert filter_new("test", rows) is rows
+
+
+def test_filter_new(dedupe):
+    """Test that rows with registered keys are dropped and counted, across calls and row containers.
+
+    :param dedupe: The dedupe fixture.
+    """
+    dedupe.add("pair", ("A", "X"))
+    rows = [{"a": "A", "b": "X"}, {"a": "A", "b": "Y"}, {"a": "A", "b": "Y"}]
+    assert filter_new("pair", rows, lambda row: (row["a"], row["b"])) == [rows[1]]
+
+    frame = pandas.DataFrame({"a": ["A", "B", "B"], "b": ["Y", "Y", "Y"]})
+    new_frame = filter_new("pair", frame, lambda row: (row.a, row.b))
+    assert list(new_frame["a"]) == ["B"]
+    assert metrics.get_stage_metrics("unnamed").rows_deduplicated == 4
+
+
+def test_shared_namespaces(dedupe):
+    """Test that entities inserted by one loader are not inserted again by another.
+
+    :param dedupe: The dedupe fixture.
+    """
+    uniprot_dataset = [{"organism": "Homo sapiens (Human)"}, {"organism": "Mus musculus (Mouse)"}]
+    virus_dataset = [{"host": "Homo sapiens (Human)", "location-discovered": "China"}]
+
+    assert len(list(iter_organism_queries(filter_new("organism", get_organism_names(uniprot_dataset))))) == 2
+    organism_names, country_names = get_extra_roleplayer_names(virus_dataset)
+    organism_names = filter_new("organism", organism_names)
+    country_names = filter_new("country", country_names)
+    assert list(iter_extra_roleplayer_queries(organism_names, country_names, guard=False)) == [
+        "insert $c isa country, has country-name \"China\";",
+    ]
+
+
+def test_skipped_stages_register_keys(dedupe, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that the keys of stages a resumed load skips are registered, so that later stages do not insert them.
+
+    :param dedupe: The dedupe fixture.
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    checkpoint = Checkpoint(tmp_path / "checkpoint.jsonl")
+    checkpoint.record_complete(checkpoint.stage_key("organisms"))
+    checkpoint.record_complete(checkpoint.stage_key("organisms and countries"))
+    checkpoint.close()
+
+    checkpoint = Checkpoint(tmp_path / "checkpoint.jsonl", resume=True)
+    monkeypatch.setitem(writer_options, "checkpoint", checkpoint)
+    insert_organisms([{"organism": "Homo sapiens (Human)"}], None, 1, 10)
+    insert_extra_roleplayers([{"host": "Sus scrofa (Pig)", "location-discovered": "China"}], None, 1, 10)
+    checkpoint.close()
+
+    assert dedupe.contains("organism", "Homo sapiens (Human)")
+    assert dedupe.contains("organism", "Sus scrofa (Pig)")
+    assert dedupe.contains("country", "China")
+
+
+def test_semmed_relation_key():
+    """Test that negated predicates do not share keys with the relations they negate."""
+    row = pandas.DataFrame({"subject": ["A"], "object": ["B"], "predicate": ["INHIBITS"]})
+    negated = pandas.DataFrame({"subject": ["A"], "object": ["B"], "predicate": ["NEG_INHIBITS"]})
+    assert get_gene_relation_key(next(row.itertuples())) != get_gene_relation_key(next(negated.itertuples()))
+
+
+def test_unguarded_queries():
+    """Test that disabling the existence checks removes the negated subqueries."""
+    dataset = [{"gene-symbol": "A", "disease-id": "C1", "disgenet-score": "0.5"}]
+    assert "not {" in next(iter_association_queries(dataset))
+    assert "not {" not in next(iter_association_queries(dataset, guard=False))
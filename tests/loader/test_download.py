@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the download manager, against a local HTTP server."""
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from loader.download import DownloadError, DownloadManager
+from loader.util import writer_options
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        content = self.server.files.get(self.path)
+
+        if content is None:
+            self.send_error(404)
+            return
+
+        etag = "\"{}\"".format(hashlib.sha256(content).hexdigest()[:8])
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        resume = self.headers.get("Range") is not None and self.headers.get("If-Range") in (None, etag)
+
+        if resume:
+            start = int(self.headers["Range"].split("=")[1].split("-")[0])
+
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(len(content)))
+                self.end_headers()
+                return
+
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Length", str(len(content) - start))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        # The first response of a file listed in cut is cut short, as if the connection dropped.
+        end = len(content) // 2 if self.server.cut.pop(self.path, False) else len(content)
+        self.wfile.write(content[start:end])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """Serve in-memory files over HTTP, recording each request.
+
+    :return: The server, with its files, cut and requests attributes
+    """
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    http_server.files = dict()
+    http_server.cut = dict()
+    http_server.requests = list()
+    http_server.url = "http://127.0.0.1:{}".format(http_server.server_address[1])
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield http_server
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def test_download(monkeypatch: pytest.MonkeyPatch, tmp_path: Path, server):
+    """Test that files are downloaded concurrently, resumed after an interruption and recorded in the manifest.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    :param server: The server fixture.
+    """
+    monkeypatch.setitem(writer_options, "retry_backoff", 0.0)
+    server.files = {"/a.tsv": b"a" * 100000, "/b.tsv": b"b" * 1000}
+    server.cut["/a.tsv"] = True
+    manager = DownloadManager(str(tmp_path / "manifest.json"), str(tmp_path / "store"))
+    directory = str(tmp_path / "data")
+
+    manager.prefetch([(server.url + "/a.tsv", directory), (server.url + "/b.tsv", directory)])
+    manager.wait()
+    assert (tmp_path / "data" / "a.tsv").read_bytes() == server.files["/a.tsv"]
+    assert (tmp_path / "data" / "b.tsv").read_bytes() == server.files["/b.tsv"]
+    assert ("/a.tsv", "bytes=50000-") in server.requests
+    assert not (tmp_path / "data" / "a.tsv.part").exists()
+
+    manifest = json.loads((tmp_path / "manifest.json").read_text(encoding="utf-8"))
+    entry = manifest[str(tmp_path / "data" / "a.tsv")]
+    assert entry["size"] == 100000
+    assert entry["sha256"] == hashlib.sha256(server.files["/a.tsv"]).hexdigest()
+
+    # A new manager trusts files matching the manifest, and downloads modified ones again.
+    server.requests.clear()
+    (tmp_path / "data" / "b.tsv").write_bytes(b"c" * 1000)
+    manager = DownloadManager(str(tmp_path / "manifest.json"), str(tmp_path / "store"))
+    assert manager.get(server.url + "/a.tsv", directory) == str(tmp_path / "data" / "a.tsv")
+    manager.get(server.url + "/b.tsv", directory)
+    assert server.requests == [("/b.tsv", None)]
+    assert (tmp_path / "data" / "b.tsv").read_bytes() == server.files["/b.tsv"]
+
+
+def test_download_restarts_unvalidated_files(tmp_path: Path, server):
+    """Test that files without a manifest entry or partial files without validators are downloaded whole, and
+    that missing files raise a DownloadError.
+
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    :param server: The server fixture.
+    """
+    server.files = {"/a.tsv": b"0123456789", "/b.tsv": b"abcdefghij"}
+    # The files changed on the server since these were started, which a resumed download would splice.
+    (tmp_path / "a.tsv").write_bytes(b"ABCDE")
+    (tmp_path / "b.tsv.part").write_bytes(b"ABCDE")
+    (tmp_path / "b.tsv.part.json").write_text(json.dumps({"etag": None, "last_modified": None}))
+    manager = DownloadManager(str(tmp_path / "manifest.json"), str(tmp_path / "store"))
+
+    manager.get(server.url + "/a.tsv", str(tmp_path))
+    manager.get(server.url + "/b.tsv", str(tmp_path))
+    assert (tmp_path / "a.tsv").read_bytes() == b"0123456789"
+    assert (tmp_path / "b.tsv").read_bytes() == b"abcdefghij"
+    assert server.requests == [("/a.tsv", None), ("/b.tsv", None)]
+
+    with pytest.raises(DownloadError):
+        manager.get(server.url + "/missing.tsv", str(tmp_path))
+
+
+def test_refresh(monkeypatch: pytest.MonkeyPatch, tmp_path: Path, server):
+    """Test that refreshed sources cost one request if unchanged, and are stored as new snapshots if changed.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    :param server: The server fixture.
+    """
+    monkeypatch.setitem(writer_options, "refresh_sources", True)
+    server.files = {"/a.tsv": b"version 1"}
+    path = tmp_path / "a.tsv"
+    url = server.url + "/a.tsv"
+
+    def get():
+        return DownloadManager(str(tmp_path / "manifest.json"), str(tmp_path / "store")).get(url, str(tmp_path))
+
+    get()
+    first = hashlib.sha256(b"version 1").hexdigest()
+    assert path.stat().st_ino == (tmp_path / "store" / first).stat().st_ino
+
+    server.requests.clear()
+    get()
+    assert len(server.requests) == 1
+    assert path.read_bytes() == b"version 1"
+
+    server.files["/a.tsv"] = b"version 2"
+    get()
+    assert path.read_bytes() == b"version 2"
+    assert (tmp_path / "store" / first).read_bytes() == b"version 1"
+
+    entry = json.loads((tmp_path / "manifest.json").read_text(encoding="utf-8"))[str(path)]
+    assert entry["sha256"] == hashlib.sha256(b"version 2").hexdigest()
+    assert entry["etag"] is not None
+    assert [snapshot["sha256"] for snapshot in entry["history"]] == [first]
+
+    # An unreachable source keeps its snapshot.
+    del server.files["/a.tsv"]
+    assert get() == str(path)
+    assert path.read_bytes() == b"version 2"
+
+
+def test_resume_changed_file(tmp_path: Path, server):
+    """Test that a partial file started from another version of the file is downloaded again whole.
+
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    :param server: The server fixture.
+    """
+    server.files = {"/a.tsv": b"version 2"}
+    (tmp_path / "a.tsv.part").write_bytes(b"vers")
+    (tmp_path / "a.tsv.part.json").write_text(json.dumps({"etag": "\"old\"", "last_modified": None}))
+
+    DownloadManager(str(tmp_path / "manifest.json"), str(tmp_path / "store")).get(server.url + "/a.tsv", str(tmp_path))
+    assert (tmp_path / "a.tsv").read_bytes() == b"version 2"
+    assert not (tmp_path / "a.tsv.part.json").exists()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the in-memory TypeDB stand-in."""
+from pathlib import Path
+
+import pytest
+from typedb.client import SessionType, TransactionType
+from typedb.common.exception import TypeDBClientException
+
+from loader.coronavirus.coronavirus_loader import get_coronavirus_stages
+from loader.fake import FakeClient
+from loader.runner import get_client
+from loader.scheduler import run_stages
+from loader.util import write_batches, writer_options
+from schema.initialise import initialise_database
+
+
+def test_fake_client_records_commits():
+    """Test that committed queries are recorded and injected failures discard their transaction."""
+    with FakeClient(failure_rate=1.0) as client:
+        with client.session("test", SessionType.DATA) as session:
+            with session.transaction(TransactionType.WRITE) as transaction:
+                transaction.query().insert("insert $x isa thing;")
+
+                with pytest.raises(TypeDBClientException):
+                    transaction.commit()
+
+        database = client.databases().get("test")
+        assert database.queries == 1
+        assert database.committed == 0
+        assert database.failures == 1
+
+
+def test_fake_client_write_batches(monkeypatch: pytest.MonkeyPatch):
+    """Test that write_batches retries conflicting commits until every query is committed.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    monkeypatch.setitem(writer_options, "max_retries", 20)
+    monkeypatch.setitem(writer_options, "retry_backoff", 0)
+    queries = ["insert $x isa thing, has id {};".format(i) for i in range(500)]
+
+    with FakeClient(commit_latency=0.001, conflict_rate=0.3, seed=0, sample_size=len(queries)) as client:
+        with client.session("test", SessionType.DATA) as session:
+            write_batches(session, queries, num_jobs=4, batch_size=10)
+
+        database = client.databases().get("test")
+        assert database.conflicts > 0
+        assert database.committed == len(queries)
+        assert sorted(database.sample) == sorted(queries)
+
+
+def test_fake_client_load(monkeypatch: pytest.MonkeyPatch):
+    """Test a load of the bundled coronavirus dataset from schema initialisation to the last stage.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    monkeypatch.chdir(Path(__file__).parents[2])
+    monkeypatch.setitem(writer_options, "transaction_budget", None)
+
+    with FakeClient(sample_size=100) as client:
+        initialise_database(client, "test", False)
+
+        with client.session("test", SessionType.DATA) as session:
+            run_stages(get_coronavirus_stages(None), session, num_jobs=4, batch_size=50, max_parallel=2)
+
+        database = client.databases().get("test")
+        assert len(database.schema) == 1
+        assert database.committed > len(database.sample) == 100
+        assert any(" isa virus, " in query for query in database.sample)
+
+
+def test_fake_client_rejects_preloaded_keys():
+    """Test that keys cannot be preloaded from the fake server, which would drop every row."""
+    with pytest.raises(ValueError):
+        get_client({"server_type": "FAKE", "address": None, "preload_keys": True})
+
+
+def test_fake_client_sample_size():
+    """Test that the sample size option of the loader reaches the databases of the fake server."""
+    with get_client({"server_type": "FAKE", "address": None, "fake_sample_size": 1}) as client:
+        with client.session("test", SessionType.DATA) as session:
+            write_batches(session, ["insert $x isa thing;", "insert $y isa thing;"], num_jobs=1, batch_size=1)
+
+        database = client.databases().get("test")
+        assert database.committed == 2
+        assert database.sample == ["insert $x isa thing;"]
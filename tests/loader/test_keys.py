@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for preloading database keys."""
+import re
+
+import pandas
+import pytest
+
+from loader import metrics
+from loader.keys import filter_known, index, read_keys
+from loader.util import writer_options
+
+
+class _Value:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, variable):
+        return self
+
+    def get_value(self):
+        return self.value
+
+
+class _Transaction:
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def query(self):
+        return self
+
+    def match(self, query):
+        self.session.queries.append(query)
+        attribute = re.search(r"has ([\w-]+) \$k;", query).group(1)
+        after = re.search(r"\$k > \"(.*?)\";", query)
+        limit = int(re.search(r"limit (\d+);", query).group(1))
+        values = sorted(value for value in self.session.keys[attribute] if after is None or value > after.group(1))
+        return iter([_Value(value) for value in values[:limit]])
+
+
+class _Session:
+    def __init__(self, keys):
+        self.keys = keys
+        self.queries = list()
+
+    def transaction(self, transaction_type):
+        return _Transaction(self)
+
+
+@pytest.fixture
+def preload(monkeypatch: pytest.MonkeyPatch):
+    """Enable key preloading with an empty index and fresh metrics.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    monkeypatch.setitem(writer_options, "preload_keys", True)
+    monkeypatch.setitem(writer_options, "key_page_size", 2)
+    index.clear()
+    metrics.reset()
+    yield
+    index.clear()
+
+
+def test_read_keys():
+    """Test that keys are read in pages, each starting after the last key of the previous one."""
+    session = _Session({"entrez-id": ["5", "1", "3", "2", "4"]})
+    assert read_keys(session, "entrez-id", 2) == {"1", "2", "3", "4", "5"}
+    assert len(session.queries) == 3
+    assert session.queries[0] == "match $o isa gene, has entrez-id $k; get $k; sort $k; limit 2;"
+    assert "$k > \"4\";" in session.queries[2]
+
+
+def test_filter_known(preload):
+    """Test that rows referring to missing keys are dropped and counted, and keys are read once.
+
+    :param preload: The preload fixture.
+    """
+    session = _Session({"primary-gene-symbol": ["A", "B", "C"], "umls-id": ["C1"]})
+    keys = [("primary-gene-symbol", lambda row: row["gene"]), ("umls-id", lambda row: row["disease"] or None)]
+    rows = [
+        {"gene": "A", "disease": "C1"},
+        {"gene": "D", "disease": "C1"},
+        {"gene": "B", "disease": "C2"},
+        {"gene": "C", "disease": ""},
+    ]
+
+    assert filter_known(session, rows, keys) == [rows[0], rows[3]]
+    queries = len(session.queries)
+
+    frame = pandas.DataFrame({"subject": ["A", "A", "E"], "object": ["B", "F", "C"]})
+    known = filter_known(session, frame, [
+        ("primary-gene-symbol", lambda row: row.subject),
+        ("primary-gene-symbol", lambda row: row.object),
+    ])
+
+    assert list(known["object"]) == ["B"]
+    assert len(session.queries) == queries
+    assert metrics.get_stage_metrics("unnamed").rows_unmatched == 4
+
+
+def test_filter_known_disabled():
+    """Test that rows are kept unchanged unless keys are preloaded, or without a session."""
+    rows = [{"gene": "A"}]
+    assert filter_known(_Session({}), rows, [("primary-gene-symbol", lambda row: row["gene"])]) is rows
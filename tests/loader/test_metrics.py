@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the load metrics."""
+import json
+from pathlib import Path
+
+import pytest
+
+from loader import metrics
+from loader.scheduler import Stage, run_stages
+from loader.util import read_tsv, write_batches, writer_options
+
+
+class _Session:
+    def transaction(self, transaction_type):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def query(self):
+        return self
+
+    def insert(self, query):
+        if query == "fail":
+            raise RuntimeError("Invalid query: {}".format(query))
+
+    def commit(self):
+        pass
+
+
+def test_percentile():
+    """Test the nearest-rank percentiles."""
+    values = list(range(1, 101))
+    assert metrics.percentile(values, 50) == 50
+    assert metrics.percentile(values, 99) == 99
+    assert metrics.percentile([3.0], 95) == 3.0
+    assert metrics.percentile([], 50) is None
+
+
+def test_stage_metrics_report(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that a scheduled stage reports its rows, queries, batches and phases.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    monkeypatch.setitem(writer_options, "dead_letter_path", str(tmp_path / "dead_letter.jsonl"))
+    monkeypatch.setitem(writer_options, "transaction_budget", None)
+    metrics.reset()
+
+    dataset_path = tmp_path / "genes.tsv"
+    dataset_path.write_text("symbol\n" + "".join("gene{}\n".format(i) for i in range(100)), encoding="utf-8")
+
+    def iter_gene_queries(rows):
+        for row in rows:
+            yield "insert $g isa gene, has symbol \"{}\";".format(row["symbol"])
+
+        yield "fail"
+
+    def load_genes(session, num_jobs, batch_size):
+        write_batches(session, iter_gene_queries(read_tsv(str(dataset_path))), num_jobs, batch_size, stage="genes")
+
+    run_stages([Stage("test.genes", load_genes)], _Session(), num_jobs=2, batch_size=10)
+    report = metrics.get_report()["stages"]["test.genes"]
+
+    assert report["rows_parsed"] == 100
+    assert report["queries_generated"] == 101
+    assert report["queries_committed"] == 100
+    assert report["batches_failed"] == 1
+    assert report["commit_latency_seconds"]["p50"] is not None
+    assert set(report["phase_seconds"]) == {"parse", "generation", "write"}
+    assert report["wall_seconds"] >= sum(report["phase_seconds"].values())
+    assert report["peak_rss_bytes"] > 0
+
+    metrics_path = tmp_path / "metrics.json"
+    prometheus_path = tmp_path / "metrics.prom"
+    metrics.write_report(metrics_path)
+    metrics.write_prometheus(prometheus_path)
+
+    assert json.loads(metrics_path.read_text(encoding="utf-8"))["stages"]["test.genes"]["rows_parsed"] == 100
+    assert "typedb_bio_queries_committed_total{stage=\"test.genes\"} 100" in prometheus_path.read_text(encoding="utf-8")
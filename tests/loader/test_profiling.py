@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the stage profiler."""
+import pstats
+import time
+from pathlib import Path
+
+import pytest
+
+from loader.scheduler import Stage, run_stages
+from loader.util import write_batches, writer_options
+
+
+class _Session:
+    def transaction(self, transaction_type):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def query(self):
+        return self
+
+    def insert(self, query):
+        time.sleep(0.001)
+
+    def commit(self):
+        pass
+
+
+def test_profile_stage(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that a profiled stage writes pstats and collapsed stacks covering its writer threads.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    monkeypatch.setitem(writer_options, "profile", str(tmp_path))
+    monkeypatch.setitem(writer_options, "transaction_budget", None)
+
+    def load_genes(session, num_jobs, batch_size):
+        write_batches(session, ("insert {};".format(i) for i in range(200)), num_jobs, batch_size, stage="genes")
+
+    run_stages([Stage("test.genes", load_genes)], _Session(), num_jobs=4, batch_size=10)
+
+    stats = pstats.Stats(str(tmp_path / "test.genes.pstats"))
+    functions = {function for _, _, function in stats.stats}
+    assert "load_genes" in functions
+    assert "write_batch" in functions
+
+    collapsed = (tmp_path / "test.genes.collapsed").read_text(encoding="utf-8").splitlines()
+    assert len(collapsed) > 0
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed)
+    assert any("write_batch" in line for line in collapsed)
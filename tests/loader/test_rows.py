@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for compact records."""
+import pickle
+
+import pytest
+
+from loader.rows import record_type
+
+
+FIELDS = ("gene-symbol", "tissue", "level")
+
+
+def test_record():
+    """Test that records are read and compared like dictionaries."""
+    record = record_type(FIELDS, categorical=("tissue",))
+    row = record.from_dict({"gene-symbol": "A", "tissue": "liver", "level": None, "extra": "ignored"})
+
+    assert row["gene-symbol"] == "A"
+    assert row == {"gene-symbol": "A", "tissue": "liver", "level": None}
+    assert dict(row, level="High") == {"gene-symbol": "A", "tissue": "liver", "level": "High"}
+    assert list(row.keys()) == list(FIELDS)
+    assert "tissue" in row and "extra" not in row
+    assert row.get("extra") is None
+    assert record_type(FIELDS, categorical=("tissue",)) is record
+
+    with pytest.raises(KeyError):
+        row["extra"]
+
+    with pytest.raises(TypeError):
+        record("A", "liver")
+
+    with pytest.raises(AttributeError):
+        row.extra = "value"
+
+
+def test_record_interning():
+    """Test that the values of categorical fields are shared between rows, and records survive pickling."""
+    record = record_type(FIELDS, categorical=("tissue",))
+    first = record("A", "".join(["liv", "er"]), "".join(["Hi", "gh"]))
+    second = record("B", "".join(["li", "ver"]), "".join(["Hig", "h"]))
+
+    assert first["tissue"] is second["tissue"]
+    assert first["level"] is not second["level"]
+
+    copy = pickle.loads(pickle.dumps(first))
+    assert copy == first
+    assert type(copy) is record
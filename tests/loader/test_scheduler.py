@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the loader stage scheduler."""
+import threading
+import time
+from multiprocessing import Array
+
+import pytest
+
+from loader import scheduler
+from loader.scheduler import SharedTracker, Stage, get_dependencies, run_stages
+from loader.util import writer_options
+
+
+def test_get_dependencies():
+    """Test that stages wait for earlier producers of the types they consume or produce."""
+    stages = [
+        Stage("genes", None, produces=["gene"]),
+        Stage("drugs", None, produces=["drug"]),
+        Stage("interactions", None, produces=["interaction"], consumes=["gene", "drug"]),
+        Stage("more-genes", None, produces=["gene"]),
+        Stage("pathways", None, produces=["pathway"]),
+    ]
+
+    assert get_dependencies(stages) == {
+        "genes": set(),
+        "drugs": set(),
+        "interactions": {"genes", "drugs"},
+        "more-genes": {"genes"},
+        "pathways": set(),
+    }
+
+
+def test_run_stages(monkeypatch: pytest.MonkeyPatch):
+    """Test that independent stages run concurrently and dependent stages run after their inputs.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    monkeypatch.setitem(writer_options, "transaction_budget", None)
+    events = list()
+    lock = threading.Lock()
+    barrier = threading.Barrier(2, timeout=5)
+
+    def run(name, wait=False):
+        def _run(session, num_jobs, batch_size):
+            if wait:
+                # Only passes if both independent stages are running at the same time.
+                barrier.wait()
+
+            time.sleep(0.01)
+
+            with lock:
+                events.append(name)
+
+        return _run
+
+    stages = [
+        Stage("genes", run("genes", wait=True), produces=["gene"]),
+        Stage("drugs", run("drugs", wait=True), produces=["drug"]),
+        Stage("interactions", run("interactions"), produces=["interaction"], consumes=["gene", "drug"]),
+    ]
+
+    run_stages(stages, None, num_jobs=4, batch_size=10, max_parallel=4)
+    assert events[-1] == "interactions"
+    assert sorted(events[:2]) == ["drugs", "genes"]
+
+
+def test_run_stages_error(monkeypatch: pytest.MonkeyPatch):
+    """Test that a failing stage stops its dependents and is raised.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    monkeypatch.setitem(writer_options, "transaction_budget", None)
+    ran = list()
+
+    def fail(session, num_jobs, batch_size):
+        raise RuntimeError("Stage failed")
+
+    stages = [
+        Stage("genes", fail, produces=["gene"]),
+        Stage("interactions", lambda *args: ran.append("interactions"), consumes=["gene"]),
+    ]
+
+    with pytest.raises(RuntimeError):
+        run_stages(stages, None, num_jobs=4, batch_size=10, max_parallel=2)
+
+    assert ran == []
+
+
+def test_run_stages_shared_tracker(monkeypatch: pytest.MonkeyPatch):
+    """Test that sharded runs only start a stage once its dependencies are complete in every shard.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    monkeypatch.setitem(writer_options, "transaction_budget", None)
+    monkeypatch.setattr(scheduler, "POLL_INTERVAL", 0.01)
+    names = ["genes", "interactions"]
+    counts = Array("i", len(names))
+    events = list()
+    lock = threading.Lock()
+
+    def run(name, shard, delay):
+        def _run(session, num_jobs, batch_size):
+            time.sleep(delay)
+
+            with lock:
+                events.append((name, shard))
+
+        return _run
+
+    def run_shard(shard, delay):
+        stages = [
+            Stage("genes", run("genes", shard, delay), produces=["gene"]),
+            Stage("interactions", run("interactions", shard, 0), consumes=["gene"]),
+        ]
+
+        run_stages(stages, None, num_jobs=4, batch_size=10, tracker=SharedTracker(names, counts, 2))
+
+    threads = [threading.Thread(target=run_shard, args=(shard, 0.05 * shard)) for shard in range(2)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert events[:2] == [("genes", 0), ("genes", 1)]
+    assert sorted(events[2:]) == [("interactions", 0), ("interactions", 1)]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for parsing UniProt entries."""
+import pytest
+
+from loader.uniprot.uniprot_loader import extract_protein_names, get_protein_record, iter_gene_queries
+
+
+@pytest.mark.parametrize("entry, names", [
+    ("", {"alternative-names": []}),
+    ("Protein kinase C", {"alternative-names": [], "primary-name": "Protein kinase C"}),
+    (
+        "Hemoglobin subunit alpha (Alpha-globin) (Hemoglobin alpha chain)",
+        {"alternative-names": ["Alpha-globin", "Hemoglobin alpha chain"], "primary-name": "Hemoglobin subunit alpha"},
+    ),
+    (
+        "Tumor necrosis factor (Cachectin) (TNF-alpha) [Cleaved into: Tumor necrosis factor, membrane form "
+        "(N-terminal fragment) (NTF); Intracellular domain 1 (ICD1)]",
+        {"alternative-names": ["Cachectin", "TNF-alpha"], "primary-name": "Tumor necrosis factor"},
+    ),
+    (
+        "[Pyruvate dehydrogenase (acetyl-transferring)] kinase isozyme 1, mitochondrial (EC 2.7.11.2) (PDK p48)",
+        {
+            "alternative-names": ["EC 2.7.11.2", "PDK p48"],
+            "primary-name": "[Pyruvate dehydrogenase (acetyl-transferring)] kinase isozyme 1, mitochondrial",
+        },
+    ),
+    ("Insulin [Cleaved into: Insulin B chain; Insulin A chain]", {"alternative-names": [], "primary-name": "Insulin"}),
+    (
+        "Protein (EC 1.1.1.1) [Includes: Domain A (DA)] extra",
+        {"alternative-names": ["EC 1.1.1.1"], "primary-name": "Protein [Includes: Domain A (DA)] extra"},
+    ),
+    ("(Alt only)", {"alternative-names": ["Alt only"], "primary-name": ""}),
+    ("Unbalanced (name", {"alternative-names": [], "primary-name": "Unbalanced (name"}),
+    ("Unbalanced name)", {"alternative-names": [], "primary-name": "Unbalanced name)"}),
+    ("Nested ((a) b) name (c (d))", {"alternative-names": ["c (d)"], "primary-name": "Nested ((a) b) name"}),
+])
+def test_extract_protein_names(entry, names):
+    """Test that protein names are split as by the previous character-by-character parser.
+
+    :param entry: The protein names of a UniProt entry.
+    :type entry: str
+    :param names: The expected primary and alternative names.
+    :type names: dict
+    """
+    assert extract_protein_names(entry) == names
+
+
+def test_extract_protein_names_long_entry():
+    """Test that long entries are parsed in linear time."""
+    entry = "Protein " * 50000 + "(Alternative)" * 50000
+    names = extract_protein_names(entry)
+    assert names["primary-name"] == entry[:entry.index("(")].strip()
+    assert len(names["alternative-names"]) == 50000
+
+
+def test_get_protein_record():
+    """Test that a record holds the parsed gene, transcripts and names of a protein, and is used by the queries."""
+    data = {
+        "uniprot-id": "P1",
+        "uniprot-entry-name": "P1_HUMAN",
+        "protein-name": "Protein 1 (Alternative 1)",
+        "gene-symbol": "A B",
+        "organism": "Homo sapiens (Human)",
+        "function-description": "",
+        "ensembl-transcript": "T1 [P1-1];T2;",
+        "entrez-id": "1;2",
+    }
+
+    record = get_protein_record(data)
+    assert record["gene-symbol"] == "A"
+    assert record["alternative-gene-symbols"] == ["B"]
+    assert record["entrez-ids"] == ["1", "2"]
+    assert record["transcripts"] == ["T1", "T2"]
+    assert record["primary-name"] == "Protein 1"
+    assert record["alternative-names"] == ["Alternative 1"]
+
+    missing = get_protein_record(dict(data, **{"gene-symbol": "", "protein-name": "", "ensembl-transcript": ""}))
+    assert missing["gene-symbol"] is None
+    assert missing["primary-name"] is None
+    assert missing["transcripts"] == []
+
+    assert list(iter_gene_queries([record, record, missing])) == [
+        "insert $g isa gene, has primary-gene-symbol \"A\", has alternative-gene-symbol \"B\", "
+        "has entrez-id \"1\", has entrez-id \"2\";"
+    ]
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""Module containing the tests for the loader utilities."""
+import asyncio
+import gzip
+import json
+import threading
+from pathlib import Path
+from zipfile import ZipFile
+
+import pytest
+
+from loader import metrics
+from loader.checkpoint import Checkpoint
+from loader.util import (
+    generate_queries, group_by, iter_batches, iter_tsv, write_batches, write_batches_async, writer_options
+)
+
+
+class _Transaction:
+    def __init__(self, session):
+        self.session = session
+        self.queries = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def query(self):
+        return self
+
+    def insert(self, query):
+        if query == "fail":
+            raise RuntimeError("Invalid query: {}".format(query))
+
+        self.queries.append(query)
+
+    def commit(self):
+        with self.session.lock:
+            if "conflict" in self.queries and self.session.conflicts > 0:
+                self.session.conflicts -= 1
+                raise RuntimeError("Conflict")
+
+            self.session.committed.extend(self.queries)
+
+
+class _Session:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.committed = list()
+        self.conflicts = 0
+
+    def transaction(self, transaction_type):
+        return _Transaction(self)
+
+
+def test_iter_batches():
+    """Test that iter_batches() splits sequences and generators alike."""
+    assert list(iter_batches([1, 2, 3, 4, 5], 2)) == [[1, 2], [3, 4], [5]]
+    assert list(iter_batches((i for i in range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_batches(iter(()), 2)) == []
+
+
+def test_group_by():
+    """Test that values are grouped in order of first occurrence, deduplicated unless unique is false."""
+    pairs = [("b", 1), ("a", None), ("b", 2), ("b", 1), ("c", None), ("a", 3)]
+    assert group_by(pairs) == {"b": [1, 2], "a": [3], "c": []}
+    assert list(group_by(pairs)) == ["b", "a", "c"]
+    assert group_by(pairs, unique=False) == {"b": [1, 2, 1], "a": [3], "c": []}
+    rows = [{"gene": "x"}, {"gene": "y"}, {"gene": "x"}]
+    assert group_by(((row["gene"], row) for row in rows), unique=False) == {"x": [rows[0], rows[2]], "y": [rows[1]]}
+
+
+def test_iter_tsv(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that iter_tsv() reads plain, gzip and zip files lazily, stopping at the row limit.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    monkeypatch.setattr("loader.util.PARSE_CHUNK_ROWS", 4)
+    text = "id\t name \n" + "".join("{}\t name {} \n".format(i, i) for i in range(10))
+    (tmp_path / "rows.tsv").write_text(text)
+
+    with gzip.open(tmp_path / "rows.tsv.gz", "wt") as file:
+        file.write(text)
+
+    with ZipFile(tmp_path / "rows.tsv.zip", "w") as file:
+        file.writestr("rows.tsv", text)
+        file.writestr("other.tsv", "a\tb\n")
+
+    for path, archive in (("rows.tsv", None), ("rows.tsv.gz", "gz"), ("rows.tsv.zip", "zip")):
+        metrics.reset()
+        rows = list(iter_tsv(str(tmp_path / path), archive=archive, max_rows=6))
+        assert rows == [{"id": str(i), "name": "name {}".format(i)} for i in range(6)]
+        assert metrics.get_stage_metrics("unnamed").rows_parsed == 6
+        assert len(list(iter_tsv(str(tmp_path / path), archive=archive))) == 10
+
+    rows = iter_tsv(str(tmp_path / "rows.tsv.zip"), header=False, archive="zip", member="other.tsv")
+    assert list(rows) == [["a", "b"]]
+    assert list(iter_tsv(str(tmp_path / "rows.tsv"), max_rows=0)) == []
+
+
+def test_iter_tsv_projection(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that iter_tsv() keeps only the requested columns and applies the row limit after the predicate.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    monkeypatch.setattr("loader.util.PARSE_CHUNK_ROWS", 4)
+    text = "id\tname\tkind\n" + "".join("{}\tname {}\t{}\n".format(i, i, "ab"[i % 2]) for i in range(10))
+    (tmp_path / "rows.tsv").write_text(text)
+    path = str(tmp_path / "rows.tsv")
+
+    rows = iter_tsv(path, columns=["name", "id"], predicate=lambda row: row["id"] != "2", max_rows=3)
+    assert list(rows) == [{"name": "name 0", "id": "0"}, {"name": "name 1", "id": "1"}, {"name": "name 3", "id": "3"}]
+
+    rows = iter_tsv(path, header=False, columns=[2, 0], predicate=lambda row: row[0] == "b")
+    assert list(rows) == [["b", str(i)] for i in range(1, 10, 2)]
+
+    with pytest.raises(ValueError):
+        list(iter_tsv(path, columns=["missing"]))
+
+
+def test_iter_tsv_parallel(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that parsing in worker processes yields the rows of a sequential parse, despite quoted line breaks.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    monkeypatch.setattr("loader.util.PARSE_CHUNK_BYTES", 64)
+    rows = ["{}\t name {} \t{}\r\n".format(i, i, "note" if i != 40 else "\"line\r\nbreak\"") for i in range(60)]
+    (tmp_path / "quoted.tsv").write_bytes("".join(["id\tname\tnote\r\n"] + rows).encode("utf-8"))
+    (tmp_path / "plain.tsv").write_bytes("".join(["id\tname\tnote\n"] + rows[:40]).encode("utf-8"))
+
+    for name, ordered, header, columns in (
+        ("quoted.tsv", True, True, None),
+        ("quoted.tsv", False, False, [2, 0]),
+        ("plain.tsv", True, True, ["name"]),
+    ):
+        path = str(tmp_path / name)
+        monkeypatch.setitem(writer_options, "parse_processes", 0)
+        expected = list(iter_tsv(path, header=header, columns=columns))
+        monkeypatch.setitem(writer_options, "parse_processes", 2)
+        assert list(iter_tsv(path, header=header, columns=columns, ordered=ordered)) == expected
+
+    rows = list(iter_tsv(str(tmp_path / "plain.tsv"), ordered=False))
+    assert sorted(int(row["id"]) for row in rows) == list(range(40))
+
+
+def test_write_batches_from_generator():
+    """Test that write_batches() consumes a generator lazily and commits every query."""
+    session = _Session()
+    generated = list()
+
+    def generate():
+        for i in range(1000):
+            generated.append(i)
+            # Generation may only run ahead of the commits by the pending batches.
+            assert len(generated) - len(session.committed) <= 4 * 10 + 10
+            yield "insert {};".format(i)
+
+    write_batches(session, generate(), num_jobs=2, batch_size=10, max_pending=4)
+    assert sorted(session.committed) == sorted("insert {};".format(i) for i in range(1000))
+
+
+def test_write_batches_raises():
+    """Test that a failing batch stops write_batches()."""
+    with pytest.raises(RuntimeError):
+        write_batches(_Session(), ["insert 1;", "fail"], num_jobs=2, batch_size=1)
+
+
+def test_write_batches_adaptive(monkeypatch: pytest.MonkeyPatch):
+    """Test that write_batches() commits every query in adaptive mode.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    monkeypatch.setitem(writer_options, "adaptive", True)
+    session = _Session()
+    write_batches(session, ("insert {};".format(i) for i in range(1000)), num_jobs=2, batch_size=5)
+    assert sorted(session.committed) == sorted("insert {};".format(i) for i in range(1000))
+
+
+def test_write_batches_dead_letters(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that write_batches() commits the valid queries of a failing batch and dead-letters the rest.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    dead_letter_path = tmp_path / "dead_letter.jsonl"
+    monkeypatch.setitem(writer_options, "dead_letter_path", dead_letter_path)
+    monkeypatch.setitem(writer_options, "max_retries", 1)
+    monkeypatch.setitem(writer_options, "retry_backoff", 0.0)
+    queries = ["insert {};".format(i) for i in range(100)]
+    queries[17] = "fail"
+    queries[63] = "fail"
+
+    session = _Session()
+    write_batches(session, queries, num_jobs=4, batch_size=10)
+    assert sorted(session.committed) == sorted(query for query in queries if query != "fail")
+
+    with open(dead_letter_path, "r", encoding="utf-8") as file:
+        records = [json.loads(line) for line in file]
+
+    assert [record["query"] for record in records] == ["fail", "fail"]
+    assert all(record["error"] == "Invalid query: fail" for record in records)
+
+    # A half failing with a transient conflict is retried instead of dead-lettered.
+    session = _Session()
+    session.conflicts = 1
+    write_batches(session, ["fail", "conflict"], num_jobs=1, batch_size=2)
+    assert session.committed == ["conflict"]
+
+    with open(dead_letter_path, "r", encoding="utf-8") as file:
+        assert len(file.readlines()) == 3
+
+
+def _iter_row_queries(rows):
+    for row in rows:
+        yield "insert {};".format(row)
+
+
+def test_generate_queries_in_processes(monkeypatch: pytest.MonkeyPatch):
+    """Test that generate_queries() yields the same queries in order whether or not processes are used.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    rows = list(range(2500))
+    expected = list(_iter_row_queries(rows))
+    assert list(generate_queries(_iter_row_queries, rows)) == expected
+
+    monkeypatch.setitem(writer_options, "generation_processes", 2)
+    monkeypatch.setitem(writer_options, "generation_chunk_size", 100)
+    assert list(generate_queries(_iter_row_queries, rows)) == expected
+
+
+def test_write_batches_asyncio(monkeypatch: pytest.MonkeyPatch):
+    """Test that the asyncio engine commits every query through both the sync and async APIs.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    monkeypatch.setitem(writer_options, "engine", "asyncio")
+    session = _Session()
+    write_batches(session, ("insert {};".format(i) for i in range(500)), num_jobs=4, batch_size=10)
+    asyncio.run(write_batches_async(session, ["insert {};".format(i) for i in range(500, 1000)], 4, 10))
+    assert sorted(session.committed) == sorted("insert {};".format(i) for i in range(1000))
+
+    with pytest.raises(RuntimeError):
+        write_batches(_Session(), ["insert 1;", "fail"], num_jobs=2, batch_size=1)
+
+
+def test_write_batches_resume(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """Test that a load resumed from a checkpoint commits each query exactly once.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    :param tmp_path: The pytest tmp_path fixture.
+    :type tmp_path: Path
+    """
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    queries = ["insert {};".format(i) for i in range(200)]
+    session = _Session()
+
+    checkpoint = Checkpoint(checkpoint_path)
+    monkeypatch.setitem(writer_options, "checkpoint", checkpoint)
+    write_batches(session, queries[:50], num_jobs=2, batch_size=10, stage="first")
+
+    with pytest.raises(RuntimeError):
+        write_batches(session, queries[50:150] + ["fail"] + queries[150:], num_jobs=1, batch_size=10, stage="second")
+
+    checkpoint.close()
+    assert len(session.committed) < 200
+
+    checkpoint = Checkpoint(checkpoint_path, resume=True)
+    monkeypatch.setitem(writer_options, "checkpoint", checkpoint)
+    write_batches(session, ["insert first;"], num_jobs=2, batch_size=10, stage="first")
+    write_batches(session, queries[50:], num_jobs=4, batch_size=7, stage="second")
+    checkpoint.close()
+    assert sorted(session.committed) == sorted(queries)
+
+    checkpoint = Checkpoint(checkpoint_path, resume=True)
+    assert checkpoint.is_complete(checkpoint.stage_key("first"))
+    assert checkpoint.is_complete(checkpoint.stage_key("second"))
+    checkpoint.close()
+
+
+def test_write_batches_shards(monkeypatch: pytest.MonkeyPatch):
+    """Test that the shards of a stage together commit each query exactly once.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    queries = ["insert {};".format(i) for i in range(300)]
+    sessions = [_Session() for _ in range(3)]
+
+    for index, session in enumerate(sessions):
+        monkeypatch.setitem(writer_options, "shard", (index, len(sessions)))
+        write_batches(session, iter(queries), num_jobs=2, batch_size=10)
+        assert 0 < len(session.committed) < len(queries)
+
+    assert sorted(query for session in sessions for query in session.committed) == sorted(queries)
+
+
+def _generate_pairs(rows):
+    for row in rows:
+        yield "insert {} {};".format(*sorted(row))
+
+
+def test_generate_queries_shards(monkeypatch: pytest.MonkeyPatch):
+    """Test that each shard only generates the queries of its rows, keeping rows with the same key together.
+
+    :param monkeypatch: The pytest monkeypatch fixture.
+    :type monkeypatch: pytest.MonkeyPatch
+    """
+    rows = [(i, i + 1) for i in range(100)] + [(i + 1, i) for i in range(100)]
+    generated = list()
+
+    for index in range(3):
+        monkeypatch.setitem(writer_options, "shard", (index, 3))
+        session = _Session()
+        write_batches(session, generate_queries(_generate_pairs, rows, key=frozenset), num_jobs=2, batch_size=10)
+        assert 0 < len(session.committed) < len(rows)
+        generated += session.committed
+
+    assert sorted(generated) == sorted(_generate_pairs(rows))